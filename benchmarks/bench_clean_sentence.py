@@ -0,0 +1,68 @@
+"""
+Compare `clean_sentence` with the per-character implementation it replaced.
+
+>>> python benchmarks/bench_clean_sentence.py --num-sentences 20000
+"""
+
+import argparse
+import random
+import time
+import unicodedata
+
+from ko_lm_dataformat.sentence_cleaner import _is_control, clean_sentence, clean_sentences
+
+
+def legacy_clean_sentence(sentence, remove_control=True):
+    sentence = unicodedata.normalize("NFC", sentence)
+
+    if remove_control:
+        output = []
+        for char in sentence:
+            if _is_control(char) or ord(char) == 0xFFFD:
+                continue
+            output.append(char)
+
+        sentence = "".join(output)
+
+    return " ".join(sentence.strip().split())
+
+
+def make_sentences(num_sentences, seed=42):
+    rng = random.Random(seed)
+    hangul = [chr(cp) for cp in range(0xAC00, 0xD7A4)]
+    sentences = []
+    for _ in range(num_sentences):
+        words = ["".join(rng.choices(hangul, k=rng.randint(1, 5))) for _ in range(rng.randint(5, 30))]
+        if rng.random() < 0.1:
+            words.append("\x00\u200b\t\ufffd")
+        sentences.append(" ".join(words) + ".")
+    return sentences
+
+
+def bench(name, fn, sentences):
+    start = time.perf_counter()
+    fn(sentences)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {elapsed:8.3f}s {len(sentences) / elapsed:12,.0f} sentences/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-sentences", type=int, default=20000)
+    parser.add_argument("--num-proc", type=int, default=4)
+    args = parser.parse_args()
+
+    sentences = make_sentences(args.num_sentences)
+    clean_sentence("워밍업")  # build the regex outside of the timing
+
+    legacy = bench("legacy clean_sentence", lambda x: [legacy_clean_sentence(s) for s in x], sentences)
+    fast = bench("clean_sentence", lambda x: [clean_sentence(s) for s in x], sentences)
+    bench(
+        f"clean_sentences(num_proc={args.num_proc})", lambda x: clean_sentences(x, num_proc=args.num_proc), sentences
+    )
+    print(f"speedup: {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Write and read throughput of the archives and the reader, per format and setting.
+
+A synthetic Korean corpus is generated once, then every case runs in its own process, so its peak RSS is its own.
+Results (MB/s of UTF-8 text, records/s, peak RSS) are printed and saved as JSON, to compare them across commits.
+
+>>> python benchmarks/bench_throughput.py --size-mb 64 --length-dist lognormal --output bench_throughput.json
+>>> python benchmarks/bench_throughput.py --cases write:jsonl read:jsonl read:dat --repeat 3
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from glob import glob
+
+import ko_lm_dataformat as kldf
+
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CORPUS_NAME = "corpus.jsonl"
+
+# name: (kind, format, settings)
+CASES = {
+    "write:jsonl": ("write", "jsonl", {}),
+    "write:jsonl+meta": ("write", "jsonl", {"meta": True}),
+    "write:jsonl+clean": ("write", "jsonl", {"clean": True}),
+    "write:jsonl+threads": ("write", "jsonl", {"compress_workers": 4}),
+    "write:jsonl+threads+meta+clean": ("write", "jsonl", {"compress_workers": 4, "meta": True, "clean": True}),
+    "write:dat": ("write", "dat", {}),
+    "write:json": ("write", "json", {}),
+    "read:jsonl": ("read", "jsonl", {}),
+    "read:jsonl+meta": ("read", "jsonl", {"get_meta": True}),
+    "read:jsonl+strict": ("read", "jsonl", {"strict_jsonl": True}),
+    "read:jsonl+threaded": ("read", "jsonl", {"num_proc": 1}),
+    "read:jsonl+num_proc4": ("read", "jsonl", {"num_proc": 4}),
+    "read:dat": ("read", "dat", {}),
+    "read:dat+num_proc4": ("read", "dat", {"num_proc": 4}),
+    "read:json": ("read", "json", {}),
+    "read:jsonl_tar": ("read", "jsonl_tar", {}),
+    "read:tar_gz": ("read", "tar_gz", {}),
+    "read:gz": ("read", "gz", {}),
+}
+
+
+def make_corpus(path, size_mb, length_dist="lognormal", mean_chars=500, seed=42):
+    """
+    Write a corpus of random Hangul words as jsonl, `{"text": ..., "meta": ...}` per line, until `size_mb` MB of text.
+
+    Args:
+        length_dist (str): Distribution of the number of characters per record: `fixed`, `uniform` (1 to 2x the mean)
+            or `lognormal` (long tail, like web documents)
+        mean_chars (int): Mean number of characters per record
+    """
+    rng = random.Random(seed)
+    syllables = [chr(cp) for cp in range(0xAC00, 0xD7A4)]
+    # a vocabulary, so the text compresses like natural language instead of random syllables
+    vocab = ["".join(rng.choices(syllables, k=rng.randint(1, 4))) for _ in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]  # zipf
+    sigma = 1.0
+
+    def num_chars():
+        if length_dist == "fixed":
+            return mean_chars
+        if length_dist == "uniform":
+            return rng.randint(1, 2 * mean_chars)
+        if length_dist == "lognormal":
+            return max(1, int(rng.lognormvariate(math.log(mean_chars) - sigma**2 / 2, sigma)))
+        raise ValueError(f"Unknown length distribution: {length_dist}")
+
+    num_records = 0
+    num_bytes = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while num_bytes < size_mb * 2**20:
+            target = num_chars()
+            words = []
+            length = 0
+            while length < target:
+                # about 3 characters per word, drawn in chunks
+                for word in rng.choices(vocab, weights, k=max(1, (target - length) // 3)):
+                    words.append(word)
+                    length += len(word) + 1
+            text = " ".join(words)[:target].strip() + "."
+            meta = {"id": num_records, "source": rng.choice(["news", "blog", "wiki"])}
+            f.write(json.dumps({"text": text, "meta": meta}, ensure_ascii=False) + "\n")
+            num_records += 1
+            num_bytes += len(text.encode("utf-8"))
+    return {"num_records": num_records, "num_bytes": num_bytes}
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def prepare_read_data(work_dir, corpus_path, max_shard_records):
+    """Write the corpus once in every readable format, `<work_dir>/read_<format>/`."""
+    docs = load_corpus(corpus_path)
+
+    archive = kldf.Archive(os.path.join(work_dir, "read_jsonl"), max_shard_records=max_shard_records)
+    for doc in docs:
+        archive.add_data(doc["text"], meta=doc["meta"])
+    archive.commit()
+    archive.close()
+
+    archive = kldf.DatArchive(os.path.join(work_dir, "read_dat"), max_shard_records=max_shard_records)
+    for doc in docs:
+        archive.add_data(doc["text"])
+    archive.commit()
+
+    archive = kldf.JSONArchive(os.path.join(work_dir, "read_json"), max_shard_records=max_shard_records)
+    for doc in docs:
+        archive.add_data(doc["text"])
+    archive.commit()
+
+    shards = sorted(glob(os.path.join(work_dir, "read_jsonl", "data_*.jsonl.zst")))
+    for fmt, fname, mode in (("jsonl_tar", "data.jsonl.zst.tar", "w"), ("tar_gz", "data.tar.gz", "w:gz")):
+        os.makedirs(os.path.join(work_dir, f"read_{fmt}"))
+        with tarfile.open(os.path.join(work_dir, f"read_{fmt}", fname), mode) as tar:
+            for shard in shards:
+                tar.add(shard, arcname=os.path.basename(shard))
+
+    # one document per line
+    os.makedirs(os.path.join(work_dir, "read_gz"))
+    with gzip.open(os.path.join(work_dir, "read_gz", "data.txt.gz"), "wt", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(doc["text"].replace("\n", " ") + "\n")
+
+
+def _vm_hwm_kb():
+    """Peak RSS of this process from /proc (Linux), which unlike `ru_maxrss` starts over at exec"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its finished children (the `num_proc` workers), in MB"""
+    if resource is None:
+        return None
+    # KB on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = _vm_hwm_kb()
+    if own is None:
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max(own, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit / 2**20
+
+
+def run_write(fmt, settings, work_dir, corpus_path, max_shard_records):
+    docs = load_corpus(corpus_path)
+    baseline_rss = peak_rss_mb()
+    out_dir = tempfile.mkdtemp(prefix="write_", dir=work_dir)
+
+    start = time.perf_counter()
+    if fmt == "jsonl":
+        archive = kldf.Archive(
+            out_dir, max_shard_records=max_shard_records, compress_workers=settings.get("compress_workers", 0)
+        )
+        meta = settings.get("meta", False)
+        clean = settings.get("clean", False)
+        for doc in docs:
+            archive.add_data(doc["text"], meta=doc["meta"] if meta else None, clean_sent=clean)
+        archive.commit()
+        archive.close()
+    elif fmt in ("dat", "json"):
+        archive_cls = kldf.DatArchive if fmt == "dat" else kldf.JSONArchive
+        archive = archive_cls(out_dir, max_shard_records=max_shard_records)
+        for doc in docs:
+            archive.add_data(doc["text"])
+        archive.commit()
+    else:
+        raise ValueError(f"Unknown write format: {fmt}")
+    elapsed = time.perf_counter() - start
+
+    num_compressed_bytes = sum(os.path.getsize(f) for f in glob(os.path.join(out_dir, "data_*.zst")))
+    shutil.rmtree(out_dir)
+    return {
+        "elapsed": elapsed,
+        "num_records": len(docs),
+        "num_compressed_bytes": num_compressed_bytes,
+        "baseline_rss_mb": baseline_rss,
+    }
+
+
+def run_read(fmt, settings, work_dir):
+    baseline_rss = peak_rss_mb()
+    reader = kldf.Reader(os.path.join(work_dir, f"read_{fmt}"), strict_jsonl=settings.get("strict_jsonl", False))
+
+    start = time.perf_counter()
+    num_records = 0
+    for _ in reader.stream_data(get_meta=settings.get("get_meta", False), num_proc=settings.get("num_proc", 0)):
+        num_records += 1
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "num_records": num_records, "baseline_rss_mb": baseline_rss}
+
+
+def run_case_in_subprocess(name, args):
+    """Run `name` in a fresh interpreter and return what it reports."""
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--run-case",
+        name,
+        "--work-dir",
+        args.work_dir,
+        "--max-shard-records",
+        str(args.max_shard_records),
+    ]
+    output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=32, help="MB of UTF-8 text in the corpus")
+    parser.add_argument("--length-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--mean-chars", type=int, default=500, help="Mean number of characters per record")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-shard-records", type=int, default=20000)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=1, help="Run every case this many times, keep the best")
+    parser.add_argument("--output", type=str, default=None, help="Save the results as JSON")
+    parser.add_argument("--work-dir", type=str, default=None, help="Defaults to a temporary directory")
+    parser.add_argument("--run-case", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        kind, fmt, settings = CASES[args.run_case]
+        if kind == "write":
+            result = run_write(
+                fmt, settings, args.work_dir, os.path.join(args.work_dir, CORPUS_NAME), args.max_shard_records
+            )
+        else:
+            result = run_read(fmt, settings, args.work_dir)
+        result["peak_rss_mb"] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    remove_work_dir = args.work_dir is None
+    args.work_dir = args.work_dir or tempfile.mkdtemp(prefix="kldf_bench_")
+    os.makedirs(args.work_dir, exist_ok=True)
+    try:
+        corpus = make_corpus(
+            os.path.join(args.work_dir, CORPUS_NAME), args.size_mb, args.length_dist, args.mean_chars, args.seed
+        )
+        if any(CASES[name][0] == "read" for name in args.cases):
+            prepare_read_data(args.work_dir, os.path.join(args.work_dir, CORPUS_NAME), args.max_shard_records)
+
+        results = []
+        print(f"{'case':<34} {'MB/s':>9} {'records/s':>12} {'peak RSS MB':>12}")
+        for name in args.cases:
+            runs = [run_case_in_subprocess(name, args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run["elapsed"])
+            if best["num_records"] != corpus["num_records"]:
+                raise RuntimeError(f"{name}: {best['num_records']} records instead of {corpus['num_records']}")
+
+            kind, fmt, settings = CASES[name]
+            result = {
+                "case": name,
+                "kind": kind,
+                "format": fmt,
+                "settings": settings,
+                **best,
+                "mb_per_sec": corpus["num_bytes"] / 2**20 / best["elapsed"],
+                "records_per_sec": corpus["num_records"] / best["elapsed"],
+                "peak_rss_mb": max(run["peak_rss_mb"] or 0 for run in runs) or None,
+            }
+            if "num_compressed_bytes" in best:
+                result["compression_ratio"] = corpus["num_bytes"] / best["num_compressed_bytes"]
+            results.append(result)
+            rss = f"{result['peak_rss_mb']:12.1f}" if result["peak_rss_mb"] is not None else f"{'-':>12}"
+            print(f"{name:<34} {result['mb_per_sec']:9.1f} {result['records_per_sec']:12,.0f} {rss}")
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    if args.output is not None:
+        report = {
+            "version": kldf.get_version(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus": {
+                "size_mb": args.size_mb,
+                "length_dist": args.length_dist,
+                "mean_chars": args.mean_chars,
+                "seed": args.seed,
+                **corpus,
+            },
+            "max_shard_records": args.max_shard_records,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 from .archive import Archive, DatArchive, JSONArchive
+from .cache import CachedSentenceCleaner, CachedSentenceSplitter
+from .dedup import ExactDeduplicator, MinHashDeduplicator
+from .meta_filter import MetaFilter
+from .metrics import Metrics
+from .packing import PackedDataset, pack_tokens
 from .reader import Reader
 from .sentence_splitter import KssV1SentenceSplitter
-from .utils import get_version, tarfile_reader
+from .utils import get_version, iter_tar_members, list_tar_members, tarfile_reader
 
 
 __version__ = get_version()
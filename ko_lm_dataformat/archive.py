@@ -1,22 +1,115 @@
 import os
+import threading
 import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 
 import ujson as json
 import zstandard
 
+from .dedup import DEDUP_STATE_NAME, Deduplicator, write_dedup_state
+from .manifest import ShardStats, count_chars, write_dir_manifest, write_manifest
+from .metrics import Metrics
 from .sentence_cleaner import clean_sentence
 from .sentence_splitter import SentenceSplitterBase
-from .utils import get_datetime_timestamp, get_version
+from .utils import (
+    DAT_FOOTER,
+    DAT_MAGIC,
+    INDEX_SUFFIX,
+    get_datetime_timestamp,
+    get_version,
+    to_zstd_dictionary,
+    train_zstd_dictionary,
+    write_frame_index,
+    write_uint64_array,
+    write_zstd_dictionary,
+)
 
 
 CURRENT_CHUNK_INCOMPLETE = "current_chunk_incomplete"
+BACKGROUND_BLOCK_BYTES = 1 << 20  # uncompressed size of a block compressed in the background (without frame_size)
+
+
+def get_chunk_path(out_dir: str) -> str:
+    """Unique path for a chunk that is still being written"""
+    # check whether the incomplete chunks exist
+    chunk_list = glob(os.path.join(out_dir, CURRENT_CHUNK_INCOMPLETE + "_*"))
+    # sort the names of chunks by numerical order
+    chunk_list = sorted(chunk_list, key=lambda name: int(name.split("_")[-1]))
+    # give a unique name of the current chunk
+    chunk_num = 0
+    if chunk_list and chunk_list[-1]:
+        chunk_num = int(chunk_list[-1].split("_")[-1]) + 1
+
+    return os.path.join(out_dir, f"{CURRENT_CHUNK_INCOMPLETE}_{chunk_num}")
+
+
+class _BackgroundShard:
+    """
+    Chunk file written by the background writer of `Archive`.
+
+    Only the writer thread touches it after creation, so blocks are written in the order they were submitted.
+    """
+
+    def __init__(self, chunk_path: str):
+        self.chunk_path = chunk_path
+        self.fh = open(chunk_path, "wb")  # create it now, so the next `get_chunk_path` doesn't reuse the name
+        self.frame_offsets = array("Q", [0])
+        self.compressed_bytes = 0
+
+    def write_block(self, future: Future, slots: threading.BoundedSemaphore, metrics: Optional[Metrics] = None):
+        try:
+            cdata = future.result()
+        finally:
+            slots.release()
+        start = time.perf_counter() if metrics is not None else 0.0
+        self.fh.write(cdata)
+        self.compressed_bytes += len(cdata)
+        self.frame_offsets.append(self.compressed_bytes)
+        if metrics is not None:
+            metrics.add_time("archive.write", time.perf_counter() - start)
+            metrics.count("archive.bytes_out", len(cdata))
+
+    def finish(
+        self,
+        fname: str,
+        frame_size: Optional[int],
+        record_cnt: int,
+        dictionary: Optional[zstandard.ZstdCompressionDict],
+        stats: Optional[ShardStats],
+    ):
+        self.fh.close()
+        os.rename(self.chunk_path, fname)
+        if frame_size is not None:
+            write_frame_index(fname + INDEX_SUFFIX, frame_size, record_cnt, self.frame_offsets)
+        if dictionary is not None:
+            write_zstd_dictionary(fname, dictionary)
+        if stats is not None:
+            write_manifest(fname, stats.to_manifest(fname, self.compressed_bytes))
 
 
 class Archive:
     def __init__(
-        self, out_dir: str, sentence_splitter: Optional[SentenceSplitterBase] = None, threads: int = -1, level: int = 3
+        self,
+        out_dir: str,
+        sentence_splitter: Optional[SentenceSplitterBase] = None,
+        threads: int = -1,
+        level: int = 3,
+        frame_size: Optional[int] = None,
+        max_shard_bytes: Optional[int] = None,
+        max_shard_compressed_bytes: Optional[int] = None,
+        max_shard_records: Optional[int] = None,
+        compress_workers: int = 0,
+        dictionary: Optional[Union[bytes, zstandard.ZstdCompressionDict]] = None,
+        dict_size: int = 0,
+        dict_sample_records: int = 10000,
+        sentence_cleaner: Optional[Callable[[str], str]] = None,
+        manifest: bool = True,
+        metrics: Optional[Metrics] = None,
+        dedup: Optional[Deduplicator] = None,
     ):
         """
         Archive for save lm data. Save as `.jsonl.zst`
@@ -30,29 +123,96 @@ class Archive:
                 -1 will set the number of threads to the number of detected logical CPUs.
                 Defaults to -1.
             level (int, optional): Integer compression level. Valid values are all negative integers through 22.
+            frame_size (int, optional):
+                If set, end a zstd frame every `frame_size` records and write a `.idx` sidecar with the frame offsets,
+                so `Reader` can seek to any record. Defaults to None (one frame per commit, no index).
+            max_shard_bytes (int, optional): Commit automatically once the shard holds this many uncompressed bytes.
+            max_shard_compressed_bytes (int, optional):
+                Commit automatically once about this many compressed bytes are written. Compressed data lags
+                behind `add_data`, so shards can be a little larger. Defaults to None.
+            max_shard_records (int, optional): Commit automatically once the shard holds this many records.
+            compress_workers (int, optional):
+                If > 0, records are grouped into blocks (one per frame if `frame_size` is set, ~1MB otherwise)
+                that are compressed by a pool of `compress_workers` threads and written by a background thread,
+                so `add_data` and `commit` don't wait for zstd. Call `close()` to wait for them.
+                Defaults to 0 (compress inline with `threads`).
+            dictionary (bytes or zstandard.ZstdCompressionDict, optional):
+                zstd dictionary used for every shard. Helps a lot for small records and small frames.
+                Every shard gets a `.dict` sidecar that `Reader` picks up. Defaults to None.
+            dict_size (int, optional):
+                If > 0 and no `dictionary` is given, train a dictionary of this many bytes
+                from the first `dict_sample_records` records. Defaults to 0.
+            dict_sample_records (int, optional): Number of records to train the dictionary on. Defaults to 10000.
+            sentence_cleaner (Callable[[str], str], optional):
+                Function used for `clean_sent=True`, e.g. `CachedSentenceCleaner()`. Defaults to `clean_sentence`.
+            manifest (bool, optional):
+                Write a `.manifest.json` next to every shard on commit (number of records, bytes, characters, meta keys,
+                checksum), and gather them with the totals of the directory in `manifest.json` on `close()`.
+                Defaults to True.
+            metrics (Metrics, optional):
+                Collect counters and per-stage timers (split, clean, encode, compress, write, commit) into it.
+                Defaults to None (no measurement).
+            dedup (Deduplicator, optional):
+                Drop documents that `dedup.is_duplicate` (e.g. `ExactDeduplicator()`, `MinHashDeduplicator()`),
+                before they are split, cleaned and compressed. Its state is saved to `dedup.state` in `out_dir` on every
+                commit, by appending the hashes added since the last one, and loaded from there, so a resumed run still
+                drops what earlier runs wrote. Defaults to None.
         """
         self.out_dir = out_dir
         os.makedirs(out_dir, exist_ok=True)
         self.commit_cnt = 0  # count number of commit
 
-        self.chunk_path = self.set_chunk_name()
-        self.fh = open(self.chunk_path, "wb")
-        self.cctx = zstandard.ZstdCompressor(level=level, threads=threads)
-        self.compressor = self.cctx.stream_writer(self.fh)
+        if frame_size is not None and frame_size < 1:
+            raise ValueError("frame_size should be a positive integer")
+        self.frame_size = frame_size
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_compressed_bytes = max_shard_compressed_bytes
+        self.max_shard_records = max_shard_records
+
+        self.record_cnt = 0  # number of records in the current chunk
+        self.byte_cnt = 0  # number of uncompressed bytes in the current chunk
+        self.frame_offsets = array("Q", [0])
+        self.manifest = manifest
+        self._shard_stats = ShardStats() if manifest else None
+        self.metrics = metrics
+        self.dedup = dedup
+        if dedup is not None and os.path.exists(os.path.join(out_dir, DEDUP_STATE_NAME)):
+            dedup.load(os.path.join(out_dir, DEDUP_STATE_NAME))
+
+        self.level = level
+        self.threads = threads
+        self.dictionary = to_zstd_dictionary(dictionary)
+        self.dict_size = dict_size
+        self.dict_sample_records = dict_sample_records
+        # records held back until the dictionary is trained from them
+        self._dict_samples = [] if dict_size > 0 and self.dictionary is None else None
+
+        self.compress_workers = compress_workers
+        if compress_workers > 0:
+            self._local = threading.local()
+            self.compress_pool = ThreadPoolExecutor(compress_workers, thread_name_prefix="kldf-compress")
+            self.writer = ThreadPoolExecutor(1, thread_name_prefix="kldf-writer")
+            # bounds the number of blocks held in memory
+            self._block_slots = threading.BoundedSemaphore(compress_workers * 4)
+            self._writer_futures = deque()
+            self._block = []
+            self._block_bytes = 0
+            self.fh = None
+            self.compressor = None
+            self._shard = _BackgroundShard(self.set_chunk_name())
+            self.chunk_path = self._shard.chunk_path
+        else:
+            self.compress_pool = None
+            self.chunk_path = self.set_chunk_name()
+            self.fh = open(self.chunk_path, "wb")
+            self.cctx = zstandard.ZstdCompressor(level=level, threads=threads, dict_data=self.dictionary)
+            self.compressor = self.cctx.stream_writer(self.fh)
 
         self.sentence_splitter = sentence_splitter
+        self.sentence_cleaner = sentence_cleaner if sentence_cleaner is not None else clean_sentence
 
     def set_chunk_name(self):
-        # check whether the incomplete chunks exist
-        chunk_list = glob(os.path.join(self.out_dir, CURRENT_CHUNK_INCOMPLETE + "_*"))
-        # sort the names of chunks by numerical order
-        chunk_list = sorted(chunk_list, key=lambda name: int(name.split("_")[-1]))
-        # give a unique name of the current chunk
-        chunk_num = 0
-        if chunk_list and chunk_list[-1]:
-            chunk_num = int(chunk_list[-1].split("_")[-1]) + 1
-
-        return os.path.join(self.out_dir, f"{CURRENT_CHUNK_INCOMPLETE}_{chunk_num}")
+        return get_chunk_path(self.out_dir)
 
     def add_data(
         self,
@@ -71,19 +231,172 @@ class Archive:
             split_sent (bool): Whether to split text into sentences
             clean_sent (bool): Whether to clean text (NFC, remove control char etc.)
         """
+        if not self._is_duplicate(data):
+            self._add_data(data, meta, split_sent, clean_sent)
+
+    def _is_duplicate(self, data) -> bool:
+        if self.dedup is None or not self.dedup.is_duplicate(data):
+            return False
+        if self.metrics is not None:
+            self.metrics.count("archive.duplicates")
+        return True
+
+    def _add_data(self, data, meta=None, split_sent=False, clean_sent=False):
+        metrics = self.metrics
         if meta is None:
             meta = {}
         if split_sent:
             assert self.sentence_splitter
             assert type(data) is str
+            start = time.perf_counter() if metrics is not None else 0.0
             data = self.sentence_splitter.split(data, clean_sent=clean_sent)
+            if metrics is not None:
+                metrics.add_time("archive.split", time.perf_counter() - start)
 
         if clean_sent and type(data) is str:
-            data = clean_sentence(data)
+            start = time.perf_counter() if metrics is not None else 0.0
+            data = self.sentence_cleaner(data)
+            if metrics is not None:
+                metrics.add_time("archive.clean", time.perf_counter() - start)
+
+        start = time.perf_counter() if metrics is not None else 0.0
+        line = json.dumps({"text": data, "meta": meta}, ensure_ascii=False).encode("UTF-8") + b"\n"
+        if metrics is not None:
+            metrics.add_time("archive.encode", time.perf_counter() - start)
+        if self._dict_samples is not None:
+            self._dict_samples.append((line, data, meta))
+            if len(self._dict_samples) >= self.dict_sample_records:
+                self._train_dictionary()
+            return
+
+        self._write_line(line, data, meta)
+        if self._is_shard_full():
+            self.commit()
+
+    def add_data_batch(
+        self,
+        data_list: List[Union[str, List, dict]],
+        metas: Optional[List[Dict]] = None,
+        split_sent: bool = False,
+        clean_sent: bool = False,
+    ):
+        """
+        `add_data` for many documents. With `split_sent`, all documents go through
+        `sentence_splitter.split_batch` at once, so a splitter with `num_proc` splits them in parallel.
 
-        self.compressor.write(json.dumps({"text": data, "meta": meta}, ensure_ascii=False).encode("UTF-8") + b"\n")
+        Args:
+            data_list (List[Union[str, List, dict]]): Documents, see `add_data`
+            metas (List[Dict], optional): metadata of each document. Defaults to None.
+            split_sent (bool): Whether to split text into sentences
+            clean_sent (bool): Whether to clean text (NFC, remove control char etc.)
+        """
+        if metas is None:
+            metas = [None] * len(data_list)
+        assert len(metas) == len(data_list)
+        if self.dedup is not None:
+            # before the split, as in `add_data`
+            kept = [i for i, data in enumerate(data_list) if not self._is_duplicate(data)]
+            data_list = [data_list[i] for i in kept]
+            metas = [metas[i] for i in kept]
+
+        if split_sent:
+            assert self.sentence_splitter
+            assert all(type(data) is str for data in data_list)
+            data_list = self.sentence_splitter.split_batch(data_list, clean_sent=clean_sent)
+
+        for data, meta in zip(data_list, metas):
+            self._add_data(data, meta=meta, clean_sent=clean_sent)
+
+    def _write_line(self, line: bytes, data=None, meta: Optional[Dict] = None):
+        self.record_cnt += 1
+        self.byte_cnt += len(line)
+        if self._shard_stats is not None:
+            self._shard_stats.update(line, count_chars(data), meta)
+        end_of_frame = self.frame_size is not None and self.record_cnt % self.frame_size == 0
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.count("archive.records")
+            metrics.count("archive.bytes_in", len(line))
+
+        if self.compress_pool is None:
+            start = time.perf_counter() if metrics is not None else 0.0
+            self.compressor.write(line)
+            if end_of_frame:
+                self.compressor.flush(zstandard.FLUSH_FRAME)
+                self.frame_offsets.append(self.fh.tell())
+            if metrics is not None:
+                # compression and the writes of the compressor
+                metrics.add_time("archive.compress", time.perf_counter() - start)
+        else:
+            self._block.append(line)
+            self._block_bytes += len(line)
+            if end_of_frame or (self.frame_size is None and self._block_bytes >= BACKGROUND_BLOCK_BYTES):
+                self._submit_block()
+
+    def _train_dictionary(self):
+        """Train the dictionary from the held back records, then write them"""
+        samples, self._dict_samples = self._dict_samples, None
+        self.dictionary = train_zstd_dictionary([line for line, _, _ in samples], self.dict_size)
+        if self.compress_pool is None:
+            # nothing has been written to the chunk yet
+            self.cctx = zstandard.ZstdCompressor(level=self.level, threads=self.threads, dict_data=self.dictionary)
+            self.compressor = self.cctx.stream_writer(self.fh)
+
+        for line, data, meta in samples:
+            self._write_line(line, data, meta)
+            if self._is_shard_full():
+                self.commit()
+
+    def _is_shard_full(self):
+        if self.max_shard_records is not None and self.record_cnt >= self.max_shard_records:
+            return True
+        if self.max_shard_bytes is not None and self.byte_cnt >= self.max_shard_bytes:
+            return True
+        if self.max_shard_compressed_bytes is not None:
+            if self.compress_pool is None:
+                compressed_bytes = self.fh.tell()
+            else:
+                compressed_bytes = self._shard.compressed_bytes
+            return compressed_bytes >= self.max_shard_compressed_bytes
+        return False
+
+    def _compress_block(self, block: List[bytes]) -> bytes:
+        # `ZstdCompressor` is not thread-safe, so every pool thread has its own
+        cctx = getattr(self._local, "cctx", None)
+        if cctx is None:
+            cctx = self._local.cctx = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        if self.metrics is None:
+            return cctx.compress(b"".join(block))
+
+        start = time.perf_counter()
+        cdata = cctx.compress(b"".join(block))
+        self.metrics.add_time("archive.compress", time.perf_counter() - start)
+        return cdata
+
+    def _submit_block(self):
+        if not self._block:
+            return
+        self._raise_writer_error()
+        self._block_slots.acquire()
+        future = self.compress_pool.submit(self._compress_block, self._block)
+        self._submit_write(self._shard.write_block, future, self._block_slots, self.metrics)
+        self._block = []
+        self._block_bytes = 0
+        if self.metrics is not None:
+            self.metrics.set_gauge("archive.queue_depth", len(self._writer_futures))
+
+    def _submit_write(self, fn, *args):
+        self._writer_futures.append(self.writer.submit(fn, *args))
+
+    def _raise_writer_error(self):
+        while self._writer_futures and self._writer_futures[0].done():
+            self._writer_futures.popleft().result()
 
     def commit(self, archive_name="default"):
+        if self._dict_samples is not None:
+            self._train_dictionary()
+        start = time.perf_counter() if self.metrics is not None else 0.0
+
         fname = (
             self.out_dir
             + "/data_"
@@ -96,65 +409,272 @@ class Archive:
             + archive_name
             + ".jsonl.zst"
         )
+        if self.compress_pool is None:
+            self._commit_inline(fname)
+        else:
+            self._submit_block()
+            self._submit_write(
+                self._shard.finish, fname, self.frame_size, self.record_cnt, self.dictionary, self._shard_stats
+            )
+            self._shard = _BackgroundShard(self.set_chunk_name())
+            self.chunk_path = self._shard.chunk_path
+
+        if self.dedup is not None:
+            dedup_state_path = os.path.join(self.out_dir, DEDUP_STATE_NAME)
+            if self.compress_pool is None:
+                self.dedup.save(dedup_state_path)
+            else:
+                # after the shard is written, with the hashes added up to this commit
+                self._submit_write(write_dedup_state, dedup_state_path, *self.dedup.state_update(dedup_state_path))
+
+        self.record_cnt = 0
+        self.byte_cnt = 0
+        self.commit_cnt += 1
+        if self.manifest:
+            self._shard_stats = ShardStats()
+        if self.metrics is not None:
+            self.metrics.add_time("archive.commit", time.perf_counter() - start)
+            self.metrics.count("archive.shards")
+            self.metrics.emit("commit")
+
+    def _commit_inline(self, fname: str):
         self.compressor.flush(zstandard.FLUSH_FRAME)
 
         self.fh.flush()
+        end = self.fh.tell()
         self.fh.close()
         os.rename(self.chunk_path, fname)
+        if self.metrics is not None:
+            self.metrics.count("archive.bytes_out", end)
+
+        if self.frame_size is not None:
+            if end != self.frame_offsets[-1]:
+                self.frame_offsets.append(end)
+            write_frame_index(fname + INDEX_SUFFIX, self.frame_size, self.record_cnt, self.frame_offsets)
+        if self.dictionary is not None:
+            write_zstd_dictionary(fname, self.dictionary)
+        if self._shard_stats is not None:
+            write_manifest(fname, self._shard_stats.to_manifest(fname, end))
+        self.frame_offsets = array("Q", [0])
 
         # Make new file for temporary writer
         self.chunk_path = self.set_chunk_name()
         self.fh = open(self.chunk_path, "wb")
         self.compressor = self.cctx.stream_writer(self.fh)
 
-        self.commit_cnt += 1
+    def close(self):
+        """
+        Wait for the background compression, then close the current chunk.
+        Records added after the last `commit()` stay in the incomplete chunk, which is removed if it is empty.
+        Also stops the `split_batch` worker processes of `sentence_splitter` (started again if it is used after).
+        """
+        if self._dict_samples:
+            self._train_dictionary()
+
+        if self.compress_pool is not None:
+            self._submit_block()
+            self.writer.submit(self._shard.fh.close).result()
+            self.writer.shutdown()
+            self.compress_pool.shutdown()
+            while self._writer_futures:
+                self._writer_futures.popleft().result()
+        else:
+            self.compressor.close()
+            self.fh.close()
+
+        if self.record_cnt == 0 and os.path.exists(self.chunk_path):
+            os.remove(self.chunk_path)
+        if self.manifest:
+            write_dir_manifest(self.out_dir)
+        if self.sentence_splitter is not None:
+            self.sentence_splitter.close()
 
     def set_sentence_splitter(self, sentence_splitter: SentenceSplitterBase):
         self.sentence_splitter = sentence_splitter
 
 
+def get_commit_cnt(out_dir: str) -> int:
+    """Next commit number, following the `data_<commit_cnt>_...` files already in `out_dir`"""
+    commit_nums = [int(x.split("_")[1].split(".")[0]) for x in os.listdir(out_dir) if x.startswith("data_")]
+    return max(commit_nums) + 1 if commit_nums else 0
+
+
+def _check_dat_split_sent(split_sent: bool):
+    if split_sent:
+        raise ValueError(
+            "DatArchive stores every document as a single string and can't keep the sentences of `split_sent`. "
+            "Use `Archive` or `JSONArchive`, which store them as a list."
+        )
+
+
 class DatArchive:
-    def __init__(self, out_dir: str, sentence_splitter: Optional[SentenceSplitterBase] = None, level: int = 3):
+    def __init__(
+        self,
+        out_dir: str,
+        sentence_splitter: Optional[SentenceSplitterBase] = None,
+        level: int = 3,
+        format_version: int = 1,
+        max_shard_bytes: Optional[int] = None,
+        max_shard_records: Optional[int] = None,
+        dictionary: Optional[Union[bytes, zstandard.ZstdCompressionDict]] = None,
+        dict_size: int = 0,
+        dict_sample_records: int = 10000,
+        manifest: bool = True,
+        metrics: Optional[Metrics] = None,
+        dedup: Optional[Deduplicator] = None,
+    ):
         """
         Archive for save lm data. Save as `.dat.zst`
 
+        Records are compressed as they are added, so memory doesn't grow with the shard size.
+
         Args:
             out_dir (str): Output directory path
-            sentence_splitter (SentenceSplitterBase, optional): Sentence Splitter. Defaults to None.
+            sentence_splitter (SentenceSplitterBase, optional):
+                Unused, records are single strings so `split_sent` isn't supported. Defaults to None.
             level (int, optional): Integer compression level. Valid values are all negative integers through 22.
+            format_version (int, optional):
+                1: every record is prefixed with its length as 16 ascii digits (`%016d`).
+                2: magic header, records, then a uint64 offset table and a footer, so `Reader` can slice records
+                out of one decompressed buffer. Readers of ko_lm_dataformat 0.3.1 and older can't read it.
+                Defaults to 1.
+            max_shard_bytes (int, optional): Commit automatically once the shard holds this many uncompressed bytes.
+            max_shard_records (int, optional): Commit automatically once the shard holds this many records.
+            dictionary (bytes or zstandard.ZstdCompressionDict, optional):
+                zstd dictionary used for every shard, saved as a `.dict` sidecar. Defaults to None.
+            dict_size (int, optional):
+                If > 0 and no `dictionary` is given, train a dictionary of this many bytes
+                from the first `dict_sample_records` records. Defaults to 0.
+            dict_sample_records (int, optional): Number of records to train the dictionary on. Defaults to 10000.
+            manifest (bool, optional): Write shard and directory manifests, see `Archive`. Defaults to True.
+            metrics (Metrics, optional): Collect counters and timers into it, see `Archive`. Defaults to None.
+            dedup (Deduplicator, optional): Drop duplicate documents, see `Archive`. Defaults to None.
         """
+        if format_version not in (1, 2):
+            raise ValueError(f"Unsupported dat format version: {format_version}")
+
         self.out_dir = out_dir
         os.makedirs(out_dir, exist_ok=True)
         self.level = level
-
-        self.commit_cnt = 0
-        if os.path.exists(out_dir) and len(os.listdir(out_dir)) > 0:
-            self.commit_cnt = max(map(lambda x: int(x.split("_")[1].split(".")[0]), os.listdir(out_dir))) + 1
-
-        self.data = []
+        self.format_version = format_version
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_records = max_shard_records
+
+        self.commit_cnt = get_commit_cnt(out_dir)
+
+        self.dictionary = to_zstd_dictionary(dictionary)
+        self.dict_size = dict_size
+        self.dict_sample_records = dict_sample_records
+        # records held back until the dictionary is trained from them
+        self._dict_samples = [] if dict_size > 0 and self.dictionary is None else None
+
+        self.cctx = zstandard.ZstdCompressor(level=level, dict_data=self.dictionary)
+        self.chunk_path = None
+        self.fh = None
+        self.compressor = None
+        self.record_cnt = 0
+        self.byte_cnt = 0
+        self.offsets = array("Q", [0])  # v2 offset table, written on commit
+        self.manifest = manifest
+        self._shard_stats = ShardStats() if manifest else None
+        self.metrics = metrics
+        self.dedup = dedup
+        if dedup is not None and os.path.exists(os.path.join(out_dir, DEDUP_STATE_NAME)):
+            dedup.load(os.path.join(out_dir, DEDUP_STATE_NAME))
 
         self.sentence_splitter = sentence_splitter
 
-    def add_data(self, data: Union[str, List, dict], split_sent: bool = False, clean_sent: bool = False):
-        if split_sent:
-            assert self.sentence_splitter
-            assert type(data) is str
-            data = self.sentence_splitter.split(data, clean_sent=clean_sent)
-
-        self.data.append(data)
+    def _open_chunk(self):
+        self.chunk_path = get_chunk_path(self.out_dir)
+        self.fh = open(self.chunk_path, "wb")
+        self.compressor = self.cctx.stream_writer(self.fh)
+        if self.format_version == 2:
+            self.compressor.write(DAT_MAGIC)
+
+    def add_data(self, data: str, split_sent: bool = False, clean_sent: bool = False):
+        _check_dat_split_sent(split_sent)
+        if not self._is_duplicate(data):
+            self._add_data(data)
+
+    def _is_duplicate(self, data) -> bool:
+        if self.dedup is None or not self.dedup.is_duplicate(data):
+            return False
+        if self.metrics is not None:
+            self.metrics.count("archive.duplicates")
+        return True
+
+    def _add_data(self, data):
+        num_chars = len(data)
+        data = data.encode("UTF-8")
+        if self._dict_samples is not None:
+            self._dict_samples.append((data, num_chars))
+            if len(self._dict_samples) >= self.dict_sample_records:
+                self._train_dictionary()
+            return
+
+        self._write_record(data, num_chars)
+
+    def add_data_batch(self, data_list: List[str], split_sent: bool = False, clean_sent: bool = False):
+        """`add_data` for many documents"""
+        _check_dat_split_sent(split_sent)
+        if self.dedup is not None:
+            data_list = [data for data in data_list if not self._is_duplicate(data)]
+
+        for data in data_list:
+            self._add_data(data)
+
+    def _write_record(self, data: bytes, num_chars: int = 0):
+        if self.compressor is None:
+            self._open_chunk()
+        if self._shard_stats is not None:
+            self._shard_stats.update(data, num_chars)
+
+        start = time.perf_counter() if self.metrics is not None else 0.0
+        if self.format_version == 1:
+            self.compressor.write(("%016d" % len(data)).encode("UTF-8"))
+        else:
+            self.offsets.append(self.offsets[-1] + len(data))
+        self.compressor.write(data)
+        self.record_cnt += 1
+        self.byte_cnt += len(data)
+        if self.metrics is not None:
+            self.metrics.add_time("archive.compress", time.perf_counter() - start)
+            self.metrics.count("archive.records")
+            self.metrics.count("archive.bytes_in", len(data))
+
+        if (self.max_shard_records is not None and self.record_cnt >= self.max_shard_records) or (
+            self.max_shard_bytes is not None and self.byte_cnt >= self.max_shard_bytes
+        ):
+            self.commit()
+
+    def _train_dictionary(self):
+        """Train the dictionary from the held back records, then write them"""
+        samples, self._dict_samples = self._dict_samples, None
+        self.dictionary = train_zstd_dictionary([data for data, _ in samples], self.dict_size)
+        self.cctx = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        for data, num_chars in samples:
+            self._write_record(data, num_chars)
 
     def commit(self, archive_name=None):
-        cctx = zstandard.ZstdCompressor(level=self.level)
+        if self._dict_samples is not None:
+            self._train_dictionary()
+        start = time.perf_counter() if self.metrics is not None else 0.0
 
         if archive_name is None:
             archive_name = str(int(time.time()))
 
-        res = b"".join(
-            map(lambda x: ("%016d" % len(x)).encode("UTF-8") + x, map(lambda x: x.encode("UTF-8"), self.data))
-        )
-        cdata = cctx.compress(res)
+        if self.compressor is None:
+            self._open_chunk()
 
-        with open(
+        if self.format_version == 2:
+            # align the offset table to 8 bytes so it can be cast in place
+            self.compressor.write(b"\0" * (-(len(DAT_MAGIC) + self.byte_cnt) % 8))
+            write_uint64_array(self.compressor, self.offsets)
+            self.compressor.write(DAT_FOOTER.pack(self.record_cnt, DAT_MAGIC))
+        self.compressor.flush(zstandard.FLUSH_FRAME)
+        self.fh.close()
+
+        fname = (
             self.out_dir
             + "/data_"
             + str(self.commit_cnt)
@@ -162,50 +682,208 @@ class DatArchive:
             + f"v{get_version()}"
             + "_"
             + archive_name
-            + ".dat.zst",
-            "wb",
-        ) as fh:
-            fh.write(cdata)
+            + ".dat.zst"
+        )
+        os.rename(self.chunk_path, fname)
+        if self.dictionary is not None:
+            write_zstd_dictionary(fname, self.dictionary)
+        if self._shard_stats is not None:
+            write_manifest(fname, self._shard_stats.to_manifest(fname, os.path.getsize(fname)))
+            self._shard_stats = ShardStats()
+        if self.dedup is not None:
+            self.dedup.save(os.path.join(self.out_dir, DEDUP_STATE_NAME))
+        if self.metrics is not None:
+            self.metrics.add_time("archive.commit", time.perf_counter() - start)
+            self.metrics.count("archive.shards")
+            self.metrics.count("archive.bytes_out", os.path.getsize(fname))
+            self.metrics.emit("commit")
 
         self.commit_cnt += 1
-        self.data = []
+        self.chunk_path = None
+        self.fh = None
+        self.compressor = None
+        self.record_cnt = 0
+        self.byte_cnt = 0
+        self.offsets = array("Q", [0])
+
+    def close(self):
+        """
+        Close the current chunk. Records added after the last `commit()` stay in the incomplete chunk, which is
+        removed if it is empty.
+        """
+        if self._dict_samples:
+            self._train_dictionary()
+        if self.compressor is not None:
+            self.compressor.close()
+            self.fh.close()
+            if self.record_cnt == 0:
+                os.remove(self.chunk_path)
+            self.fh = None
+            self.compressor = None
+        if self.manifest:
+            write_dir_manifest(self.out_dir)
 
 
 class JSONArchive:
-    def __init__(self, out_dir: str, sentence_splitter: Optional[SentenceSplitterBase] = None, level: int = 3):
+    def __init__(
+        self,
+        out_dir: str,
+        sentence_splitter: Optional[SentenceSplitterBase] = None,
+        level: int = 3,
+        max_shard_bytes: Optional[int] = None,
+        max_shard_records: Optional[int] = None,
+        dictionary: Optional[Union[bytes, zstandard.ZstdCompressionDict]] = None,
+        dict_size: int = 0,
+        dict_sample_records: int = 10000,
+        manifest: bool = True,
+        metrics: Optional[Metrics] = None,
+        dedup: Optional[Deduplicator] = None,
+    ):
         """
         Archive for save lm data. Save as `.json.zst`
 
+        Records are compressed as they are added, so memory doesn't grow with the shard size.
+
         Args:
             out_dir (str): Output directory path
             sentence_splitter (SentenceSplitterBase, optional): Sentence Splitter. Defaults to None.
             level (int, optional): Integer compression level. Valid values are all negative integers through 22.
+            max_shard_bytes (int, optional): Commit automatically once the shard holds this many uncompressed bytes.
+            max_shard_records (int, optional): Commit automatically once the shard holds this many records.
+            dictionary (bytes or zstandard.ZstdCompressionDict, optional):
+                zstd dictionary used for every shard, saved as a `.dict` sidecar. Defaults to None.
+            dict_size (int, optional):
+                If > 0 and no `dictionary` is given, train a dictionary of this many bytes
+                from the first `dict_sample_records` records. Defaults to 0.
+            dict_sample_records (int, optional): Number of records to train the dictionary on. Defaults to 10000.
+            manifest (bool, optional): Write shard and directory manifests, see `Archive`. Defaults to True.
+            metrics (Metrics, optional): Collect counters and timers into it, see `Archive`. Defaults to None.
+            dedup (Deduplicator, optional): Drop duplicate documents, see `Archive`. Defaults to None.
         """
         self.out_dir = out_dir
         os.makedirs(out_dir, exist_ok=True)
         self.level = level
-
-        self.commit_cnt = 0
-        if os.path.exists(out_dir) and len(os.listdir(out_dir)) > 0:
-            self.commit_cnt = max(map(lambda x: int(x.split("_")[1].split(".")[0]), os.listdir(out_dir))) + 1
-
-        self.data = []
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_records = max_shard_records
+
+        self.commit_cnt = get_commit_cnt(out_dir)
+
+        self.dictionary = to_zstd_dictionary(dictionary)
+        self.dict_size = dict_size
+        self.dict_sample_records = dict_sample_records
+        # records held back until the dictionary is trained from them
+        self._dict_samples = [] if dict_size > 0 and self.dictionary is None else None
+
+        self.cctx = zstandard.ZstdCompressor(level=level, dict_data=self.dictionary)
+        self.chunk_path = None
+        self.fh = None
+        self.compressor = None
+        self.record_cnt = 0
+        self.byte_cnt = 0
+        self.manifest = manifest
+        self._shard_stats = ShardStats() if manifest else None
+        self.metrics = metrics
+        self.dedup = dedup
+        if dedup is not None and os.path.exists(os.path.join(out_dir, DEDUP_STATE_NAME)):
+            dedup.load(os.path.join(out_dir, DEDUP_STATE_NAME))
 
         self.sentence_splitter = sentence_splitter
 
+    def _open_chunk(self):
+        self.chunk_path = get_chunk_path(self.out_dir)
+        self.fh = open(self.chunk_path, "wb")
+        self.compressor = self.cctx.stream_writer(self.fh)
+        self.compressor.write(b"[")
+
     def add_data(self, data: Union[str, List, dict], split_sent: bool = False, clean_sent: bool = False):
+        if not self._is_duplicate(data):
+            self._add_data(data, split_sent, clean_sent)
+
+    def _is_duplicate(self, data) -> bool:
+        if self.dedup is None or not self.dedup.is_duplicate(data):
+            return False
+        if self.metrics is not None:
+            self.metrics.count("archive.duplicates")
+        return True
+
+    def _add_data(self, data, split_sent=False, clean_sent=False):
         if split_sent:
             assert self.sentence_splitter
             assert type(data) is str  # Shouldn't be List[str]
             data = self.sentence_splitter.split(data, clean_sent=clean_sent)
 
-        self.data.append(data)
+        num_chars = count_chars(data)
+        data = json.dumps(data).encode("UTF-8")
+        if self._dict_samples is not None:
+            self._dict_samples.append((data, num_chars))
+            if len(self._dict_samples) >= self.dict_sample_records:
+                self._train_dictionary()
+            return
+
+        self._write_record(data, num_chars)
+
+    def add_data_batch(
+        self, data_list: List[Union[str, List, dict]], split_sent: bool = False, clean_sent: bool = False
+    ):
+        """
+        `add_data` for many documents. With `split_sent`, all documents go through
+        `sentence_splitter.split_batch` at once, so a splitter with `num_proc` splits them in parallel.
+        """
+        if self.dedup is not None:
+            data_list = [data for data in data_list if not self._is_duplicate(data)]
+
+        if split_sent:
+            assert self.sentence_splitter
+            assert all(type(data) is str for data in data_list)
+            data_list = self.sentence_splitter.split_batch(data_list, clean_sent=clean_sent)
+
+        for data in data_list:
+            self._add_data(data)
+
+    def _write_record(self, data: bytes, num_chars: int = 0):
+        if self.compressor is None:
+            self._open_chunk()
+        if self._shard_stats is not None:
+            self._shard_stats.update(data, num_chars)
+
+        # Same bytes as `json.dumps(list_of_data)`, written one element at a time
+        if self.record_cnt > 0:
+            data = b"," + data
+        start = time.perf_counter() if self.metrics is not None else 0.0
+        self.compressor.write(data)
+        self.record_cnt += 1
+        self.byte_cnt += len(data)
+        if self.metrics is not None:
+            self.metrics.add_time("archive.compress", time.perf_counter() - start)
+            self.metrics.count("archive.records")
+            self.metrics.count("archive.bytes_in", len(data))
+
+        if (self.max_shard_records is not None and self.record_cnt >= self.max_shard_records) or (
+            self.max_shard_bytes is not None and self.byte_cnt >= self.max_shard_bytes
+        ):
+            self.commit()
+
+    def _train_dictionary(self):
+        """Train the dictionary from the held back records, then write them"""
+        samples, self._dict_samples = self._dict_samples, None
+        self.dictionary = train_zstd_dictionary([data for data, _ in samples], self.dict_size)
+        self.cctx = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        for data, num_chars in samples:
+            self._write_record(data, num_chars)
 
     def commit(self):
-        cctx = zstandard.ZstdCompressor(level=self.level)
+        if self._dict_samples is not None:
+            self._train_dictionary()
+        start = time.perf_counter() if self.metrics is not None else 0.0
 
-        cdata = cctx.compress(json.dumps(self.data).encode("UTF-8"))
-        with open(
+        if self.compressor is None:
+            self._open_chunk()
+
+        self.compressor.write(b"]")
+        self.compressor.flush(zstandard.FLUSH_FRAME)
+        self.fh.close()
+
+        fname = (
             self.out_dir
             + "/data_"
             + str(self.commit_cnt)
@@ -214,10 +892,44 @@ class JSONArchive:
             + "_"
             + f"v{get_version()}"
             + "_"
-            + ".json.zst",
-            "wb",
-        ) as fh:
-            fh.write(cdata)
+            + ".json.zst"
+        )
+        os.rename(self.chunk_path, fname)
+        if self.dictionary is not None:
+            write_zstd_dictionary(fname, self.dictionary)
+        if self._shard_stats is not None:
+            write_manifest(fname, self._shard_stats.to_manifest(fname, os.path.getsize(fname)))
+            self._shard_stats = ShardStats()
+        if self.dedup is not None:
+            self.dedup.save(os.path.join(self.out_dir, DEDUP_STATE_NAME))
+        if self.metrics is not None:
+            self.metrics.add_time("archive.commit", time.perf_counter() - start)
+            self.metrics.count("archive.shards")
+            self.metrics.count("archive.bytes_out", os.path.getsize(fname))
+            self.metrics.emit("commit")
 
         self.commit_cnt += 1
-        self.data = []
+        self.chunk_path = None
+        self.fh = None
+        self.compressor = None
+        self.record_cnt = 0
+        self.byte_cnt = 0
+
+    def close(self):
+        """
+        Close the current chunk. Records added after the last `commit()` stay in the incomplete chunk, which is
+        removed if it is empty. Also stops the `split_batch` worker processes of `sentence_splitter`.
+        """
+        if self._dict_samples:
+            self._train_dictionary()
+        if self.compressor is not None:
+            self.compressor.close()
+            self.fh.close()
+            if self.record_cnt == 0:
+                os.remove(self.chunk_path)
+            self.fh = None
+            self.compressor = None
+        if self.manifest:
+            write_dir_manifest(self.out_dir)
+        if self.sentence_splitter is not None:
+            self.sentence_splitter.close()
@@ -0,0 +1,149 @@
+import hashlib
+from collections import OrderedDict
+from typing import List
+
+from .sentence_cleaner import clean_sentence
+from .sentence_splitter import SentenceSplitterBase
+
+
+_MISSING = object()
+
+
+def content_key(text: str) -> bytes:
+    """128-bit hash of `text`, so the cache doesn't keep every document it has seen as a key"""
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self):
+        return (
+            f"CacheStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+            f"hit_rate={self.hit_rate:.3f})"
+        )
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 100000):
+        """
+        Least recently used cache holding at most `max_size` entries
+
+        Args:
+            max_size (int, optional): Max number of entries. Defaults to 100000.
+        """
+        if max_size < 1:
+            raise ValueError("max_size should be a positive integer")
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.stats.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+
+class CachedSentenceSplitter(SentenceSplitterBase):
+    def __init__(self, sentence_splitter: SentenceSplitterBase, max_size: int = 100000):
+        """
+        Sentence splitter that remembers the result for documents it has already split.
+        Useful for crawled data with many exact duplicates (boilerplate, footers, notices...).
+
+        Args:
+            sentence_splitter (SentenceSplitterBase): Splitter to call on cache misses
+            max_size (int, optional): Max number of cached documents. Defaults to 100000.
+        """
+        super().__init__()
+        self.sentence_splitter = sentence_splitter
+        self.cache = LRUCache(max_size)
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
+
+    def split(self, document: str, clean_sent: bool = False) -> List[str]:
+        key = (content_key(document), clean_sent)
+        sentences = self.cache.get(key, _MISSING)
+        if sentences is _MISSING:
+            sentences = self.sentence_splitter.split(document, clean_sent=clean_sent)
+            self.cache.put(key, sentences)
+        # copy, so the caller can't change the cached value
+        return list(sentences)
+
+    def split_batch(self, documents: List[str], clean_sent: bool = False, chunksize: int = 16) -> List[List[str]]:
+        """`split_batch` of the wrapped splitter, only for the distinct documents that are not cached"""
+        keys = [(content_key(document), clean_sent) for document in documents]
+        results = {}  # key -> cached sentences, or _MISSING if it is split below
+        for key in keys:
+            if key in results:
+                # as with `split`, copies after the first are hits, the document is split once
+                self.cache.stats.hits += 1
+            else:
+                results[key] = self.cache.get(key, _MISSING)
+
+        misses = [key for key, sentences in results.items() if sentences is _MISSING]
+        if misses:
+            document_by_key = dict(zip(keys, documents))
+            split_docs = self.sentence_splitter.split_batch(
+                [document_by_key[key] for key in misses], clean_sent, chunksize
+            )
+            for key, sentences in zip(misses, split_docs):
+                self.cache.put(key, sentences)
+                results[key] = sentences
+
+        return [list(results[key]) for key in keys]
+
+    def close(self):
+        self.sentence_splitter.close()
+
+
+class CachedSentenceCleaner:
+    def __init__(self, max_size: int = 100000, remove_control: bool = True):
+        """
+        `clean_sentence` that remembers the result for sentences it has already cleaned.
+        Can be given to `Archive(sentence_cleaner=...)`.
+
+        Args:
+            max_size (int, optional): Max number of cached sentences. Defaults to 100000.
+            remove_control (bool, optional): See `clean_sentence`. Defaults to True.
+        """
+        self.remove_control = remove_control
+        self.cache = LRUCache(max_size)
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.cache.stats
+
+    def __call__(self, sentence: str) -> str:
+        key = content_key(sentence)
+        cleaned = self.cache.get(key)
+        if cleaned is None:
+            cleaned = clean_sentence(sentence, remove_control=self.remove_control)
+            self.cache.put(key, cleaned)
+        return cleaned
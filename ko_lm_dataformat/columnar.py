@@ -0,0 +1,184 @@
+import importlib
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import ujson as json
+
+from .archive import get_chunk_path
+
+
+ARROW_SUFFIXES = (".parquet", ".arrow")
+TEXT_COLUMN = "text"
+META_PREFIX = "meta."  # meta keys are flattened into `meta.<key>` columns
+# metadata of the meta columns that hold JSON strings, for keys of mixed or unknown type
+JSON_FIELD_METADATA = {b"ko_lm_dataformat.encoding": b"json"}
+
+
+def import_pyarrow():
+    """`pyarrow`, which is only needed for the columnar formats"""
+    try:
+        return importlib.import_module("pyarrow")
+    except ImportError:
+        raise ImportError("Parquet and Arrow files need pyarrow. Install it with `pip install pyarrow`.") from None
+
+
+def get_arrow_format(path: str) -> str:
+    return "parquet" if path.endswith(".parquet") else "ipc"
+
+
+def _open_dataset(path: str):
+    pa = import_pyarrow()
+    ds = importlib.import_module("pyarrow.dataset")
+    fs = importlib.import_module("pyarrow.fs")
+    # memory mapped, so uncompressed Arrow IPC batches point into the page cache instead of being copied
+    return pa, ds.dataset(
+        os.path.abspath(path), format=get_arrow_format(path), filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def count_rows(path: str) -> int:
+    """Number of rows of a Parquet or Arrow IPC file, from its metadata"""
+    _, dataset = _open_dataset(path)
+    return dataset.count_rows()
+
+
+def iter_arrow_batches(path: str, columns: Optional[List[str]] = None, filter=None, batch_size: Optional[int] = None):
+    """
+    Record batches of a Parquet or Arrow IPC file.
+
+    Only `columns` are read (for Parquet, the other column chunks are not even decompressed), and `filter` is pushed
+    down to skip the row groups whose statistics don't match.
+    """
+    _, dataset = _open_dataset(path)
+    kwargs = {} if batch_size is None else {"batch_size": batch_size}
+    yield from dataset.to_batches(columns=columns, filter=filter, **kwargs)
+
+
+def batch_to_docs(batch, get_meta: bool = False) -> Iterator:
+    """Documents of a record batch, as `Reader.stream_data` yields them. Null meta values are left out."""
+    texts = batch.column(TEXT_COLUMN).to_pylist()
+    if not get_meta:
+        yield from texts
+        return
+
+    meta_fields = [field for field in batch.schema if field.name.startswith(META_PREFIX)]
+    meta_keys = [field.name[len(META_PREFIX) :] for field in meta_fields]
+    meta_values = []
+    for field in meta_fields:
+        values = batch.column(field.name).to_pylist()
+        if _is_json_field(field):
+            values = [None if value is None else json.loads(value) for value in values]
+        meta_values.append(values)
+    for i, text in enumerate(texts):
+        meta = {key: values[i] for key, values in zip(meta_keys, meta_values) if values[i] is not None}
+        yield text, meta
+
+
+def _is_json_field(field) -> bool:
+    return field.metadata is not None and field.metadata.items() >= JSON_FIELD_METADATA.items()
+
+
+def infer_schema(
+    docs: List[Tuple[str, Dict]],
+    meta_keys: Iterable[str] = (),
+    meta_values: Optional[Dict[str, Optional[List]]] = None,
+):
+    """
+    Schema of `text` and the flattened meta of `docs`, plus `meta_keys` that don't show up in them.
+
+    The values listed in `meta_values` (from a manifest) are taken into account as well. Columns whose values have
+    mixed types, or without any known non-null value, hold JSON strings and are decoded back when read.
+    """
+    pa = import_pyarrow()
+    meta_values = meta_values or {}
+    keys = list(dict.fromkeys([key for _, meta in docs for key in meta] + list(meta_keys) + list(meta_values)))
+    fields = [pa.field(TEXT_COLUMN, pa.string())]
+    for key in keys:
+        values = [meta.get(key) for _, meta in docs] + (meta_values.get(key) or [])
+        try:
+            column_type = pa.array(values).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            column_type = pa.null()
+        if pa.types.is_null(column_type):
+            fields.append(pa.field(META_PREFIX + key, pa.string(), metadata=JSON_FIELD_METADATA))
+        else:
+            fields.append(pa.field(META_PREFIX + key, column_type))
+    return pa.schema(fields)
+
+
+def docs_to_batch(docs: List[Tuple[str, Dict]], schema):
+    pa = import_pyarrow()
+    meta_keys = {name[len(META_PREFIX) :] for name in schema.names if name.startswith(META_PREFIX)}
+    for _, meta in docs:
+        unknown = meta.keys() - meta_keys
+        if unknown:
+            raise ValueError(
+                f"Meta keys {sorted(unknown)} are not in the schema inferred from the first documents. "
+                "Pass more `infer_rows`, or write the data with manifests, which list every meta key."
+            )
+
+    arrays = [pa.array([text for text, _ in docs], type=pa.string())]
+    for field in schema:
+        if field.name.startswith(META_PREFIX):
+            key = field.name[len(META_PREFIX) :]
+            values = [meta.get(key) for _, meta in docs]
+            if _is_json_field(field):
+                values = [None if value is None else json.dumps(value, ensure_ascii=False) for value in values]
+            try:
+                arrays.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(
+                    f"Values of meta key {key!r} don't fit the {field.type} column inferred from the first documents "
+                    f"({e}). Pass more `infer_rows`, or write the data with manifests, which list the meta values."
+                ) from None
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_arrow_file(
+    path: str,
+    docs: Iterable[Tuple[str, Dict]],
+    meta_keys: Iterable[str] = (),
+    batch_size: int = 10000,
+    infer_rows: int = 10000,
+    compression: Optional[str] = "zstd",
+    meta_values: Optional[Dict[str, Optional[List]]] = None,
+) -> int:
+    """
+    Write `(text, meta)` pairs to a Parquet (`.parquet`) or Arrow IPC (`.arrow`) file. Returns the number of rows.
+
+    The schema is inferred from the first `infer_rows` documents, with a column for every key of `meta_keys` as well
+    and the types of `meta_values` (see `infer_schema`). Every `batch_size` documents make a Parquet row group / an
+    IPC record batch. Arrow IPC files are written uncompressed, so they can be read without copies.
+    """
+    pa = import_pyarrow()
+    docs = iter(docs)
+    head = list(islice(docs, infer_rows))
+    schema = infer_schema(head, meta_keys, meta_values)
+
+    # same as the archives: a chunk that is renamed once complete, and removed if writing fails
+    chunk_path = get_chunk_path(os.path.dirname(path) or ".")
+    num_rows = 0
+    try:
+        if get_arrow_format(path) == "parquet":
+            pq = importlib.import_module("pyarrow.parquet")
+            writer = pq.ParquetWriter(chunk_path, schema, compression=compression)
+        else:
+            writer = pa.ipc.new_file(chunk_path, schema)
+
+        with writer:
+            for batch_docs in (head[i : i + batch_size] for i in range(0, len(head), batch_size)):
+                writer.write_batch(docs_to_batch(batch_docs, schema))
+                num_rows += len(batch_docs)
+            while True:
+                batch_docs = list(islice(docs, batch_size))
+                if not batch_docs:
+                    break
+                writer.write_batch(docs_to_batch(batch_docs, schema))
+                num_rows += len(batch_docs)
+    except BaseException:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+        raise
+    os.replace(chunk_path, path)
+    return num_rows
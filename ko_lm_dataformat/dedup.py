@@ -0,0 +1,447 @@
+import hashlib
+import math
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import ujson as json
+
+
+DEDUP_STATE_NAME = "dedup.state"  # state of the archive's deduplicator, next to the shards
+DEDUP_MAGIC = b"KLDFDDP2"
+_STATE_HEADER = struct.Struct("<8sI")  # magic, length of the json config that follows
+_STATE_CHUNK = struct.Struct("<QQQ")  # num_seen, num_duplicates, number of the hashes that follow
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _blake2b_64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+# a saved state keeps the name of its hash, and is loaded with the same one
+HASH_FUNCTIONS = {"blake2b-64": _blake2b_64}
+if xxhash is not None:
+    HASH_FUNCTIONS["xxh3_64"] = xxhash.xxh3_64_intdigest
+HASH_NAME = "xxh3_64" if xxhash is not None else "blake2b-64"  # hash of new deduplicators
+
+
+def hash64(data: bytes) -> int:
+    """64-bit hash of `data`, xxh3 if `xxhash` is installed"""
+    return HASH_FUNCTIONS[HASH_NAME](data)
+
+
+def dedup_text(data: Union[str, List, dict]) -> str:
+    """Text of a document, as compared by the deduplicators. Whitespace is collapsed."""
+    if isinstance(data, list):
+        data = "\n".join(x for x in data if isinstance(x, str))
+    elif isinstance(data, dict):
+        data = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return " ".join(data.split())
+
+
+class HashSet:
+    """
+    Set of 64-bit hashes in one `array("Q")`, with open addressing.
+    About 16 bytes per hash instead of ~70 for a python set of ints. The table doubles once it is half full.
+    """
+
+    def __init__(self, capacity: int = 1 << 10):
+        size = 1 << max(4, (2 * capacity - 1).bit_length())
+        self.table = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.num_items = 0
+
+    def __len__(self):
+        return self.num_items
+
+    def __iter__(self):
+        return (key for key in self.table if key)
+
+    def add(self, key: int) -> bool:
+        """Add `key`. Returns False if it was already in the set."""
+        key = key or 1  # 0 marks an empty slot
+        table, mask = self.table, self.mask
+        i = key & mask
+        while True:
+            slot = table[i]
+            if slot == key:
+                return False
+            if slot == 0:
+                break
+            i = (i + 1) & mask
+        table[i] = key
+        self.num_items += 1
+        if 2 * self.num_items > len(table):
+            self._grow()
+        return True
+
+    def __contains__(self, key: int) -> bool:
+        key = key or 1
+        table, mask = self.table, self.mask
+        i = key & mask
+        while True:
+            slot = table[i]
+            if slot == key:
+                return True
+            if slot == 0:
+                return False
+            i = (i + 1) & mask
+
+    def _grow(self):
+        old = self.table
+        self.table = array("Q", bytes(16 * len(old)))
+        self.mask = len(self.table) - 1
+        self.num_items = 0
+        for key in old:
+            if key:
+                self.add(key)
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit hashes, with a fixed size: `capacity` items at `error_rate` false positives.
+    The bit positions are derived from the hash with double hashing.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        num_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_bits = num_bits
+        self.num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self.bits = bytearray((num_bits + 7) // 8)
+        self.num_items = 0
+
+    def __len__(self):
+        return self.num_items
+
+    def _positions(self, key: int):
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: int) -> bool:
+        """Add `key`. Returns False if it was (probably) already in the filter."""
+        bits = self.bits
+        added = False
+        for pos in self._positions(key):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & bit:
+                bits[byte] |= bit
+                added = True
+        self.num_items += added
+        return added
+
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class Deduplicator:
+    """
+    Base class of the deduplicators given to `Archive(dedup=...)`
+
+    A saved state is a snapshot followed by chunks of the hashes added after it. Saving to the file the state was
+    loaded from or last saved to only appends the hashes added since, so it costs as much as the new documents.
+    Deduplicators of a fixed size (a bloom filter) save their full snapshot every time instead.
+    """
+
+    def __init__(self):
+        self.num_seen = 0
+        self.num_duplicates = 0
+        self._set_hash(HASH_NAME)
+        self._incremental = True  # whether saves append the new hashes, or write the full snapshot
+        self._new_keys = array("Q")  # hashes added since the last save
+        self._state_path = None  # file the state was loaded from or last saved to
+
+    def _set_hash(self, hash_name: str):
+        if hash_name not in HASH_FUNCTIONS:
+            raise ValueError(
+                f"Dedup state was saved with the {hash_name} hash, which isn't available here. "
+                "States saved with xxh3_64 need `xxhash` (pip install xxhash)."
+            )
+        self.hash_name = hash_name
+        self.hash64 = HASH_FUNCTIONS[hash_name]
+
+    def is_duplicate(self, data: Union[str, List, dict]) -> bool:
+        """Whether `data` is a duplicate of a document seen before. If not, it is remembered."""
+        self.num_seen += 1
+        duplicate = self._check_and_add(dedup_text(data))
+        self.num_duplicates += duplicate
+        return duplicate
+
+    def _check_and_add(self, text: str) -> bool:
+        raise NotImplementedError
+
+    def get_config(self) -> Dict:
+        """Parameters a saved state has to match to be loaded"""
+        raise NotImplementedError
+
+    def _get_buffers(self) -> List[Union[array, bytearray]]:
+        """Part of the snapshot that isn't made of the hashes, e.g. the bits of a bloom filter"""
+        return []
+
+    def _get_keys(self) -> Iterable[int]:
+        """Hashes of the snapshot"""
+        return []
+
+    def _set_state(self, buffers: List[bytes], keys: array):
+        """Replace the state with the snapshot buffers, then add `keys`"""
+        raise NotImplementedError
+
+    def _dump_chunk(self, keys: array) -> bytes:
+        if sys.byteorder != "little":
+            keys = array("Q", keys)
+            keys.byteswap()
+        return _STATE_CHUNK.pack(self.num_seen, self.num_duplicates, len(keys)) + keys.tobytes()
+
+    def dumps(self) -> bytes:
+        buffers = []
+        for buf in self._get_buffers():
+            if isinstance(buf, array) and sys.byteorder != "little":
+                buf = array(buf.typecode, buf)
+                buf.byteswap()
+            buffers.append(bytes(buf))
+
+        config = {"config": self.get_config(), "buffer_sizes": [len(buf) for buf in buffers]}
+        header = json.dumps(config).encode("utf-8")
+        return (
+            _STATE_HEADER.pack(DEDUP_MAGIC, len(header))
+            + header
+            + b"".join(buffers)
+            + self._dump_chunk(array("Q", self._get_keys()))
+        )
+
+    def loads(self, state: bytes):
+        magic, header_size = _STATE_HEADER.unpack_from(state)
+        if magic != DEDUP_MAGIC:
+            raise ValueError("Not a ko_lm_dataformat dedup state")
+        offset = _STATE_HEADER.size
+        header = json.loads(state[offset : offset + header_size].decode("utf-8"))
+        offset += header_size
+
+        saved_config = dict(header["config"])
+        hash_name = saved_config.pop("hash")
+        config = self.get_config()
+        config.pop("hash")
+        if saved_config != config:
+            raise ValueError(
+                f"Dedup state was saved with {header['config']}, which doesn't match this deduplicator: "
+                f"{self.get_config()}"
+            )
+        buffers = []
+        for size in header["buffer_sizes"]:
+            buffers.append(state[offset : offset + size])
+            offset += size
+
+        num_seen = num_duplicates = 0
+        keys = array("Q")
+        while offset + _STATE_CHUNK.size <= len(state):
+            chunk_seen, chunk_duplicates, num_keys = _STATE_CHUNK.unpack_from(state, offset)
+            end = offset + _STATE_CHUNK.size + 8 * num_keys
+            if end > len(state):
+                break  # cut off by a crash while it was appended
+            keys.frombytes(state[offset + _STATE_CHUNK.size : end])
+            num_seen, num_duplicates = chunk_seen, chunk_duplicates
+            offset = end
+        if sys.byteorder != "little":
+            keys.byteswap()
+
+        self._set_hash(hash_name)
+        self.num_seen = num_seen
+        self.num_duplicates = num_duplicates
+        self._set_state(buffers, keys)
+        self._new_keys = array("Q")
+        self._state_path = None
+
+    def state_update(self, path: str) -> Tuple[bytes, bool]:
+        """
+        Bytes that bring the state saved at `path` up to date, and whether they are appended to it (the hashes added
+        since the last save) or replace it (a full state).
+        """
+        if self._incremental and path == self._state_path:
+            update, append = self._dump_chunk(self._new_keys), True
+        else:
+            update, append = self.dumps(), False
+            self._state_path = path
+        self._new_keys = array("Q")
+        return update, append
+
+    def save(self, path: str):
+        write_dedup_state(path, *self.state_update(path))
+
+    def load(self, path: str):
+        with open(path, "rb") as fh:
+            self.loads(fh.read())
+        self._state_path = path
+
+
+def write_dedup_state(path: str, state: bytes, append: bool = False):
+    if append:
+        # a chunk cut off by a crash is ignored when the state is loaded
+        with open(path, "ab") as fh:
+            fh.write(state)
+        return
+    # write then rename, so a crash never leaves a partial state
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(state)
+    os.replace(tmp_path, path)
+
+
+class ExactDeduplicator(Deduplicator):
+    def __init__(self, capacity: Optional[int] = None, bloom_error_rate: Optional[float] = None):
+        """
+        Drop documents whose text (whitespace collapsed) was seen before, by its 64-bit hash.
+
+        Args:
+            capacity (int, optional):
+                Expected number of documents. The hash set starts with room for it and grows past it, the bloom filter
+                is sized for it. Defaults to None (a small hash set that grows with the data, 1 << 20 for the bloom
+                filter).
+            bloom_error_rate (float, optional):
+                If set, use a bloom filter of fixed size (about `-capacity * ln(error_rate) / ln(2)^2` bits) instead of
+                the hash set. Memory is bounded but a fraction of the unique documents is dropped as well.
+                Defaults to None (hash set, ~16 bytes per document).
+        """
+        super().__init__()
+        self.bloom_error_rate = bloom_error_rate
+        if bloom_error_rate is not None:
+            self.capacity = capacity or 1 << 20
+            self.hashes = BloomFilter(self.capacity, bloom_error_rate)
+            # the bits hold every hash, the state stays the size of the filter
+            self._incremental = False
+        else:
+            self.capacity = capacity
+            self.hashes = HashSet(capacity) if capacity else HashSet()
+
+    def _check_and_add(self, text: str) -> bool:
+        key = self.hash64(text.encode("utf-8"))
+        if not self.hashes.add(key):
+            return True
+        if self._incremental:
+            self._new_keys.append(key)
+        return False
+
+    def get_config(self) -> Dict:
+        config = {"type": "exact", "hash": self.hash_name}
+        if self.bloom_error_rate is not None:
+            config.update(capacity=self.capacity, bloom_error_rate=self.bloom_error_rate)
+        return config
+
+    def _get_buffers(self):
+        if isinstance(self.hashes, BloomFilter):
+            return [self.hashes.bits]
+        return []
+
+    def _get_keys(self):
+        if isinstance(self.hashes, BloomFilter):
+            return []
+        return self.hashes
+
+    def _set_state(self, buffers, keys):
+        if isinstance(self.hashes, BloomFilter):
+            self.hashes.bits = bytearray(buffers[0])
+        else:
+            self.hashes = HashSet(max(len(keys), self.capacity or 1 << 10))
+        for key in keys:
+            self.hashes.add(key)
+        if isinstance(self.hashes, BloomFilter):
+            self.hashes.num_items = self.num_seen - self.num_duplicates
+
+
+class MinHashDeduplicator(Deduplicator):
+    def __init__(self, ngram_size: int = 5, num_perm: int = 128, num_bands: int = 16, capacity: int = 1 << 10):
+        """
+        Drop near-duplicates: documents that share a MinHash LSH band with a document seen before.
+
+        Signatures use one-permutation hashing: every character n-gram is hashed once and goes to one of `num_perm`
+        bins, which keeps the smallest hash. Empty bins (short documents) take the next non-empty bin.
+        The signature is cut into `num_bands` bands of `num_perm // num_bands` rows, and the hashes of the bands are kept
+        in a `HashSet`. Documents with a Jaccard similarity of about `(1 / num_bands) ** (num_bands / num_perm)`
+        (0.7 with the defaults) or more are dropped with high probability.
+
+        Every n-gram is hashed in python, about 1ms per 1000 characters with `hashlib`, a few times less with `xxhash`
+        installed. Use it on documents that passed `ExactDeduplicator` to skip the exact duplicates cheaply.
+
+        Args:
+            ngram_size (int, optional): Number of characters per shingle. Defaults to 5.
+            num_perm (int, optional): Size of the signature. Defaults to 128.
+            num_bands (int, optional): Number of LSH bands, a divisor of `num_perm`. Defaults to 16.
+            capacity (int, optional):
+                Initial number of documents the band table has room for, it grows past it. Defaults to 1 << 10.
+        """
+        super().__init__()
+        if num_perm % num_bands != 0:
+            raise ValueError(f"num_bands ({num_bands}) should divide num_perm ({num_perm})")
+        self.ngram_size = ngram_size
+        self.num_perm = num_perm
+        self.num_bands = num_bands
+        self.rows = num_perm // num_bands
+        self.capacity = capacity
+        self.bands = HashSet(capacity * num_bands)
+
+    def signature(self, text: str) -> List[int]:
+        """MinHash signature of `text` (whitespace collapsed)"""
+        n = self.ngram_size
+        shingles = {text[i : i + n] for i in range(max(1, len(text) - n + 1))}
+        num_perm = self.num_perm
+        hash64 = self.hash64
+        empty = 1 << 64
+        mins = [empty] * num_perm
+        for shingle in shingles:
+            h = hash64(shingle.encode("utf-8"))
+            i = h % num_perm
+            if h < mins[i]:
+                mins[i] = h
+
+        # densification, so that short documents still have comparable signatures
+        if empty in mins:
+            filled = [i for i, h in enumerate(mins) if h != empty]
+            if not filled:
+                return [0] * num_perm
+            for i in range(num_perm):
+                if mins[i] == empty:
+                    j = next((j for j in filled if j > i), filled[0])
+                    mins[i] = mins[j]
+        return mins
+
+    def band_keys(self, signature: Iterable[int]) -> List[int]:
+        signature = array("Q", signature)
+        if sys.byteorder != "little":
+            signature.byteswap()
+        data = signature.tobytes()
+        size = 8 * self.rows
+        hash64 = self.hash64
+        return [
+            hash64(struct.pack("<I", band) + data[band * size : (band + 1) * size]) for band in range(self.num_bands)
+        ]
+
+    def _check_and_add(self, text: str) -> bool:
+        keys = self.band_keys(self.signature(text))
+        if any(key in self.bands for key in keys):
+            return True
+        for key in keys:
+            if self.bands.add(key):
+                self._new_keys.append(key)
+        return False
+
+    def get_config(self) -> Dict:
+        return {
+            "type": "minhash",
+            "hash": self.hash_name,
+            "ngram_size": self.ngram_size,
+            "num_perm": self.num_perm,
+            "num_bands": self.num_bands,
+        }
+
+    def _get_keys(self):
+        return self.bands
+
+    def _set_state(self, buffers, keys):
+        self.bands = HashSet(max(len(keys), self.capacity * self.num_bands))
+        for key in keys:
+            self.bands.add(key)
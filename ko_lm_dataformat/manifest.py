@@ -0,0 +1,129 @@
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import ujson as json
+
+from .utils import get_version
+
+
+MANIFEST_SUFFIX = ".manifest.json"  # per shard, next to it
+DIR_MANIFEST_NAME = "manifest.json"  # totals of every shard in the directory, see `write_dir_manifest`
+CHECKSUM_NAME = "blake2b-128"
+
+# summed over the shards for the directory manifest
+TOTAL_KEYS = ("num_records", "num_bytes", "num_compressed_bytes", "num_chars")
+# distinct values kept per meta key, for `Reader.stream_data(filter=...)` to skip shards
+MAX_META_VALUES = 64
+_META_VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+def count_chars(data) -> int:
+    """Number of characters of the text of a record (str or list of str)"""
+    if isinstance(data, str):
+        return len(data)
+    if isinstance(data, list):
+        return sum(len(x) for x in data if isinstance(x, str))
+    return 0
+
+
+class ShardStats:
+    """Statistics of the records written to a shard, for its manifest"""
+
+    def __init__(self):
+        self.num_records = 0
+        self.num_bytes = 0
+        self.num_chars = 0
+        self.meta_keys = set()
+        self.meta_values = {}  # key -> set of its values, None once it has too many or non-scalar ones
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    def update(self, record: bytes, num_chars: int = 0, meta: Optional[Dict] = None):
+        """
+        Args:
+            record (bytes): Record as written to the shard, before compression
+            num_chars (int, optional): Number of characters of its text. Defaults to 0.
+            meta (Dict, optional): Its metadata. Defaults to None.
+        """
+        self.num_records += 1
+        self.num_bytes += len(record)
+        self.num_chars += num_chars
+        if meta:
+            self.meta_keys.update(meta)
+            meta_values = self.meta_values
+            for key, value in meta.items():
+                values = meta_values.setdefault(key, set())
+                if values is None or (isinstance(value, _META_VALUE_TYPES) and value in values):
+                    continue
+                if isinstance(value, _META_VALUE_TYPES) and len(values) < MAX_META_VALUES:
+                    values.add(value)
+                else:
+                    meta_values[key] = None
+        self._hash.update(record)
+
+    def to_manifest(self, shard_path: str, num_compressed_bytes: int) -> Dict:
+        return {
+            "file": os.path.basename(shard_path),
+            "version": get_version(),
+            "num_records": self.num_records,
+            "num_bytes": self.num_bytes,
+            "num_compressed_bytes": num_compressed_bytes,
+            "num_chars": self.num_chars,
+            "meta_keys": sorted(self.meta_keys),
+            "meta_values": {
+                key: None if values is None else sorted(values, key=lambda v: (type(v).__name__, str(v)))
+                for key, values in sorted(self.meta_values.items())
+            },
+            # hash of the records, in order, as they were written before compression
+            "checksum": f"{CHECKSUM_NAME}:{self._hash.hexdigest()}",
+        }
+
+
+def _write_json(path: str, ob: Dict):
+    # write then rename, so readers never see a partial manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ob, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """Manifest at `path`, or None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def summarize_manifests(shard_manifests: List[Dict]) -> Dict:
+    """Totals of shard manifests, as in the directory manifest"""
+    summary = {key: sum(m[key] for m in shard_manifests) for key in TOTAL_KEYS}
+    summary["num_shards"] = len(shard_manifests)
+    summary["meta_keys"] = sorted({key for m in shard_manifests for key in m["meta_keys"]})
+    return summary
+
+
+def write_manifest(shard_path: str, manifest: Dict):
+    """Write the manifest of a committed shard, next to it"""
+    _write_json(shard_path + MANIFEST_SUFFIX, manifest)
+
+
+def write_dir_manifest(out_dir: str) -> Optional[Dict]:
+    """
+    Gather the shard manifests of `out_dir` into its directory manifest: the totals and every shard manifest.
+
+    The archives write it once on `close()` instead of on every commit, which would rewrite all shards each time.
+    Shard manifests stay the source of truth, e.g. if several archives commit to the same directory at the same time:
+    `Reader.stats()` only uses the directory manifest if it has every shard.
+    """
+    shards = {}
+    for name in sorted(os.listdir(out_dir)):
+        if name.endswith(MANIFEST_SUFFIX) and os.path.exists(os.path.join(out_dir, name[: -len(MANIFEST_SUFFIX)])):
+            manifest = read_manifest(os.path.join(out_dir, name))
+            shards[manifest["file"]] = manifest
+    if not shards:
+        return None
+
+    dir_manifest = {"version": get_version(), **summarize_manifests(list(shards.values())), "shards": shards}
+    _write_json(os.path.join(out_dir, DIR_MANIFEST_NAME), dir_manifest)
+    return dir_manifest
@@ -0,0 +1,100 @@
+from typing import Callable, Dict, Optional, Union
+
+
+class MetaFilter:
+    def __init__(self, query: Union[Dict, Callable[[Dict], bool]]):
+        """
+        Predicate on the metadata of the records, for `Reader.stream_data(filter=...)`.
+
+        Args:
+            query (Dict or Callable[[Dict], bool]):
+                - `{key: value}`: `meta[key] == value` for every key. A list, tuple or set of values matches any of them.
+                  Records are checked for the values in their raw line before being decoded, and shards whose manifest
+                  shows none of the values are skipped without being opened.
+                - A function of the meta, called on every record.
+        """
+        if not callable(query) and not isinstance(query, dict):
+            raise TypeError(f"filter should be a dict or a callable, got {type(query)}")
+        self.query = query
+        self._needles = None
+        if isinstance(query, dict):
+            self.values = {
+                key: list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+                for key, value in query.items()
+            }
+            self._needles = [needles for needles in map(_value_needles, self.values.values()) if needles is not None]
+
+    def __call__(self, meta: Dict) -> bool:
+        if callable(self.query):
+            return self.query(meta)
+        return all(meta.get(key) in values for key, values in self.values.items())
+
+    def prefilter(self, line: bytes) -> bool:
+        """False if the raw json line can't match, without decoding it"""
+        return all(any(needle in line for needle in needles) for needles in self._needles)
+
+    @property
+    def has_prefilter(self) -> bool:
+        return bool(self._needles)
+
+    def may_match(self, manifest: Optional[Dict]) -> bool:
+        """False if the shard of `manifest` has no matching record (see `ShardStats`)"""
+        if manifest is None or callable(self.query):
+            return True
+
+        for key, values in self.values.items():
+            if None in values:
+                # records without the key match
+                continue
+            if key not in manifest["meta_keys"]:
+                return False
+            seen = manifest.get("meta_values", {}).get(key)
+            if seen is not None and not any(value in seen for value in values):
+                return False
+        return True
+
+
+def _escape(value: str, hex_format: str) -> str:
+    out = []
+    for c in value:
+        if c.isascii():
+            out.append(c)
+        else:
+            # as in json, characters outside the BMP are surrogate pairs
+            data = c.encode("utf-16-be")
+            out.extend(
+                "\\u" + format(int.from_bytes(data[i : i + 2], "big"), hex_format) for i in range(0, len(data), 2)
+            )
+    return '"' + "".join(out) + '"'
+
+
+def _value_needles(values):
+    """
+    Byte strings one of which is in every json line holding one of `values`, or None if there is no such set.
+    Strings may be written with or without escapes (`ensure_ascii`), so every spelling is a needle.
+    """
+    needles = []
+    for value in values:
+        if value is None or isinstance(value, (dict, list, float)):
+            return None
+        if isinstance(value, (bool, int)):
+            needles.append(str(int(value)).encode("utf-8"))
+            if value in (0, 1):
+                # `True == 1`
+                needles.append(b"true" if value else b"false")
+        elif isinstance(value, str):
+            if any(c in value for c in '"\\/') or not value.isprintable():
+                # escaped differently by every encoder
+                return None
+            needles.append(f'"{value}"'.encode("utf-8"))
+            if not value.isascii():
+                needles.extend(_escape(value, hex_format).encode("ascii") for hex_format in ("04x", "04X"))
+        else:
+            return None
+    return needles
+
+
+def to_meta_filter(query) -> Optional[MetaFilter]:
+    if query is None or isinstance(query, MetaFilter):
+        return query
+    return MetaFilter(query)
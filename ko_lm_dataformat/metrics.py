@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional
+
+
+class Metrics:
+    def __init__(self, callback: Optional[Callable[[str, "Metrics"], None]] = None):
+        """
+        Counters, stage timers and gauges of the hot paths of `Archive` and `Reader`.
+        Give the same object to `Archive(metrics=...)` / `Reader(metrics=...)`, nothing is measured without it.
+
+        Names are `<archive|read>.<name>`:
+            - counters: `records`, `bytes_in`, `bytes_out`, `shards` / `files`
+            - timers (seconds): `split`, `clean`, `encode`, `compress`, `write`, `commit` / `decompress`, `decode`
+            - gauges: `queue_depth` of the background writer or the reader workers
+
+        Args:
+            callback (Callable[[str, Metrics], None], optional):
+                Called with the event name and the metrics after every `commit` of an archive ("commit")
+                and every file read by a reader ("file"). Defaults to None.
+        """
+        self.callback = callback
+        self._lock = threading.Lock()  # background compression threads update the timers too
+        self.reset()
+
+    def __getstate__(self):
+        # e.g. a `Reader` sent to worker processes, whose updates stay in the worker
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float)
+        self.gauges = {}
+        self.start_time = time.perf_counter()
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.timers[name] += seconds
+
+    def set_gauge(self, name: str, value: float):
+        """Keep the last and the max value of `name`"""
+        with self._lock:
+            self.gauges[name] = value
+            self.gauges[name + ".max"] = max(value, self.gauges.get(name + ".max", value))
+
+    def emit(self, event: str):
+        if self.callback is not None:
+            self.callback(event, self)
+
+    def summary(self) -> Dict:
+        """Counters, timers and gauges, plus the rates since the creation (or `reset`)"""
+        elapsed = time.perf_counter() - self.start_time
+        with self._lock:
+            summary = {
+                "elapsed": elapsed,
+                "counters": dict(self.counters),
+                "timers": dict(self.timers),
+                "gauges": dict(self.gauges),
+            }
+
+        counters = summary["counters"]
+        rates = {}
+        for prefix in ("archive", "read"):
+            if f"{prefix}.records" not in counters:
+                continue
+            rates[f"{prefix}.records_per_sec"] = counters[f"{prefix}.records"] / elapsed if elapsed else 0.0
+            for key in ("bytes_in", "bytes_out"):
+                if f"{prefix}.{key}" in counters:
+                    rates[f"{prefix}.{key}_mb_per_sec"] = (
+                        counters[f"{prefix}.{key}"] / 2**20 / elapsed if elapsed else 0.0
+                    )
+        if counters.get("archive.bytes_out"):
+            rates["archive.compression_ratio"] = counters.get("archive.bytes_in", 0) / counters["archive.bytes_out"]
+        summary["rates"] = rates
+        return summary
+
+    def __repr__(self):
+        return f"Metrics({self.summary()})"
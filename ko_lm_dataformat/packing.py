@@ -0,0 +1,247 @@
+import mmap
+import multiprocessing as mp
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from .utils import close_mmap, write_uint64_array
+
+
+TOKENS_SUFFIX = ".bin"  # token ids of every document, back to back
+TOKEN_INDEX_SUFFIX = ".tokidx"  # header and the token offset of every document, not a frame index (`.idx`)
+TOKEN_INDEX_MAGIC = b"KLDFTOK1"
+_TOKEN_INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, bytes per token, num_docs, num_tokens
+TOKEN_DTYPES = {"uint16": "H", "uint32": "I"}
+
+_worker_tokenize = None  # tokenizer of the current pool worker, see `_init_worker`
+
+
+def _init_worker(tokenize):
+    global _worker_tokenize
+    _worker_tokenize = tokenize
+
+
+def _tokenize_in_worker(args):
+    texts, typecode, batched, eos_token_id = args
+    return _tokenize_batch(_worker_tokenize, texts, typecode, batched, eos_token_id)
+
+
+def _tokenize_batch(tokenize, texts, typecode, batched=False, eos_token_id=None) -> Tuple[List[int], bytes]:
+    """Number of tokens of every text, and all of their token ids as little-endian bytes"""
+    docs = tokenize(texts) if batched else [tokenize(text) for text in texts]
+    tokens = array(typecode)
+    lengths = []
+    try:
+        for ids in docs:
+            tokens.extend(ids)
+            if eos_token_id is not None:
+                tokens.append(eos_token_id)
+            lengths.append(len(ids) + (eos_token_id is not None))
+    except OverflowError:
+        raise ValueError(f"Token ids don't fit in {8 * tokens.itemsize} bits, use dtype='uint32'") from None
+    if sys.byteorder != "little":
+        tokens.byteswap()
+    return lengths, tokens.tobytes()
+
+
+def _get_dtype(dtype: Optional[str], vocab_size: Optional[int]) -> str:
+    if dtype is None:
+        dtype = "uint16" if vocab_size is not None and vocab_size <= 1 << 16 else "uint32"
+    if dtype not in TOKEN_DTYPES:
+        raise ValueError(f"dtype should be one of {list(TOKEN_DTYPES)}, got {dtype}")
+    return dtype
+
+
+def pack_tokens(
+    reader,
+    tokenize: Callable,
+    out_path: str,
+    dtype: Optional[str] = None,
+    vocab_size: Optional[int] = None,
+    eos_token_id: Optional[int] = None,
+    num_proc: int = 0,
+    batch_size: int = 1000,
+    batched: bool = False,
+) -> Tuple[int, int]:
+    """
+    Tokenize every document of `reader` once and write the token ids as `<out_path>.bin`, with the token offset of
+    every document in `<out_path>.tokidx`. Read them back with `PackedDataset`.
+
+    Args:
+        reader (Reader or Iterable[str]): Documents to tokenize, streamed with `autojoin_sentences=True`
+        tokenize (Callable): `str -> List[int]`, or `List[str] -> List[List[int]]` with `batched`.
+            It has to be picklable for `num_proc > 1`, e.g. `tokenizer.encode`.
+        out_path (str): Output path, without suffix
+        dtype (str, optional): `uint16` or `uint32`. Defaults to `uint16` if `vocab_size <= 65536`, else `uint32`.
+        vocab_size (int, optional): Size of the vocabulary, to pick `dtype`. Defaults to None.
+        eos_token_id (int, optional): Appended to every document. Defaults to None.
+        num_proc (int, optional):
+            Number of tokenizer processes. Documents are sent to them in batches of `batch_size` and written in order.
+            0 or 1 will tokenize in the current process. Defaults to 0.
+        batch_size (int, optional): Number of documents per batch. Defaults to 1000.
+        batched (bool, optional): `tokenize` takes a list of documents. Defaults to False.
+
+    Returns:
+        Tuple[int, int]: number of documents and number of tokens
+    """
+    typecode = TOKEN_DTYPES[_get_dtype(dtype, vocab_size)]
+    if hasattr(reader, "stream_batches"):
+        batches = reader.stream_batches(autojoin_sentences=True, batch_size=batch_size)
+    else:
+        batches = _iter_chunks(reader, batch_size)
+
+    pool = None
+    if num_proc > 1:
+        pool = mp.Pool(num_proc, initializer=_init_worker, initargs=(tokenize,))
+        results = pool.imap(_tokenize_in_worker, ((texts, typecode, batched, eos_token_id) for texts in batches))
+    else:
+        results = (_tokenize_batch(tokenize, texts, typecode, batched, eos_token_id) for texts in batches)
+
+    offsets = array("Q", [0])
+    tokens_path = out_path + TOKENS_SUFFIX
+    index_path = out_path + TOKEN_INDEX_SUFFIX
+    try:
+        # written then renamed, so a `PackedDataset` never sees a partial file
+        with open(tokens_path + ".tmp", "wb") as fh:
+            for lengths, data in results:
+                fh.write(data)
+                offsets.extend(accumulate(lengths, initial=offsets[-1]))
+                del offsets[-len(lengths) - 1]  # `initial` is already in `offsets`
+
+        num_docs, num_tokens = len(offsets) - 1, offsets[-1]
+        with open(index_path + ".tmp", "wb") as fh:
+            fh.write(_TOKEN_INDEX_HEADER.pack(TOKEN_INDEX_MAGIC, array(typecode).itemsize, num_docs, num_tokens))
+            write_uint64_array(fh, offsets)
+    except BaseException:
+        # e.g. `tokenize` raised, in this process or in a worker
+        for tmp_path in (tokens_path + ".tmp", index_path + ".tmp"):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    os.replace(tokens_path + ".tmp", tokens_path)
+    os.replace(index_path + ".tmp", index_path)
+    return num_docs, num_tokens
+
+
+def _iter_chunks(docs: Iterable[str], size: int):
+    chunk = []
+    for doc in docs:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class PackedDataset:
+    def __init__(self, path: str, seq_len: int):
+        """
+        Fixed-length sequences of the tokens written by `pack_tokens`, with O(1) random access.
+
+        Both files are mapped in memory, so opening is instant and sequences are read from the page cache.
+        Sequence `i` is tokens `[i * seq_len, (i + 1) * seq_len)` of all documents back to back; the last partial
+        sequence is dropped.
+
+        Args:
+            path (str): Path given to `pack_tokens`, without suffix
+            seq_len (int): Number of tokens per sequence
+
+        Example:
+            dataset = PackedDataset("tokens/train", seq_len=2049)
+            tokens = dataset[123]  # memoryview of 2049 token ids
+        """
+        if seq_len < 1:
+            raise ValueError("seq_len should be a positive integer")
+        self.path = path
+        self.seq_len = seq_len
+
+        with open(path + TOKEN_INDEX_SUFFIX, "rb") as fh:
+            magic, itemsize, self.num_docs, self.num_tokens = _TOKEN_INDEX_HEADER.unpack(
+                fh.read(_TOKEN_INDEX_HEADER.size)
+            )
+            if magic != TOKEN_INDEX_MAGIC:
+                raise ValueError(f"{path + TOKEN_INDEX_SUFFIX} is not a ko_lm_dataformat token index")
+            self._index_mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        typecode = {array(typecode).itemsize: typecode for typecode in TOKEN_DTYPES.values()}[itemsize]
+        self.dtype = next(dtype for dtype, code in TOKEN_DTYPES.items() if code == typecode)
+
+        # the files are little-endian
+        self._swap = sys.byteorder != "little"
+        self.doc_offsets = memoryview(self._index_mm)[_TOKEN_INDEX_HEADER.size :].cast("Q")
+
+        if self.num_tokens == 0:
+            # empty files can't be mapped
+            self._tokens_mm = None
+            self.tokens = memoryview(array(typecode))
+        else:
+            with open(path + TOKENS_SUFFIX, "rb") as fh:
+                self._tokens_mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.tokens = memoryview(self._tokens_mm).cast(typecode)
+
+    def __len__(self):
+        return self.num_tokens // self.seq_len
+
+    def __getitem__(self, idx: int) -> Union[memoryview, array]:
+        """Token ids of sequence `idx`, a view of the mapped file"""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"sequence {idx} out of range")
+        return self._get_tokens(idx * self.seq_len, (idx + 1) * self.seq_len)
+
+    def _get_tokens(self, start: int, stop: int):
+        tokens = self.tokens[start:stop]
+        if self._swap:
+            tokens = array(tokens.format, tokens)
+            tokens.byteswap()
+        return tokens
+
+    def _get_offset(self, doc_idx: int) -> int:
+        offset = self.doc_offsets[doc_idx]
+        return int.from_bytes(offset.to_bytes(8, sys.byteorder), "little") if self._swap else offset
+
+    def get_document(self, doc_idx: int) -> Union[memoryview, array]:
+        """Token ids of document `doc_idx`"""
+        if not 0 <= doc_idx < self.num_docs:
+            raise IndexError(f"document {doc_idx} out of range")
+        return self._get_tokens(self._get_offset(doc_idx), self._get_offset(doc_idx + 1))
+
+    def get_document_starts(self, idx: int) -> List[int]:
+        """Positions in sequence `idx` where a document starts, e.g. to reset attention or position ids"""
+        start, stop = idx * self.seq_len, (idx + 1) * self.seq_len
+        if self._swap:
+            offsets = [self._get_offset(i) for i in range(self.num_docs + 1)]
+        else:
+            offsets = self.doc_offsets
+        first = bisect_right(offsets, start - 1)
+        starts = []
+        for doc_idx in range(first, self.num_docs):
+            offset = offsets[doc_idx]
+            if offset >= stop:
+                break
+            if offsets[doc_idx + 1] > offset:  # empty documents have no tokens to start
+                starts.append(offset - start)
+        return starts
+
+    def close(self):
+        self.tokens.release()
+        self.doc_offsets.release()
+        if self._tokens_mm is not None:
+            close_mmap(self._tokens_mm)
+        close_mmap(self._index_mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
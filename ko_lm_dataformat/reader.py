@@ -1,53 +1,812 @@
+import asyncio
 import gzip
+import heapq
 import io
 import logging
+import mmap
 import multiprocessing as mp
+import os
+import queue
+import random
+import shutil
+import sys
+import threading
+import time
+import traceback
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, islice
+from typing import Callable, List, Optional
 from zipfile import ZipFile
 
 import jsonlines
 import ujson as json
 import zstandard
 
-from .utils import handle_jsonl, listdir_or_file, tarfile_reader
+from .archive import CURRENT_CHUNK_INCOMPLETE
+from .columnar import ARROW_SUFFIXES, batch_to_docs, count_rows, iter_arrow_batches, write_arrow_file
+from .dedup import DEDUP_STATE_NAME
+from .manifest import DIR_MANIFEST_NAME, MANIFEST_SUFFIX, read_manifest, summarize_manifests
+from .meta_filter import MetaFilter, to_meta_filter
+from .metrics import Metrics
+from .shuffle import interleave_streams, shuffle_buffer
+from .utils import (
+    DAT_FOOTER,
+    DAT_MAGIC,
+    DICT_SUFFIX,
+    INDEX_SUFFIX,
+    MappedTarMember,
+    close_mmap,
+    get_zstd_dictionary_path,
+    handle_jsonl,
+    handle_jsonl_lines,
+    iter_lines,
+    iter_tar_members,
+    list_tar_members,
+    listdir_or_file,
+    load_zstd_dictionary,
+    read_frame_index,
+)
 
 
 logger = logging.getLogger(__name__)
 
+QUEUE_SIZE = 64  # max number of batches waiting in a worker queue
+BATCH_SIZE = 256  # number of documents sent per queue item
+PREFETCH_BLOCK_SIZE = 1 << 20  # read size when warming upcoming files
+
+_MSG_BATCH = "batch"
+_MSG_FILE_DONE = "file_done"
+_MSG_WORKER_DONE = "worker_done"
+_MSG_ERROR = "error"
+
+SIDECAR_SUFFIXES = (
+    INDEX_SUFFIX,
+    DICT_SUFFIX,
+    MANIFEST_SUFFIX,
+)  # files written next to the shards, not streamed as data
+
+# formats whose records have metadata, the others only match a `filter` that `{}` matches
+META_SUFFIXES = (".jsonl.zst", ".jsonl.zst.tar", ".tar.gz", ".tar.zst") + ARROW_SUFFIXES
+
+# Unit of work of the streaming methods: records `[start, stop)` of `file`, or of its tar `member`.
+# `stop=None` reads to the end of the file.
+_Task = namedtuple("_Task", ["file", "start", "member", "stop"], defaults=(0, None, None))
+
 
 class Reader:
-    def __init__(self, in_path: str):
+    def __init__(
+        self,
+        in_path: str,
+        dat_cache_dir: Optional[str] = None,
+        strict_jsonl: bool = False,
+        json_loads: Optional[Callable] = None,
+        prefetch: int = 0,
+        rank: int = 0,
+        world_size: int = 1,
+        worker_id: int = 0,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         """
         Read data which is archive with ko_lm_dataformat
 
         Args:
             in_path (str): Input directory path
+            dat_cache_dir (str, optional):
+                Directory for decompressed `.dat.zst` (version 2) files. They are decompressed once and then mmap'd
+                on every read. Defaults to None (decompress into memory on every read).
+            strict_jsonl (bool, optional):
+                Read `.jsonl.zst` line by line through `jsonlines`, which validates every line.
+                Defaults to False (decompress big blocks, split them on newlines and decode with `json_loads`).
+            json_loads (Callable, optional): JSON decoder for the fast path, e.g. `orjson.loads`. Defaults to `ujson.loads`.
+            prefetch (int, optional):
+                Number of upcoming files read ahead into the page cache by background threads while the current one is
+                decoded, so decoding doesn't wait on I/O at file boundaries (network filesystems, cold cache).
+                Defaults to 0 (no prefetch).
+            rank (int, optional): Rank of this process in distributed training. Defaults to 0.
+            world_size (int, optional): Number of ranks. Defaults to 1.
+            worker_id (int, optional): Data loader worker of this reader within the rank. Defaults to 0.
+            num_workers (int, optional): Number of data loader workers per rank. Defaults to 1.
+            seed (int, optional):
+                Shuffle the file order with this seed, differently for every epoch (see `set_epoch`) but the same on
+                every rank. Defaults to None (file order).
+            metrics (Metrics, optional):
+                Collect counters and timers of the reads into it: `read.decode` is the time spent producing documents
+                (decompression included), `read.decompress` the time in zstd alone (`.jsonl.zst` fast path).
+                With `num_proc`, only the records and the queue depth seen by the main process are collected.
+                Defaults to None (no measurement).
+
+        With `world_size * num_workers > 1` every reader streams its own part of the data and the parts don't overlap.
+        If every file has an index (see `Archive(frame_size=...)`), the records are split into equal ranges. Otherwise
+        whole files are spread so that every part gets about the same number of bytes.
         """
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank should be in [0, {world_size}), got {rank}")
+        if not 0 <= worker_id < num_workers:
+            raise ValueError(f"worker_id should be in [0, {num_workers}), got {worker_id}")
+
         self.in_path = in_path
+        self.dat_cache_dir = dat_cache_dir
+        self.strict_jsonl = strict_jsonl
+        self.json_loads = json_loads if json_loads is not None else json.loads
+        self.prefetch = prefetch
+        self.rank = rank
+        self.world_size = world_size
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.seed = seed
+        self.metrics = metrics
+        self.epoch = 0
+        self._seek_record = None
+        self._index_cache = {}
+        self._dict_cache = {}
+        self._tar_cache = {}
+        self._manifest_cache = {}
+        self._record_cumsum = None  # (epoch, tasks, cumulative record counts), built on first random access
+        self._resume_state = None
+        # tasks of the current stream, and `[task position, records read from it]` for `state_dict`
+        self._stream_tasks = []
+        self._task_offset = 0
+        self._position = [0, 0]
+
+    def __len__(self):
+        """
+        Number of records this reader streams: its own part with `world_size` / `num_workers`, all records otherwise.
+        Every file needs an index (see `Archive(frame_size=...)`), a manifest or Parquet/Arrow metadata.
+        """
+        _, cumsum = self._get_record_cumsum()
+        return cumsum[-1] if cumsum else 0
+
+    def __getitem__(self, record_idx: int):
+        """
+        Read a single record, decompressing only the frame that holds it.
+        Records are counted in the order `stream_data` yields them, over the part of this reader as `len()`.
+
+        Files without an index (other formats, or `.jsonl.zst` written without `frame_size`) are decoded from their
+        start up to the record, like `seek` does.
+        """
+        if record_idx < 0:
+            record_idx += len(self)
+        tasks, cumsum = self._get_record_cumsum()
+        if record_idx < 0 or not cumsum or record_idx >= cumsum[-1]:
+            raise IndexError("Reader index out of range")
+
+        task_idx = bisect_right(cumsum, record_idx)
+        task = tasks[task_idx]
+        f = task.file
+        local_idx = task.start + record_idx - (cumsum[task_idx - 1] if task_idx > 0 else 0)
+
+        index = self._get_index(f)
+        if index is None or task.member is not None:
+            return next(self._stream_task_docs(_Task(f, local_idx, task.member, local_idx + 1)))
+        frame = local_idx // index.frame_size
+        with open(f, "rb") as fh:
+            fh.seek(index.offsets[frame])
+            cdata = fh.read(index.offsets[frame + 1] - index.offsets[frame])
+        lines = self._get_decompressor(f).decompressobj().decompress(cdata).split(b"\n")
+        return self.json_loads(lines[local_idx - frame * index.frame_size])["text"]
+
+    def seek(self, record_idx: int):
+        """
+        Start the next `stream_data` / `stream_batches` call at `record_idx`, counted in stream order over the part
+        of this reader (see `__len__`).
+
+        Files before the target are skipped without being opened, so every file up to the target needs its number of
+        records: an index (see `Archive(frame_size=...)`), a manifest or Parquet/Arrow metadata. Only the frame holding
+        the target is decoded in an indexed file, files without an index are decoded from their start up to it.
+        """
+        if record_idx < 0:
+            raise ValueError("record_idx should be non-negative")
+        self._seek_record = record_idx
+        self._resume_state = None
+
+    def state_dict(self) -> dict:
+        """
+        Position of the current stream, as a JSON-serializable dict to save with a training checkpoint.
+        Give it to `resume` to continue right after the last document that was yielded.
+
+        The state holds the position of the file in the stream, its name and the record to start from in it
+        (and the frame holding that record if the file has an index).
+        """
+        if self._position is None:
+            raise ValueError(
+                "The position of a stream with `ordered=False`, `filter` or `stream_shuffled` is unknown, it can't be resumed"
+            )
+
+        task_idx, consumed = self._position
+        state = {"epoch": self.epoch, "task": self._task_offset + task_idx}
+        if task_idx < len(self._stream_tasks):
+            task = self._stream_tasks[task_idx]
+            record = task.start + consumed
+            state.update(file=os.path.basename(task.file), member=task.member, record=record)
+            index = self._get_index(task.file)
+            if index is not None:
+                state.update(frame=record // index.frame_size, record_in_frame=record % index.frame_size)
+        return state
+
+    def resume(self, state: dict):
+        """
+        Start the next stream where the stream of `state` (see `state_dict`) stopped, with the same epoch.
+
+        Earlier files are skipped without being opened. Indexed `.jsonl.zst` files start decoding at the frame holding
+        the record, other files are decoded from their start up to it. The reader has to be built with the same
+        `in_path`, partition and seed as the one that saved the state.
+        """
+        self.epoch = state["epoch"]
+        self._resume_state = state
+        self._seek_record = None
+
+    def _list_files(self):
+        """Data files under `in_path`, without sidecars and chunks an `Archive` is still writing"""
+        return [
+            f
+            for f in listdir_or_file(self.in_path)
+            if not f.endswith(SIDECAR_SUFFIXES)
+            and not os.path.basename(f).startswith(CURRENT_CHUNK_INCOMPLETE)
+            and os.path.basename(f) not in (DIR_MANIFEST_NAME, DEDUP_STATE_NAME)
+        ]
+
+    def _get_index(self, f):
+        """Frame index of `f`, or None if it was written without one"""
+        if f not in self._index_cache:
+            index_path = f + INDEX_SUFFIX
+            if f.endswith(".jsonl.zst") and os.path.exists(index_path):
+                self._index_cache[f] = read_frame_index(index_path)
+            else:
+                self._index_cache[f] = None
+        return self._index_cache[f]
+
+    def _get_decompressor(self, f):
+        """Decompressor for `f`, with the zstd dictionary it was compressed with (see `write_zstd_dictionary`)"""
+        if f not in self._dict_cache:
+            dict_path = get_zstd_dictionary_path(f)
+            if dict_path is not None and dict_path not in self._dict_cache:
+                # shards share the dictionary of their directory, it is only read once
+                self._dict_cache[dict_path] = load_zstd_dictionary(dict_path)
+            self._dict_cache[f] = self._dict_cache[dict_path] if dict_path is not None else None
+        return zstandard.ZstdDecompressor(dict_data=self._dict_cache[f])
+
+    def _get_manifest(self, f):
+        """Manifest of the shard `f`, or None if it was written without one"""
+        if f not in self._manifest_cache:
+            self._manifest_cache[f] = read_manifest(f + MANIFEST_SUFFIX)
+        return self._manifest_cache[f]
+
+    def _get_num_records(self, f):
+        if f.endswith(ARROW_SUFFIXES):
+            return count_rows(f)
+        index = self._get_index(f)
+        if index is not None:
+            return index.num_records
+        manifest = self._get_manifest(f)
+        if manifest is not None:
+            return manifest["num_records"]
+        raise ValueError(f"{f} has no index or manifest. Write it with `Archive(frame_size=...)` for random access.")
+
+    def stats(self) -> dict:
+        """
+        Totals of the data under `in_path` from the manifests written by the archives, without reading the data.
+        The directory manifest that `Archive.close()` writes is used if it has every file, the shard manifests otherwise.
+
+        Returns:
+            dict: `num_shards`, `num_records`, `num_bytes` (uncompressed), `num_compressed_bytes`, `num_chars`,
+            `meta_keys`, and `shards` with the manifest of every file
+        """
+        files = self._list_files()
+        names = [os.path.basename(f) for f in files]
+        manifests = None
+
+        # the directory manifest is enough if it has every file, and only them
+        if isinstance(self.in_path, str) and os.path.isdir(self.in_path):
+            dir_manifest = read_manifest(os.path.join(self.in_path, DIR_MANIFEST_NAME))
+            if dir_manifest is not None and set(dir_manifest["shards"]) == set(names):
+                manifests = [dir_manifest["shards"][name] for name in names]
+
+        if manifests is None:
+            manifests = []
+            for f in files:
+                manifest = self._get_manifest(f)
+                if manifest is None:
+                    raise ValueError(f"{f} has no manifest. Write it with an archive of ko_lm_dataformat.")
+                manifests.append(manifest)
+
+        return {**summarize_manifests(manifests), "shards": dict(zip(names, manifests))}
+
+    def _get_record_cumsum(self):
+        if self._record_cumsum is None or self._record_cumsum[0] != self.epoch:
+            tasks = self._get_part_tasks()
+            cumsum = list(accumulate(self._get_task_num_records(task) for task in tasks))
+            self._record_cumsum = (self.epoch, tasks, cumsum)
+        return self._record_cumsum[1:]
+
+    def _get_tar_members(self, f):
+        """Member table of the `.jsonl.zst.tar` `f`, without empty members"""
+        if f not in self._tar_cache:
+            with open(f, "rb") as fh:
+                self._tar_cache[f] = [entry for entry in list_tar_members(fh) if entry.size != 0]
+        return self._tar_cache[f]
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch for the file shuffle of `seed`. Call it with the same value on every rank."""
+        self.epoch = epoch
+
+    def _get_file_tasks(self, f):
+        if f.endswith(".jsonl.zst.tar"):
+            # every member is a task of its own, so the workers can share a big tar
+            return [_Task(f, member=member) for member in range(len(self._get_tar_members(f)))]
+        return [_Task(f)]
+
+    def _get_task_num_records(self, task):
+        num_records = self._get_num_records(task.file) if task.stop is None else task.stop
+        return num_records - task.start
+
+    def _get_task_bytes(self, task):
+        if task.member is not None:
+            return self._get_tar_members(task.file)[task.member].size
+        return os.path.getsize(task.file)
+
+    def _partition_tasks(self, tasks):
+        """Part of `tasks` for this rank and worker."""
+        num_parts = self.world_size * self.num_workers
+        part = self.rank * self.num_workers + self.worker_id
+
+        if all(task.file.endswith(".jsonl.zst") and self._get_index(task.file) is not None for task in tasks):
+            # equal record ranges over the concatenated files
+            num_records = [self._get_num_records(task.file) for task in tasks]
+            total = sum(num_records)
+            lo, hi = total * part // num_parts, total * (part + 1) // num_parts
+            part_tasks = []
+            offset = 0
+            for task, n in zip(tasks, num_records):
+                start, stop = max(lo - offset, 0), min(hi - offset, n)
+                if start < stop:
+                    part_tasks.append(_Task(task.file, start, None, None if stop == n else stop))
+                offset += n
+            return part_tasks
+
+        # largest files first, each to the part with the fewest bytes so far
+        sizes = [self._get_task_bytes(task) for task in tasks]
+        loads = [(0, i) for i in range(num_parts)]
+        assigned = [None] * len(tasks)
+        for task_idx in sorted(range(len(tasks)), key=lambda i: -sizes[i]):
+            load, task_part = heapq.heappop(loads)
+            assigned[task_idx] = task_part
+            heapq.heappush(loads, (load + sizes[task_idx], task_part))
+        return [task for task, task_part in zip(tasks, assigned) if task_part == part]
+
+    def _skip_records(self, tasks, num_records):
+        """`tasks` without their first `num_records` records. Needs the index of every skipped file."""
+        for i, task in enumerate(tasks):
+            n = self._get_task_num_records(task)
+            if num_records < n:
+                return [task._replace(start=task.start + num_records)] + tasks[i + 1 :]
+            num_records -= n
+        return []
+
+    def _get_part_tasks(self):
+        """`_Task`s of this reader for the current epoch, in stream order"""
+        tasks = [task for f in self._list_files() for task in self._get_file_tasks(f)]
+        if self.seed is not None:
+            random.Random(f"{self.seed}-{self.epoch}").shuffle(tasks)
+        if self.world_size * self.num_workers > 1:
+            tasks = self._partition_tasks(tasks)
+        return tasks
+
+    def _get_tasks(self):
+        """List of `_Task` to stream, consuming the position set by `seek`."""
+        tasks = self._get_part_tasks()
+
+        num_tasks = len(tasks)
+        start, self._seek_record = self._seek_record, None
+        if start:
+            tasks = self._skip_records(tasks, start)
+        state, self._resume_state = self._resume_state, None
+        if state is not None:
+            tasks = self._resume_tasks(tasks, state)
+
+        self._stream_tasks = tasks
+        self._task_offset = num_tasks - len(tasks)
+        self._position = [0, 0]
+        return tasks
+
+    def _resume_tasks(self, tasks, state):
+        task_idx = state["task"]
+        if task_idx >= len(tasks):
+            return []
+        if "file" not in state:
+            # saved before the stream started
+            return tasks[task_idx:]
+        task = tasks[task_idx]
+        if os.path.basename(task.file) != state["file"] or task.member != state["member"]:
+            raise ValueError(
+                f"Can't resume from {state}: file {task_idx} is {task.file}. "
+                "The data, partition or seed changed since the state was saved."
+            )
+        return [task._replace(start=state["record"])] + tasks[task_idx + 1 :]
 
-    def stream_data(self, get_meta=False, autojoin_sentences=False, sent_joiner=" ", threaded=False):
-        if not threaded:
+    def stream_data(
+        self,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        threaded=False,
+        num_proc=0,
+        ordered=True,
+        batch_size=BATCH_SIZE,
+        batch_bytes=None,
+        filter=None,
+    ):
+        """
+        Stream every document under `in_path`.
+
+        Args:
+            get_meta (bool, optional): Whether to get meta data. Only jsonl file has metadata. Defaults to False.
+            autojoin_sentences (bool, optional): Join sentences if data consists of multiple texts. Defaults to False.
+            sent_joiner (str, optional): Seperator for joining multiple sentences. Defaults to " ".
+            threaded (bool, optional): Decode in a single background process. Same as `num_proc=1`. Defaults to False.
+            num_proc (int, optional):
+                Number of worker processes. Files are spread across the workers and sent back in batches.
+                0 will decode inline. Defaults to 0.
+            ordered (bool, optional):
+                Keep the file order of the inline path when `num_proc > 1`.
+                If False, batches are yielded as soon as any worker finishes them. Defaults to True.
+            batch_size (int, optional): Max number of documents per batch sent from the workers. Defaults to 256.
+            batch_bytes (int, optional): Max UTF-8 size of the texts per batch. Defaults to None (no limit).
+            filter (Dict or Callable[[Dict], bool], optional):
+                Only stream the records whose meta matches, see `MetaFilter`. With `{key: value}`, shards whose
+                manifest has none of the values are skipped and jsonl lines without them are not decoded.
+                The position of a filtered stream can't be saved with `state_dict`. Defaults to None.
+
+        Example:
+            for text in rdr.stream_data(filter={"source": ["news", "wiki"]}):
+                ...
+        """
+        if threaded and num_proc < 1:
+            num_proc = 1
+        meta_filter = to_meta_filter(filter)
+
+        if num_proc < 1:
             yield from self._stream_data(
-                get_meta=get_meta, autojoin_sentences=autojoin_sentences, sent_joiner=sent_joiner
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                meta_filter=meta_filter,
             )
             return
 
-        q = mp.Queue(1000)
-        p = mp.Process(target=self._stream_data_threaded, args=(q, get_meta, autojoin_sentences, sent_joiner))
-        p.start()
-        while p.is_alive():
-            res = q.get()
-            if res is None:
-                break
-            yield res
+        for batch in self._stream_batches_parallel(
+            num_proc,
+            ordered,
+            batch_size,
+            batch_bytes,
+            get_meta=get_meta,
+            autojoin_sentences=autojoin_sentences,
+            sent_joiner=sent_joiner,
+            meta_filter=meta_filter,
+        ):
+            for data in batch:
+                if self._position is not None:
+                    self._position[1] += 1
+                yield data
+
+    def stream_batches(
+        self,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        batch_size=BATCH_SIZE,
+        batch_bytes=None,
+        num_proc=0,
+        ordered=True,
+        filter=None,
+    ):
+        """
+        Stream documents as lists, e.g. to feed a tokenizer directly.
+
+        Batches hold at most `batch_size` documents and at most `batch_bytes` bytes of text (a single document larger
+        than `batch_bytes` makes its own batch). With `num_proc > 0` a batch never spans two files.
+        `filter` selects records by their meta, as in `stream_data`.
+
+        Yields:
+            if get_meta:
+                (texts: List[str], metas: List[dict])
+            else:
+                texts: List[str]
+        """
+        stream_kwargs = {
+            "get_meta": get_meta,
+            "autojoin_sentences": autojoin_sentences,
+            "sent_joiner": sent_joiner,
+            "meta_filter": to_meta_filter(filter),
+        }
+        if num_proc < 1:
+            batches = _iter_batches(self._stream_data(**stream_kwargs), batch_size, batch_bytes)
+        else:
+            batches = self._stream_batches_parallel(num_proc, ordered, batch_size, batch_bytes, **stream_kwargs)
+
+        for batch in batches:
+            if num_proc >= 1 and self._position is not None:
+                self._position[1] += len(batch)
+            if get_meta:
+                texts, metas = zip(*batch)
+                yield list(texts), list(metas)
+            else:
+                yield batch
+
+    def stream_shuffled(
+        self,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        buffer_size=10000,
+        interleave=4,
+    ):
+        """
+        Stream every document in a shuffled order, with a bounded amount of memory.
+
+        `interleave` files are read at the same time and every document comes from a random one of them. The
+        documents then go through a shuffle buffer of `buffer_size` documents. With `seed` the order is reproducible
+        and changes with `set_epoch`. The file order is shuffled as well.
 
-    def _stream_data_threaded(self, q, get_meta=False, autojoin_sentences=False, sent_joiner=" "):
-        for data in self._stream_data(get_meta, autojoin_sentences, sent_joiner):
-            q.put(data)
-        q.put(None)
+        Args:
+            buffer_size (int, optional): Number of documents held in the shuffle buffer. 1 disables it. Defaults to 10000.
+            interleave (int, optional): Number of files read at the same time. Defaults to 4.
+        """
+        rng = random.Random(f"{self.seed}-{self.epoch}-docs") if self.seed is not None else random.Random()
+        stream_kwargs = {"get_meta": get_meta, "autojoin_sentences": autojoin_sentences, "sent_joiner": sent_joiner}
+        tasks = self._get_tasks()
+        if self.seed is None:
+            # `_get_tasks` only shuffles the files with a seed
+            rng.shuffle(tasks)
+        # documents are not read in order, the position can't be saved
+        self._position = None
+
+        streams = (self._stream_task(task, **stream_kwargs) for task in _prefetch_tasks(tasks, self.prefetch))
+        docs = interleave_streams(streams, interleave, rng)
+        if buffer_size > 1:
+            docs = shuffle_buffer(docs, buffer_size, rng)
+        yield from docs
+
+    def stream_arrow_batches(self, columns: Optional[List[str]] = None, filter=None, batch_size: Optional[int] = None):
+        """
+        Stream `pyarrow.RecordBatch`es of the Parquet / Arrow IPC files under `in_path` (see `export_arrow`),
+        with the same file order, partition and resume as `stream_data`.
+
+        Only `columns` are read, so e.g. `columns=["meta.source"]` never decompresses the texts, and `filter` is pushed
+        down to the files: Parquet row groups whose statistics don't match are skipped. Batches of uncompressed Arrow
+        IPC files are zero-copy views of the memory mapped file.
+
+        Args:
+            columns (List[str], optional): Columns to read, `text` and `meta.<key>`. Defaults to None (all).
+            filter (pyarrow.compute.Expression, optional):
+                Rows to keep, e.g. `pc.field("meta.source") == "news"`. Positions saved by `state_dict` count the rows
+                after it, so resume with the same filter. Defaults to None.
+            batch_size (int, optional): Max number of rows per batch. Defaults to pyarrow's default.
+
+        Example:
+            for batch in rdr.stream_arrow_batches(columns=["meta.source"]):
+                ...
+        """
+        for task_idx, task in enumerate(_prefetch_tasks(self._get_tasks(), self.prefetch)):
+            if not task.file.endswith(ARROW_SUFFIXES):
+                raise ValueError(f"{task.file} is not a Parquet or Arrow file. Convert it with `export_arrow` first.")
+            position = self._position = [task_idx, 0]
+
+            num_rows = 0  # rows of the file so far, to cut `[start, stop)`
+            for batch in iter_arrow_batches(task.file, columns, filter, batch_size):
+                begin, end = num_rows, num_rows + batch.num_rows
+                num_rows = end
+                if end <= task.start:
+                    continue
+                if task.stop is not None and begin >= task.stop:
+                    break
+                if begin < task.start or (task.stop is not None and end > task.stop):
+                    stop = end if task.stop is None else min(end, task.stop)
+                    batch = batch.slice(max(task.start - begin, 0), stop - max(begin, task.start))
+                position[1] += batch.num_rows
+                yield batch
+
+    def export_arrow(
+        self,
+        out_dir: str,
+        file_format: str = "parquet",
+        batch_size: int = 10000,
+        infer_rows: int = 10000,
+        compression: Optional[str] = "zstd",
+    ) -> List[str]:
+        """
+        Convert the `.jsonl.zst` files under `in_path` to Parquet or Arrow IPC files in `out_dir`, one per file,
+        with a `text` column and a `meta.<key>` column for every meta key. Other files are skipped.
 
-    def _stream_data(self, get_meta=False, autojoin_sentences=False, sent_joiner=" ", jsonl_key="text"):
+        Column types are inferred from the first `infer_rows` documents of every file and the values listed in its
+        manifest, and the keys listed there get a column even if they don't show up in those documents. Keys with
+        values of mixed or unknown types are stored as JSON strings, which are decoded back when read.
+
+        Args:
+            out_dir (str): Output directory path
+            file_format (str, optional):
+                `parquet` (compressed, row groups of `batch_size` rows with statistics for filters) or
+                `arrow` (Arrow IPC, uncompressed for zero-copy reads). Defaults to "parquet".
+            batch_size (int, optional): Rows per Parquet row group / Arrow record batch. Defaults to 10000.
+            infer_rows (int, optional): Number of documents the column types are inferred from. Defaults to 10000.
+            compression (str, optional): Parquet compression codec. Defaults to "zstd".
+
+        Returns:
+            List[str]: Paths of the written files
         """
-        - Support format: jsonl.zst, json, dat, txt, zip, tar.gz
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"Unsupported file format: {file_format}")
+        os.makedirs(out_dir, exist_ok=True)
+
+        paths = []
+        for f in self._list_files():
+            if not f.endswith(".jsonl.zst"):
+                logger.info(f"Skipping {f}, only .jsonl.zst files are exported")
+                continue
+            manifest = self._get_manifest(f)
+            path = os.path.join(out_dir, os.path.basename(f)[: -len(".jsonl.zst")] + "." + file_format)
+            write_arrow_file(
+                path,
+                self.read_jsonl(f, get_meta=True, autojoin_sentences=True),
+                meta_keys=manifest["meta_keys"] if manifest is not None else (),
+                meta_values=manifest.get("meta_values") if manifest is not None else None,
+                batch_size=batch_size,
+                infer_rows=infer_rows,
+                compression=compression,
+            )
+            paths.append(path)
+        return paths
+
+    async def astream_data(
+        self,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        read_ahead=2,
+        batch_size=BATCH_SIZE,
+        batch_bytes=None,
+    ):
+        """
+        Async version of `stream_data`, for asyncio data loaders. Same output and order.
+
+        Files are opened, read and decoded in `read_ahead` threads, so the event loop never blocks and the next files
+        are decoded while the current one is consumed. Each file sends its documents back in batches through a
+        bounded queue, so a slow consumer pauses the threads.
+
+        Args:
+            read_ahead (int, optional): Number of files decoded at the same time. Defaults to 2.
+            batch_size (int, optional): Max number of documents per batch sent from the threads. Defaults to 256.
+            batch_bytes (int, optional): Max UTF-8 size of the texts per batch. Defaults to None (no limit).
+
+        Example:
+            async for data in rdr.astream_data(get_meta=True):
+                ...
+        """
+        if read_ahead < 1:
+            raise ValueError("read_ahead should be a positive integer")
+
+        loop = asyncio.get_running_loop()
+        tasks = await loop.run_in_executor(None, self._get_tasks)
+        # the threads wait on `slots` when a queue is full, instead of awaiting `put` from outside the loop
+        queues = [(asyncio.Queue(), threading.Semaphore(QUEUE_SIZE)) for _ in tasks]
+        stop_event = threading.Event()
+        stream_kwargs = {"get_meta": get_meta, "autojoin_sentences": autojoin_sentences, "sent_joiner": sent_joiner}
+
+        # the executor runs the files in order, at most `read_ahead` at a time
+        executor = ThreadPoolExecutor(max_workers=read_ahead, thread_name_prefix="kldf-reader")
+        try:
+            for task, (aq, slots) in zip(tasks, queues):
+                executor.submit(
+                    _stream_file_to_async_queue,
+                    self,
+                    task,
+                    aq,
+                    slots,
+                    loop,
+                    stop_event,
+                    stream_kwargs,
+                    batch_size,
+                    batch_bytes,
+                )
+
+            for task_idx, (aq, slots) in enumerate(queues):
+                self._position = [task_idx, 0]
+                while True:
+                    kind, payload = await aq.get()
+                    slots.release()
+                    if kind == _MSG_FILE_DONE:
+                        break
+                    if kind == _MSG_ERROR:
+                        raise payload
+                    for data in payload:
+                        self._position[1] += 1
+                        yield data
+        finally:
+            stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _stream_batches_parallel(
+        self,
+        num_proc,
+        ordered=True,
+        batch_size=BATCH_SIZE,
+        batch_bytes=None,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        meta_filter=None,
+    ):
+        """
+        Decode files in `num_proc` worker processes and yield the batches they send back.
+
+        Worker `i` reads files `i, i + num_proc, ...`. In ordered mode every worker has its own queue and the files
+        are collected round-robin, so the output is the same as `_stream_data`. In unordered mode all workers share
+        one queue.
+        """
+        tasks = self._get_tasks()
+        if not tasks:
+            return
+        num_proc = min(num_proc, len(tasks))
+
+        stop_event = mp.Event()
+        if ordered:
+            queues = [mp.Queue(QUEUE_SIZE) for _ in range(num_proc)]
+        else:
+            queues = [mp.Queue(QUEUE_SIZE)] * num_proc
+
+        stream_kwargs = {
+            "get_meta": get_meta,
+            "autojoin_sentences": autojoin_sentences,
+            "sent_joiner": sent_joiner,
+            "meta_filter": meta_filter,
+        }
+        procs = [
+            mp.Process(
+                target=_stream_files_worker,
+                args=(self, tasks[i::num_proc], queues[i], stop_event, stream_kwargs, batch_size, batch_bytes),
+                daemon=True,
+            )
+            for i in range(num_proc)
+        ]
+        for p in procs:
+            p.start()
+
+        try:
+            if ordered:
+                for task_idx in range(len(tasks)):
+                    q = queues[task_idx % num_proc]
+                    # the caller counts the records it yields, the records of a filtered file are unknown
+                    self._position = [task_idx, 0] if meta_filter is None else None
+                    while True:
+                        kind, payload = _get_from_workers(q, procs)
+                        if kind == _MSG_FILE_DONE:
+                            break
+                        if self.metrics is not None:
+                            _measure_batch(payload, q, self.metrics)
+                        yield payload
+            else:
+                self._position = None
+                remaining = num_proc
+                while remaining:
+                    kind, payload = _get_from_workers(queues[0], procs)
+                    if kind == _MSG_WORKER_DONE:
+                        remaining -= 1
+                    elif kind == _MSG_BATCH:
+                        if self.metrics is not None:
+                            _measure_batch(payload, queues[0], self.metrics)
+                        yield payload
+        finally:
+            _shutdown_workers(procs, list(dict.fromkeys(queues)), stop_event)
+
+    def _stream_data(
+        self, get_meta=False, autojoin_sentences=False, sent_joiner=" ", jsonl_key="text", meta_filter=None
+    ):
+        """
+        - Support format: jsonl.zst, json, dat, txt, zip, tar.gz, tar.zst
 
         Args:
             get_meta (bool, optional): Whether to get meta data. Only jsonl file has metadata. Defaults to False.
@@ -60,39 +819,161 @@ class Reader:
                 (text: str, meta: dict)
         """
         self.f_name = ""
-        for f in listdir_or_file(self.in_path):
-            self.f_name = f
-            if f.endswith(".jsonl.zst"):
-                yield from self.read_jsonl(
-                    f, get_meta=get_meta, autojoin_sentences=autojoin_sentences, sent_joiner=sent_joiner, key=jsonl_key
-                )
-            elif f.endswith(".dat.zst"):
-                assert not get_meta
-                yield from self.read_dat(f)
-            elif f.endswith(".jsonl.zst.tar"):
-                yield from self.read_jsonl_tar(
-                    f, get_meta=get_meta, autojoin_sentences=autojoin_sentences, sent_joiner=sent_joiner, key=jsonl_key
+        tasks = self._get_tasks()
+        if meta_filter is not None:
+            self._position = None
+        for task_idx, task in enumerate(_prefetch_tasks(tasks, self.prefetch)):
+            if meta_filter is not None:
+                # `state_dict` needs the records read, not the ones yielded
+                yield from self._stream_task(
+                    task,
+                    get_meta=get_meta,
+                    autojoin_sentences=autojoin_sentences,
+                    sent_joiner=sent_joiner,
+                    jsonl_key=jsonl_key,
+                    meta_filter=meta_filter,
                 )
-            elif f.endswith(".json.zst"):
-                assert not get_meta
-                yield from self.read_json(f)
-            elif f.endswith(".txt"):
-                assert not get_meta
-                yield from self.read_txt(f)
-            elif f.endswith(".zip"):
-                assert not get_meta
-                yield from self.read_zip(f)
-            elif f.endswith(".tar.gz"):
-                assert not get_meta
-                yield from self.read_tgz(f)
-            elif f.endswith(".json.gz"):
-                assert not get_meta
-                yield from self.read_jsongz(f)
-            elif f.endswith(".gz"):
-                assert not get_meta
-                yield from self.read_gz(f)
+                continue
+
+            position = self._position = [task_idx, 0]
+            for data in self._stream_task(
+                task,
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                jsonl_key=jsonl_key,
+            ):
+                position[1] += 1
+                yield data
+
+    def _stream_task(self, task, **stream_kwargs):
+        if self.metrics is not None:
+            yield from _measure_docs(self._stream_task_docs(task, **stream_kwargs), self.metrics)
+            self.metrics.count("read.files")
+            self.metrics.count("read.bytes_in", self._get_task_bytes(task))
+            self.metrics.emit("file")
+            return
+        yield from self._stream_task_docs(task, **stream_kwargs)
+
+    def _stream_task_docs(self, task, meta_filter=None, **stream_kwargs):
+        if meta_filter is not None:
+            if not task.file.endswith(META_SUFFIXES):
+                # no metadata, every record has `{}`
+                if not meta_filter({}):
+                    return
+                meta_filter = None
+            elif not meta_filter.may_match(self._get_manifest(task.file)):
+                return
+            elif task.start or task.stop is not None:
+                # the record range is counted before the filter
+                get_meta = stream_kwargs.pop("get_meta", False)
+                for text, meta in self._stream_task_docs(task, get_meta=True, **stream_kwargs):
+                    if meta_filter(meta):
+                        yield (text, meta) if get_meta else text
+                return
             else:
-                logger.info(f"Skipping {f} as streaming for that filetype is not implemented")
+                stream_kwargs["meta_filter"] = meta_filter
+
+        if task.start and not (task.file.endswith(".jsonl.zst") and self._get_index(task.file) is not None):
+            # no index to start from, decode the file up to `start`
+            docs = self._stream_file(task.file, member=task.member, **stream_kwargs)
+            yield from islice(docs, task.start, task.stop)
+            return
+
+        docs = self._stream_file(task.file, start=task.start, member=task.member, **stream_kwargs)
+        if task.stop is not None:
+            docs = islice(docs, task.stop - task.start)
+        yield from docs
+
+    def _stream_file(
+        self,
+        f,
+        get_meta=False,
+        autojoin_sentences=False,
+        sent_joiner=" ",
+        jsonl_key="text",
+        start=0,
+        member=None,
+        meta_filter=None,
+    ):
+        """Stream the documents of a single file (or of its tar `member`), dispatching on its extension."""
+        self.f_name = f
+        if start and not f.endswith(".jsonl.zst"):
+            raise ValueError(f"Seeking is only supported for indexed .jsonl.zst files, not {f}")
+
+        if f.endswith(ARROW_SUFFIXES):
+            yield from self.read_arrow(f, get_meta=get_meta, meta_filter=meta_filter)
+        elif f.endswith(".jsonl.zst"):
+            yield from self.read_jsonl(
+                f,
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                key=jsonl_key,
+                start=start,
+                meta_filter=meta_filter,
+            )
+        elif f.endswith(".dat.zst"):
+            assert not get_meta
+            yield from self.read_dat(f)
+        elif f.endswith(".jsonl.zst.tar"):
+            yield from self.read_jsonl_tar(
+                f,
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                key=jsonl_key,
+                member=member,
+                meta_filter=meta_filter,
+            )
+        elif f.endswith(".json.zst"):
+            assert not get_meta
+            yield from self.read_json(f, autojoin_sentences=autojoin_sentences, sent_joiner=sent_joiner)
+        elif f.endswith(".txt"):
+            assert not get_meta
+            yield from self.read_txt(f)
+        elif f.endswith(".zip"):
+            assert not get_meta
+            yield from self.read_zip(f)
+        elif f.endswith(".tar.gz"):
+            yield from self.read_tgz(
+                f,
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                key=jsonl_key,
+                meta_filter=meta_filter,
+            )
+        elif f.endswith(".tar.zst"):
+            yield from self.read_tar_zst(
+                f,
+                get_meta=get_meta,
+                autojoin_sentences=autojoin_sentences,
+                sent_joiner=sent_joiner,
+                key=jsonl_key,
+                meta_filter=meta_filter,
+            )
+        elif f.endswith(".json.gz"):
+            assert not get_meta
+            yield from self.read_jsongz(f)
+        elif f.endswith(".gz"):
+            assert not get_meta
+            yield from self.read_gz(f)
+        else:
+            logger.info(f"Skipping {f} as streaming for that filetype is not implemented")
+
+    def read_arrow(self, file, get_meta=False, meta_filter=None):
+        """Read a Parquet or Arrow IPC file written by `export_arrow`. Without `get_meta` only `text` is read."""
+        if meta_filter is not None:
+            for batch in iter_arrow_batches(file):
+                for text, meta in batch_to_docs(batch, get_meta=True):
+                    if meta_filter(meta):
+                        yield (text, meta) if get_meta else text
+            return
+
+        columns = None if get_meta else ["text"]
+        for batch in iter_arrow_batches(file, columns=columns):
+            yield from batch_to_docs(batch, get_meta)
 
     def read_txt(self, file):
         with open(file, "r", encoding="utf-8") as fh:
@@ -103,9 +984,36 @@ class Reader:
         for f in archive.namelist():
             yield archive.read(f).decode("UTF-8")
 
-    def read_tgz(self, file):
-        gz = gzip.open(file)
-        yield from (x.decode("utf-8") for x in tarfile_reader(gz, streaming=False))
+    def read_tgz(self, file, get_meta=False, autojoin_sentences=False, sent_joiner=" ", key="text", meta_filter=None):
+        with gzip.open(file, "rb") as gz:
+            yield from self.read_tar_members(gz, get_meta, autojoin_sentences, sent_joiner, key, meta_filter)
+
+    def read_tar_zst(
+        self, file, get_meta=False, autojoin_sentences=False, sent_joiner=" ", key="text", meta_filter=None
+    ):
+        with open(file, "rb") as fh:
+            reader = zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True)
+            yield from self.read_tar_members(reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter)
+
+    def read_tar_members(
+        self, tar_stream, get_meta=False, autojoin_sentences=False, sent_joiner=" ", key="text", meta_filter=None
+    ):
+        """
+        Stream the documents of every member of a tar stream, one member at a time.
+
+        `.jsonl.zst` members (archive shards) are decoded record by record, straight from the tar stream.
+        Any other member, plain `.jsonl` included, is read as a single text document, like `.txt` files.
+        """
+        for member in iter_tar_members(tar_stream):
+            if member.name.endswith(".jsonl.zst"):
+                cctx = zstandard.ZstdDecompressor()
+                reader = io.BufferedReader(cctx.stream_reader(member, read_across_frames=True))
+                yield from self._handle_jsonl_stream(
+                    reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter
+                )
+            elif meta_filter is None or meta_filter({}):
+                assert not get_meta
+                yield member.read().decode("utf-8")
 
     def read_gz(self, file):
         with gzip.open(file, "rb") as f:
@@ -116,25 +1024,67 @@ class Reader:
         for line in self.read_gz(file):
             yield json.loads(line)
 
-    def read_json(self, file):
+    def read_json(self, file, autojoin_sentences=False, sent_joiner=" "):
+        """Read `.json.zst` data. Documents stored as a list of sentences are joined with `autojoin_sentences`."""
         with open(file, "rb") as fh:
-            cctx = zstandard.ZstdDecompressor()
+            cctx = self._get_decompressor(file)
             reader = cctx.stream_reader(fh)
             ob = json.load(reader)
-            yield from ob
+            if not autojoin_sentences:
+                yield from ob
+                return
+            for data in ob:
+                yield sent_joiner.join(data) if isinstance(data, list) else data
+
+    def read_dat(self, file, as_memoryview: bool = False):
+        """
+        Read `.dat.zst` data.
 
-    def read_dat(self, file):
+        Version 2 files are decompressed once and every record is sliced out of the buffer with the offset table.
+        Version 1 files (`%016d` length prefix) are streamed.
+
+        Args:
+            file (str): input file path
+            as_memoryview (bool, optional):
+                Yield `memoryview`s of the UTF-8 bytes instead of `str`, without copying.
+                They are only valid until the generator is exhausted or closed. Defaults to False.
+        """
         with open(file, "rb") as fh:
-            cctx = zstandard.ZstdDecompressor()
+            cctx = self._get_decompressor(file)
             reader = cctx.stream_reader(fh)
-            while True:
-                ln = reader.read(16).decode("UTF-8")
-                if not ln:
-                    break
+            head = reader.read(len(DAT_MAGIC))
+            if head != DAT_MAGIC:
+                yield from _iter_dat_v1(head, reader, as_memoryview)
+                return
+
+            if self.dat_cache_dir is None:
+                yield from _iter_dat_v2(reader.read(), as_memoryview)
+                return
 
-                ln = int(ln)
+            cache_path = self._cache_dat(file, reader)
 
-                yield reader.read(ln).decode("UTF-8")
+        with open(cache_path, "rb") as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield from _iter_dat_v2(mm, as_memoryview)
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # the caller still holds a memoryview, the mapping is released with it
+                pass
+
+    def _cache_dat(self, file, reader):
+        """Decompress the rest of `reader` into `dat_cache_dir` unless this version of `file` is already there"""
+        st = os.stat(file)
+        cache_path = os.path.join(self.dat_cache_dir, f"{os.path.basename(file)}.{st.st_size}.{st.st_mtime_ns}.raw")
+        if not os.path.exists(cache_path):
+            os.makedirs(self.dat_cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as out:
+                shutil.copyfileobj(reader, out, 1 << 20)
+            os.replace(tmp_path, cache_path)
+        return cache_path
 
     def read_jsonl(
         self,
@@ -143,6 +1093,8 @@ class Reader:
         autojoin_sentences: bool = True,
         sent_joiner: str = " ",
         key: str = "text",
+        start: int = 0,
+        meta_filter: Optional[MetaFilter] = None,
     ):
         """
         Read Jsonl data.
@@ -153,12 +1105,54 @@ class Reader:
             autojoin_sentences (bool, optional): Join sentences if data consists of multiple texts (=paragraph). Defaults to True.
             sent_joiner (str, optional): Seperator for joining multiple sentences. Defaults to "\n\n".
             key (str, optional): Json key name for text. Defaults to "text".
+            start (int, optional): First record to read. Needs the file's index if > 0. Defaults to 0.
+            meta_filter (MetaFilter, optional): Only read the records whose meta matches. Defaults to None.
         """
         with open(file_path, "rb") as fh:
-            cctx = zstandard.ZstdDecompressor()
-            reader = io.BufferedReader(cctx.stream_reader(fh))
+            skip = 0
+            if start:
+                index = self._get_index(file_path)
+                if index is None:
+                    raise ValueError(f"{file_path} has no index. Write it with `Archive(frame_size=...)` to seek.")
+                frame = start // index.frame_size
+                fh.seek(index.offsets[frame])
+                skip = start - frame * index.frame_size
+
+            cctx = self._get_decompressor(file_path)
+            reader = io.BufferedReader(cctx.stream_reader(fh, read_across_frames=True))
+            for _ in range(skip):
+                reader.readline()
+            yield from self._handle_jsonl_stream(reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter)
+
+    def _handle_jsonl_stream(self, reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter=None):
+        if meta_filter is not None:
+            yield from self._filter_jsonl_stream(reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter)
+            return
+
+        if self.strict_jsonl:
             rdr = jsonlines.Reader(reader)
             yield from handle_jsonl(rdr, get_meta, autojoin_sentences, sent_joiner, key)
+        else:
+            if self.metrics is not None:
+                reader = _TimedReader(reader, self.metrics, "read.decompress")
+            lines = iter_lines(reader)
+            yield from handle_jsonl_lines(lines, self.json_loads, get_meta, autojoin_sentences, sent_joiner, key)
+
+    def _filter_jsonl_stream(self, reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter):
+        if self.strict_jsonl:
+            docs = handle_jsonl(jsonlines.Reader(reader), True, autojoin_sentences, sent_joiner, key)
+        else:
+            if self.metrics is not None:
+                reader = _TimedReader(reader, self.metrics, "read.decompress")
+            lines = iter_lines(reader)
+            if meta_filter.has_prefilter:
+                # lines without any of the values are dropped before they are decoded
+                lines = (line for line in lines if meta_filter.prefilter(line))
+            docs = handle_jsonl_lines(lines, self.json_loads, True, autojoin_sentences, sent_joiner, key)
+
+        for text, meta in docs:
+            if meta_filter(meta):
+                yield (text, meta) if get_meta else text
 
     def read_jsonl_tar(
         self,
@@ -167,11 +1161,282 @@ class Reader:
         autojoin_sentences: bool = True,
         sent_joiner: str = " ",
         key="text",
+        member: Optional[int] = None,
+        meta_filter: Optional[MetaFilter] = None,
     ):
+        """
+        Read a tar of `.jsonl.zst` files. The tar is mapped in memory once and every member is decompressed straight
+        from the mapping.
+
+        Args:
+            member (int, optional): Only read the member at this position of the member table. Defaults to None (all).
+        """
+        members = self._get_tar_members(file_path)
+        if member is not None:
+            members = members[member : member + 1]
+        if not members:
+            return
+
         with open(file_path, "rb") as fh:
-            for f in tarfile_reader(fh, streaming=True):
-                cctx = zstandard.ZstdDecompressor()
-                reader = io.BufferedReader(cctx.stream_reader(f))
-                rdr = jsonlines.Reader(reader)
-                yield from handle_jsonl(rdr, get_meta, autojoin_sentences, sent_joiner, key)
-                f.close()
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for entry in members:
+                with MappedTarMember(mm, *entry) as f:
+                    cctx = zstandard.ZstdDecompressor()
+                    reader = io.BufferedReader(cctx.stream_reader(f.data, read_across_frames=True))
+                    yield from self._handle_jsonl_stream(
+                        reader, get_meta, autojoin_sentences, sent_joiner, key, meta_filter
+                    )
+                    # the zstd reader holds a view of the member until it is freed
+                    del reader
+        finally:
+            close_mmap(mm)
+
+
+def _put_until_stopped(q, item, stop_event):
+    """`q.put` that gives up once the consumer has stopped reading. Returns False if it gave up."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _text_bytes(data):
+    """UTF-8 size of the text part of a streamed document."""
+    if isinstance(data, tuple):
+        data = data[0]
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    if isinstance(data, list):
+        return sum(len(x.encode("utf-8")) for x in data if isinstance(x, str))
+    return 0
+
+
+def _iter_batches(docs, batch_size=BATCH_SIZE, batch_bytes=None):
+    """Group `docs` into lists of at most `batch_size` documents and (roughly) `batch_bytes` bytes of text."""
+    batch = []
+    size = 0
+    for data in docs:
+        batch.append(data)
+        if batch_bytes is not None:
+            size += _text_bytes(data)
+        if len(batch) >= batch_size or (batch_bytes is not None and size >= batch_bytes):
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def _stream_files_worker(reader, tasks, q, stop_event, stream_kwargs, batch_size=BATCH_SIZE, batch_bytes=None):
+    """Worker process for `Reader._stream_batches_parallel`."""
+    try:
+        for task in _prefetch_tasks(tasks, reader.prefetch):
+            docs = reader._stream_task(task, **stream_kwargs)
+            for batch in _iter_batches(docs, batch_size, batch_bytes):
+                if not _put_until_stopped(q, (_MSG_BATCH, batch), stop_event):
+                    return
+            if not _put_until_stopped(q, (_MSG_FILE_DONE, None), stop_event):
+                return
+        _put_until_stopped(q, (_MSG_WORKER_DONE, None), stop_event)
+    except Exception:
+        _put_until_stopped(q, (_MSG_ERROR, traceback.format_exc()), stop_event)
+    finally:
+        if stop_event.is_set():
+            # Don't wait for the queue's feeder thread to flush into a pipe nobody reads anymore
+            q.cancel_join_thread()
+
+
+def _measure_docs(docs, metrics):
+    """Yield `docs`, adding the time spent in `next` to `read.decode` and counting `read.records`."""
+    docs = iter(docs)
+    total = 0.0
+    num_records = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                data = next(docs)
+            finally:
+                total += time.perf_counter() - start
+            num_records += 1
+            yield data
+    except StopIteration:
+        pass
+    finally:
+        # once per file (or when the stream is closed), so the lock is not taken per document
+        metrics.add_time("read.decode", total)
+        metrics.count("read.records", num_records)
+
+
+def _measure_batch(batch, q, metrics):
+    """Count a batch received from the worker processes, and the depth of their queue."""
+    metrics.count("read.records", len(batch))
+    try:
+        metrics.set_gauge("read.queue_depth", q.qsize())
+    except NotImplementedError:
+        # `qsize` is not implemented on macOS
+        pass
+
+
+class _TimedReader:
+    """Binary stream that adds the time spent reading from `reader` to the timer `name` of `metrics`."""
+
+    def __init__(self, reader, metrics, name):
+        self._reader = reader
+        self._metrics = metrics
+        self._name = name
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self._reader.read(size)
+        self._metrics.add_time(self._name, time.perf_counter() - start)
+        return data
+
+
+def _warm_file(path, stop_event):
+    """Read `path` once so it is in the page cache when it gets opened for decoding."""
+    with open(path, "rb", buffering=0) as fh:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        # fadvise is only a hint (and a no-op on some network filesystems), so read through the file as well
+        buf = bytearray(PREFETCH_BLOCK_SIZE)
+        while not stop_event.is_set() and fh.readinto(buf):
+            pass
+
+
+class _ShardPrefetcher:
+    """Warm files in `depth` background threads, each file once."""
+
+    def __init__(self, depth):
+        self._executor = ThreadPoolExecutor(max_workers=depth, thread_name_prefix="kldf-prefetch")
+        self._stop_event = threading.Event()
+        self._warmed = set()
+
+    def warm(self, f):
+        if f not in self._warmed:
+            self._warmed.add(f)
+            self._executor.submit(_warm_file, f, self._stop_event)
+
+    def close(self):
+        self._stop_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _prefetch_tasks(tasks, depth):
+    """Yield `tasks`, warming the files of the next `depth` files while each task is processed."""
+    if depth < 1:
+        yield from tasks
+        return
+
+    files = list(dict.fromkeys(task.file for task in tasks))
+    file_pos = {f: i for i, f in enumerate(files)}
+    prefetcher = _ShardPrefetcher(depth)
+    try:
+        for task in tasks:
+            i = file_pos[task.file]
+            for f in files[i + 1 : i + 1 + depth]:
+                prefetcher.warm(f)
+            yield task
+    finally:
+        prefetcher.close()
+
+
+def _put_async_until_stopped(aq, slots, item, loop, stop_event):
+    """`aq.put` from a thread, blocking while all `slots` are taken. Returns False if the consumer has stopped."""
+    while not slots.acquire(timeout=0.1):
+        if stop_event.is_set():
+            return False
+    try:
+        loop.call_soon_threadsafe(aq.put_nowait, item)
+    except RuntimeError:
+        # event loop closed
+        return False
+    return True
+
+
+def _stream_file_to_async_queue(reader, task, aq, slots, loop, stop_event, stream_kwargs, batch_size, batch_bytes):
+    """Thread target for `Reader.astream_data`: decode one file into `aq`."""
+    if stop_event.is_set():
+        return
+    try:
+        docs = reader._stream_task(task, **stream_kwargs)
+        for batch in _iter_batches(docs, batch_size, batch_bytes):
+            if not _put_async_until_stopped(aq, slots, (_MSG_BATCH, batch), loop, stop_event):
+                return
+        _put_async_until_stopped(aq, slots, (_MSG_FILE_DONE, None), loop, stop_event)
+    except Exception as e:
+        _put_async_until_stopped(aq, slots, (_MSG_ERROR, e), loop, stop_event)
+
+
+def _get_from_workers(q, procs):
+    """`q.get` that raises instead of blocking forever when a worker dies or fails."""
+    while True:
+        try:
+            kind, payload = q.get(timeout=1.0)
+        except queue.Empty:
+            for p in procs:
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError(f"Reader worker {p.name} died with exit code {p.exitcode}")
+            continue
+        if kind == _MSG_ERROR:
+            raise RuntimeError(f"Reader worker failed:\n{payload}")
+        return kind, payload
+
+
+def _shutdown_workers(procs, queues, stop_event, timeout=5.0):
+    """Stop the workers even when the consumer left the generator early."""
+    stop_event.set()
+    for q in queues:
+        # Unblock workers that are waiting in `q.put`
+        try:
+            while True:
+                q.get_nowait()
+        except (queue.Empty, OSError, ValueError):
+            pass
+    for p in procs:
+        p.join(timeout)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+    for q in queues:
+        q.close()
+        q.cancel_join_thread()
+
+
+def _iter_dat_v1(head, reader, as_memoryview=False):
+    """Records of a version 1 `.dat.zst`, `head` being the bytes already read from `reader`"""
+    ln = head + reader.read(16 - len(head)) if head else head
+    while ln:
+        data = reader.read(int(ln.decode("UTF-8")))
+        yield memoryview(data) if as_memoryview else data.decode("UTF-8")
+        ln = reader.read(16)
+
+
+def _iter_dat_v2(buf, as_memoryview=False):
+    """Records of a version 2 `.dat.zst`, `buf` being the decompressed data after the magic header"""
+    mv = memoryview(buf)
+    table_end = len(mv) - DAT_FOOTER.size
+    num_records, magic = DAT_FOOTER.unpack_from(mv, table_end)
+    if magic != DAT_MAGIC:
+        raise ValueError("Corrupted dat file: footer magic mismatch")
+    table = mv[table_end - 8 * (num_records + 1) : table_end]
+    if sys.byteorder == "little":
+        offsets = table.cast("Q")
+    else:
+        offsets = array("Q", table.tobytes())
+        offsets.byteswap()
+
+    try:
+        for i in range(num_records):
+            data = mv[offsets[i] : offsets[i + 1]]
+            yield data if as_memoryview else str(data, "UTF-8")
+    finally:
+        # release our own views so an mmap'd buffer can be closed
+        if isinstance(offsets, memoryview):
+            offsets.release()
+        table.release()
+        mv.release()
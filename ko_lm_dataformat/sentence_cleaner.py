@@ -1,4 +1,14 @@
+import multiprocessing as mp
+import re
 import unicodedata
+from functools import lru_cache, partial
+from typing import List
+
+
+# Control characters in ASCII, except "\t", "\n", "\r"
+_ASCII_CONTROL_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+# Characters outside of the BMP. Rare enough to be checked one by one.
+_ASTRAL_RE = re.compile("[\U00010000-\U0010ffff]")
 
 
 def _is_control(char):
@@ -14,6 +24,45 @@ def _is_control(char):
     return False
 
 
+@lru_cache(maxsize=None)
+def _get_bmp_control_re():
+    """
+    Regex matching every BMP character removed by `clean_sentence` (`_is_control` or U+FFFD).
+
+    Built from `unicodedata` on first use. The class only holds BMP characters, so `re` compiles it into a bitmap
+    and matching costs the same for every character.
+    """
+    ranges = []
+    start = None
+    for cp in range(0x10000):
+        removed = _is_control(chr(cp)) or cp == 0xFFFD
+        if removed and start is None:
+            start = cp
+        elif not removed and start is not None:
+            ranges.append((start, cp - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, 0xFFFF))
+
+    return re.compile("[" + "".join(f"\\u{a:04x}-\\u{b:04x}" for a, b in ranges) + "]")
+
+
+def _remove_astral_control(match):
+    char = match.group()
+    return "" if _is_control(char) else char
+
+
+def remove_control_chars(sentence):
+    """Remove control characters (except "\\t", "\\n", "\\r") and U+FFFD"""
+    if sentence.isascii():
+        return _ASCII_CONTROL_RE.sub("", sentence)
+
+    sentence = _get_bmp_control_re().sub("", sentence)
+    if sentence and max(sentence) > "\uffff":
+        sentence = _ASTRAL_RE.sub(_remove_astral_control, sentence)
+    return sentence
+
+
 def clean_sentence(sentence, remove_control=True):
     """
     - NFC Normalization
@@ -23,15 +72,31 @@ def clean_sentence(sentence, remove_control=True):
       - double whitespace, \n, \r, \t -> simple whitespace (" ")
       - Unify all Zs to simple whitespace (" ")
     """
-    sentence = unicodedata.normalize("NFC", sentence)
+    # ASCII is already NFC
+    if not sentence.isascii():
+        sentence = unicodedata.normalize("NFC", sentence)
 
     if remove_control:
-        output = []
-        for char in sentence:
-            if _is_control(char) or ord(char) == 0xFFFD:
-                continue
-            output.append(char)
+        sentence = remove_control_chars(sentence)
+
+    return " ".join(sentence.split())
 
-        sentence = "".join(output)
 
-    return " ".join(sentence.strip().split())
+def clean_sentences(
+    sentences: List[str], remove_control: bool = True, num_proc: int = 0, chunksize: int = 1000
+) -> List[str]:
+    """
+    `clean_sentence` over a list, keeping the order.
+
+    Args:
+        sentences (List[str]): Sentences to clean
+        remove_control (bool, optional): Remove control characters. Defaults to True.
+        num_proc (int, optional): Number of processes. 0 or 1 will clean in the current process. Defaults to 0.
+        chunksize (int, optional): Number of sentences sent to a process at once. Defaults to 1000.
+    """
+    clean_fn = partial(clean_sentence, remove_control=remove_control)
+    if num_proc <= 1:
+        return list(map(clean_fn, sentences))
+
+    with mp.Pool(num_proc) as pool:
+        return pool.map(clean_fn, sentences, chunksize=chunksize)
@@ -1,5 +1,7 @@
 import importlib
 import logging
+import multiprocessing as mp
+from functools import partial
 from typing import List
 
 from .sentence_cleaner import clean_sentence
@@ -7,20 +9,71 @@ from .sentence_cleaner import clean_sentence
 
 logger = logging.getLogger(__name__)
 
+_worker_splitter = None  # splitter of the current pool worker, see `_init_worker`
+
+
+def _init_worker(splitter):
+    global _worker_splitter
+    _worker_splitter = splitter
+
+
+def _split_in_worker(document, clean_sent=False):
+    return _worker_splitter.split(document, clean_sent=clean_sent)
+
 
 class SentenceSplitterBase:
     """Base Class for sentence splitter"""
 
-    def __init__(self):
+    def __init__(self, num_proc: int = 0):
+        """
+        Args:
+            num_proc (int, optional):
+                Number of processes for `split_batch`. The pool is started on the first call and reused,
+                so every worker sets up the splitter once. 0 or 1 will split in the current process. Defaults to 0.
+        """
         self.splitter = None
+        self.num_proc = num_proc
+        self._pool = None
 
     def split(self, document: str, clean_sent: bool) -> List[str]:
         raise NotImplementedError
 
+    def split_batch(self, documents: List[str], clean_sent: bool = False, chunksize: int = 16) -> List[List[str]]:
+        """
+        Split many documents, in `num_proc` processes if set. The output keeps the order of `documents`.
+
+        Args:
+            documents (List[str]): Documents to split
+            clean_sent (bool): Whether to clean the sentences. Defaults to False.
+            chunksize (int, optional): Number of documents sent to a process at once. Defaults to 16.
+        """
+        if self.num_proc <= 1:
+            return [self.split(document, clean_sent=clean_sent) for document in documents]
+
+        if self._pool is None:
+            self._pool = mp.Pool(self.num_proc, initializer=_init_worker, initargs=(self,))
+        return self._pool.map(partial(_split_in_worker, clean_sent=clean_sent), documents, chunksize=chunksize)
+
+    def close(self):
+        """Stop the `split_batch` worker processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __getstate__(self):
+        # sent to the pool workers, without the pool itself
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
 
 class KssV1SentenceSplitter(SentenceSplitterBase):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, num_proc: int = 0):
+        super().__init__(num_proc=num_proc)
+        self._load_kss()
+
+    def _load_kss(self):
         try:
             self.splitter = importlib.import_module("kss")
             assert importlib.metadata.version("kss") == "1.3.1"
@@ -31,6 +84,16 @@ class KssV1SentenceSplitter(SentenceSplitterBase):
                 ">>> pip install kss==1.3.1\n"
             )
 
+    def __getstate__(self):
+        # modules can't be pickled, every worker imports kss once in `__setstate__`
+        state = super().__getstate__()
+        state["splitter"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_kss()
+
     def split(self, document: str, clean_sent: bool = False) -> List[str]:
         sentences = self.splitter.split_sentences(document)
         if clean_sent:
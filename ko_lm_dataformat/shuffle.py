@@ -0,0 +1,68 @@
+import random
+from itertools import islice
+from typing import Iterable, Iterator
+
+
+def interleave_streams(streams: Iterator[Iterable], num_open: int, rng: random.Random) -> Iterator:
+    """
+    Mix the items of `streams`, keeping `num_open` of them open and taking every item from a random one.
+    A stream that runs out is replaced by the next one, so only `num_open` streams are open at a time.
+
+    Args:
+        streams (Iterator[Iterable]): Streams to mix, opened lazily in order
+        num_open (int): Number of streams read at the same time
+        rng (random.Random): Source of randomness
+    """
+    if num_open < 1:
+        raise ValueError("num_open should be a positive integer")
+
+    streams = iter(streams)
+    open_streams = [iter(stream) for stream in islice(streams, num_open)]
+    rand = rng.random
+    while open_streams:
+        i = int(rand() * len(open_streams))
+        try:
+            yield next(open_streams[i])
+        except StopIteration:
+            stream = next(streams, None)
+            if stream is not None:
+                open_streams[i] = iter(stream)
+            else:
+                # swap with the last one instead of removing from the middle
+                open_streams[i] = open_streams[-1]
+                open_streams.pop()
+
+
+def shuffle_buffer(items: Iterable, buffer_size: int, rng: random.Random) -> Iterator:
+    """
+    Shuffle a stream with a buffer of `buffer_size` items.
+
+    The buffer is preallocated and filled first. Every next item then takes the place of a random one, which is
+    yielded, so the buffer is never resized. At the end the rest of the buffer is shuffled and yielded.
+
+    Args:
+        items (Iterable): Stream to shuffle
+        buffer_size (int): Max number of items held in memory
+        rng (random.Random): Source of randomness
+    """
+    if buffer_size < 1:
+        raise ValueError("buffer_size should be a positive integer")
+
+    items = iter(items)
+    buffer = [None] * buffer_size
+    num_items = 0
+    for item in items:
+        buffer[num_items] = item
+        num_items += 1
+        if num_items == buffer_size:
+            break
+
+    rand = rng.random
+    for item in items:
+        i = int(rand() * buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+
+    del buffer[num_items:]
+    rng.shuffle(buffer)
+    yield from buffer
@@ -1,18 +1,153 @@
 import datetime
+import io
+import logging
 import mmap
 import os
-from functools import reduce
+import re
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from functools import lru_cache, reduce
 from importlib.metadata import version
 from math import ceil
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+import ujson
+import zstandard
+
+
+logger = logging.getLogger(__name__)
+
+
+JSONL_BLOCK_SIZE = 1 << 20  # bytes read from the decompressor at once by `iter_lines`
+
+DICT_SUFFIX = ".dict"
+DICT_PREFIX = "zstd_dict_"  # `zstd_dict_<dict id>.dict`, shared by the shards of a directory
+ZSTD_FRAME_HEADER_SIZE_MAX = 18
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"KLDFIDX1"
+_INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, frame_size, num_records, num_frames
+
+# `.dat.zst` version 2, once decompressed:
+#   DAT_MAGIC | records | zero padding to 8 bytes | uint64 offsets (num_records + 1) | DAT_FOOTER
+# Offsets are relative to the end of the header. Version 1 files start with a `%016d` length instead of the magic.
+DAT_MAGIC = b"KLDFDAT2"
+DAT_FOOTER = struct.Struct("<Q8s")  # num_records, magic
+
+# Index of a `.jsonl.zst` written with `Archive(frame_size=...)`.
+# Frame `k` holds records `[k * frame_size, (k + 1) * frame_size)` and starts at byte `offsets[k]`.
+# `offsets` has `num_frames + 1` entries, the last one being the file size.
+FrameIndex = namedtuple("FrameIndex", ["frame_size", "num_records", "offsets"])
+
+
+def natural_sort_key(name: str):
+    """Sort key that orders `data_2_...` before `data_10_...`"""
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", name)]
 
 
 def listdir_or_file(x):
     if isinstance(x, list):
         return reduce(lambda x, y: x + y, map(listdir_or_file, sorted(x)))
-    return [x] if os.path.isfile(x) else [x + "/" + fn for fn in sorted(os.listdir(x))]
+    return [x] if os.path.isfile(x) else [x + "/" + fn for fn in sorted(os.listdir(x), key=natural_sort_key)]
 
 
-def tarfile_reader(file, streaming=False):
+TAR_BLOCK_SIZE = 512
+
+
+def _read_exact(file, size: int) -> bytes:
+    """`file.read(size)` for streams that may return less than asked (e.g. zstd readers)"""
+    data = file.read(size)
+    if len(data) == size or not data:
+        return data
+    chunks = [data]
+    size -= len(data)
+    while size:
+        chunk = file.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _skip_forward(file, size: int):
+    if size <= 0:
+        return
+    try:
+        file.seek(size, os.SEEK_CUR)
+    except (OSError, ValueError):
+        # pipes and other unseekable streams
+        while size:
+            chunk = file.read(min(size, JSONL_BLOCK_SIZE))
+            if not chunk:
+                break
+            size -= len(chunk)
+
+
+class TarMember(io.RawIOBase):
+    """
+    Read-only file-like view of a tar member's data, reading at most `size` bytes from the tar stream.
+    The view is only valid until the next member is read, since they share the same stream.
+    """
+
+    def __init__(self, file, name: str, offset: int, size: int):
+        super().__init__()
+        self.file = file
+        self.name = name
+        self.offset = offset  # position of the data from the start of the tar
+        self.size = size
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._remaining)
+        if n == 0:
+            return 0
+        with memoryview(b) as view:
+            if hasattr(self.file, "readinto"):
+                read = self.file.readinto(view[:n])
+            else:
+                data = self.file.read(n)
+                read = len(data)
+                view[:read] = data
+        self._remaining -= read
+        return read
+
+    def readall(self):
+        data = _read_exact(self.file, self._remaining)
+        self._remaining -= len(data)
+        return data
+
+    def __repr__(self):
+        return f"TarMember(name={self.name!r}, offset={self.offset}, size={self.size})"
+
+
+def _parse_pax(data: bytes) -> dict:
+    # "%d %s=%s\n" records, https://pubs.opengroup.org/onlinepubs/9699919799/utilities/pax.html#tag_20_92_13_03
+    attrs = {}
+    pos = 0
+    while pos < len(data):
+        length = int(data[pos : data.index(b" ", pos)])
+        key, _, value = data[data.index(b" ", pos) + 1 : pos + length - 1].partition(b"=")
+        attrs[key.decode("utf-8")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return attrs
+
+
+def iter_tar_members(file) -> Iterator[TarMember]:
+    """
+    Iterate over the regular files of a tar stream, without reading the data of the members.
+
+    Works on any binary stream read front to back (`open`, `gzip.open`, zstd `stream_reader`...), so compressed
+    tarballs are never decompressed as a whole. Each member is a `TarMember` reading from `file`. Whatever is
+    left unread is skipped when the next member is requested.
+
+    Args:
+        file: binary stream positioned at the start of the tar
+    """
     # we need our own tarfile parser because `tarfile` doesn't work well for
     # big tarfiles; it seems to be reading the entire file to get a list of
     # where all the files are - but we don't need that because we just need
@@ -20,65 +155,160 @@ def tarfile_reader(file, streaming=False):
     # facilities for this. the only options are 1. load the entire tarfile
     # and then query by filename or 2. extract to disk - and neither of
     # these is what we want.
-
-    offset = 0
-    paxfilesize = None
+    offset = 0  # position of the next header
+    pos = 0  # position of `file`
+    pax = {}
+    long_name = None
     while True:
-        hdr = file.read(512)
-        offset += 512
+        _skip_forward(file, offset - pos)
+        hdr = _read_exact(file, TAR_BLOCK_SIZE)
+        offset += TAR_BLOCK_SIZE
+        pos = offset
 
         # https://www.gnu.org/software/tar/manual/html_node/Standard.html
         # end at 135 not 136 because of \0 terminator
-        if hdr[124:135] == b"\0" * 11:
+        if len(hdr) < TAR_BLOCK_SIZE or hdr[124:135] == b"\0" * 11:
             # end of record
             break
 
-        # fname = hdr[:100].split(b"\0")[0]
-
         # if the file is too big to fit in the size field, tarfiles will actually
         # include a PaxHeader with the size in it, applicable to the immediate next file.
-        if paxfilesize is not None:
-            size = paxfilesize
-            paxfilesize = None
-        else:
-            size = int(hdr[124:135], 8)
-
-        padded_size = ceil(size / 512) * 512
+        size = int(pax["size"]) if "size" in pax else int(hdr[124:135], 8)
+        padded_size = ceil(size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
 
         # for handling PaxHeader files (which contain extra metadata about file size) and directories
-        # https://pubs.opengroup.org/onlinepubs/9699919799/utilities/pax.html#tag_20_92_13_03
         type = chr(hdr[156])
 
-        if type == "x":
-            meta = file.read(padded_size)[:size]
+        if type in ("x", "L"):
+            meta = _read_exact(file, padded_size)[:size]
+            pos += padded_size
+            if type == "x":
+                pax = _parse_pax(meta)
+            else:
+                # GNU long name
+                long_name = meta.rstrip(b"\0").decode("utf-8", "surrogateescape")
+        elif type == "0" or type == "\0":
+            if "path" in pax:
+                name = pax["path"]
+            elif long_name is not None:
+                name = long_name
+            else:
+                name = hdr[:100].split(b"\0")[0].decode("utf-8", "surrogateescape")
+                prefix = hdr[345:500].split(b"\0")[0] if hdr[257:262] == b"ustar" else b""
+                if prefix:
+                    name = prefix.decode("utf-8", "surrogateescape") + "/" + name
 
-            def kv(x):
-                return x.decode("utf-8").split(" ")[1].split("=")
+            member = TarMember(file, name, offset, size)
+            yield member
+            pos += size - member._remaining
 
-            paxfileattrs = {kv(x)[0]: kv(x)[1] for x in meta.split(b"\n") if x}
-            paxfilesize = int(paxfileattrs["size"])
+        if type not in ("x", "L"):
+            pax = {}
+            long_name = None
+        offset += padded_size
 
-            offset += padded_size
-            continue
-        elif type != "0" and type != "\0":
-            if streaming:
-                file.seek(padded_size, os.SEEK_CUR)
-            else:
-                file.read(padded_size)
-            offset += padded_size
-            continue
 
-        if streaming:
-            # skip directory entries
-            if size != 0:
-                mmo = mmap.mmap(file.fileno(), length=offset + size, access=mmap.ACCESS_READ)
-                mmo.seek(offset)
-                yield mmo
+class MappedTarMember(io.RawIOBase):
+    """
+    Member of a tar mapped in memory. `data` is a zero-copy `memoryview` of the member, and `read` / `seek` work
+    like on a file bounded to the member.
+    """
 
-            file.seek(padded_size, os.SEEK_CUR)
-        else:
-            yield file.read(padded_size)[:size]
-        offset += padded_size
+    def __init__(self, buffer, name: str, offset: int, size: int):
+        super().__init__()
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.data = memoryview(buffer)[offset : offset + size]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+        self._pos = min(max(pos, 0), self.size)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self._pos)
+        with memoryview(b) as view:
+            view[:n] = self.data[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def readall(self):
+        data = bytes(self.data[self._pos :])
+        self._pos = self.size
+        return data
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.data.release()
+            except BufferError:
+                # still used by e.g. a zstd reader, released with it
+                pass
+        super().close()
+
+    def __repr__(self):
+        return f"MappedTarMember(name={self.name!r}, offset={self.offset}, size={self.size})"
+
+
+TarEntry = namedtuple("TarEntry", ["name", "offset", "size"])
+
+
+def list_tar_members(file) -> List[TarEntry]:
+    """
+    Member table of a tar: name, data offset and size of every regular file, in order.
+    On a seekable file only the headers are read.
+    """
+    return [TarEntry(member.name, member.offset, member.size) for member in iter_tar_members(file)]
+
+
+def close_mmap(mm: mmap.mmap):
+    """Close `mm`, unless views of it are still alive. They keep the mapping until they are released."""
+    try:
+        mm.close()
+    except BufferError:
+        pass
+
+
+def tarfile_reader(file, streaming=False):
+    """
+    Yield the data of every regular file in the tar `file`.
+
+    Args:
+        file: binary stream positioned at the start of the tar
+        streaming (bool, optional):
+            Map the tar in memory once and yield a `MappedTarMember` per non-empty member instead of `bytes`.
+            `file` has to be a real file. Defaults to False.
+    """
+    if not streaming:
+        for member in iter_tar_members(file):
+            yield member.read()
+        return
+
+    base = file.tell()
+    if os.fstat(file.fileno()).st_size <= base:
+        return
+    mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for member in iter_tar_members(file):
+            # skip empty files
+            if member.size != 0:
+                yield MappedTarMember(mm, member.name, base + member.offset, member.size)
+    finally:
+        close_mmap(mm)
 
 
 def handle_jsonl(
@@ -97,12 +327,146 @@ def handle_jsonl(
             yield text
 
 
+def iter_lines(reader, block_size: int = JSONL_BLOCK_SIZE) -> Iterator[bytes]:
+    """Split a binary stream on newlines, reading big blocks instead of one line at a time"""
+    rest = b""
+    while True:
+        block = reader.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def handle_jsonl_lines(
+    lines: Iterable[bytes],
+    loads: Callable = ujson.loads,
+    get_meta: bool = False,
+    autojoin_sentences: bool = False,
+    sent_joiner: str = " ",
+    key: str = "text",
+):
+    """Same as `handle_jsonl`, for raw lines decoded with `loads`. Empty lines are skipped."""
+    for line in lines:
+        if not line:
+            continue
+
+        ob = loads(line)
+        text = ob[key]
+
+        # if data is List[str], concatenate multiple sentence.
+        if autojoin_sentences and isinstance(text, list):
+            text = sent_joiner.join(text)
+
+        if get_meta:
+            yield text, (ob["meta"] if "meta" in ob else {})
+        else:
+            yield text
+
+
+def write_uint64_array(fh, values: array):
+    """Write `values` as little-endian uint64"""
+    values = array("Q", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    fh.write(values.tobytes())
+
+
+def write_frame_index(path: str, frame_size: int, num_records: int, offsets: array):
+    """Write a frame index sidecar (little-endian uint64)"""
+    with open(path, "wb") as fh:
+        fh.write(_INDEX_HEADER.pack(INDEX_MAGIC, frame_size, num_records, len(offsets) - 1))
+        write_uint64_array(fh, offsets)
+
+
+def read_frame_index(path: str) -> FrameIndex:
+    """Read a frame index sidecar written by `write_frame_index`"""
+    with open(path, "rb") as fh:
+        magic, frame_size, num_records, num_frames = _INDEX_HEADER.unpack(fh.read(_INDEX_HEADER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a ko_lm_dataformat index file")
+        offsets = array("Q")
+        offsets.fromfile(fh, num_frames + 1)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return FrameIndex(frame_size, num_records, offsets)
+
+
+def to_zstd_dictionary(
+    dictionary: Optional[Union[bytes, zstandard.ZstdCompressionDict]],
+) -> Optional[zstandard.ZstdCompressionDict]:
+    if dictionary is None or isinstance(dictionary, zstandard.ZstdCompressionDict):
+        return dictionary
+    return zstandard.ZstdCompressionDict(dictionary)
+
+
+def train_zstd_dictionary(samples: List[bytes], dict_size: int) -> Optional[zstandard.ZstdCompressionDict]:
+    """Train a zstd dictionary. Returns None (no dictionary) if there isn't enough data to train one."""
+    try:
+        return zstandard.train_dictionary(dict_size, samples)
+    except zstandard.ZstdError as e:
+        logger.warning(f"Failed to train zstd dictionary from {len(samples)} samples, compressing without it: {e}")
+        return None
+
+
+def write_zstd_dictionary(path: str, dictionary: zstandard.ZstdCompressionDict):
+    """
+    Save the dictionary the shard at `path` was compressed with.
+
+    Shards reference a dictionary by the id in their zstd frame headers, so it is written once per directory as
+    `zstd_dict_<id>.dict`. Raw content dictionaries have no id, they get a `<path>.dict` sidecar instead.
+    """
+    dict_id = dictionary.dict_id()
+    if dict_id:
+        dict_path = os.path.join(os.path.dirname(path), f"{DICT_PREFIX}{dict_id}{DICT_SUFFIX}")
+        if os.path.exists(dict_path):
+            return
+    else:
+        dict_path = path + DICT_SUFFIX
+
+    tmp_path = dict_path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(dictionary.as_bytes())
+    os.replace(tmp_path, dict_path)
+
+
+def get_zstd_dictionary_path(path: str) -> Optional[str]:
+    """Dictionary file of the zstd shard at `path` (see `write_zstd_dictionary`), or None if it has none"""
+    dict_path = path + DICT_SUFFIX
+    if os.path.exists(dict_path):
+        return dict_path
+
+    with open(path, "rb") as fh:
+        head = fh.read(ZSTD_FRAME_HEADER_SIZE_MAX)
+    try:
+        dict_id = zstandard.get_frame_parameters(head).dict_id
+    except zstandard.ZstdError:
+        # not a zstd file, or an empty one
+        return None
+    if dict_id == 0:
+        return None
+
+    dict_path = os.path.join(os.path.dirname(path), f"{DICT_PREFIX}{dict_id}{DICT_SUFFIX}")
+    if not os.path.exists(dict_path):
+        raise ValueError(f"{path} was compressed with zstd dictionary {dict_id}, but {dict_path} is missing")
+    return dict_path
+
+
+def load_zstd_dictionary(dict_path: str) -> zstandard.ZstdCompressionDict:
+    with open(dict_path, "rb") as fh:
+        return zstandard.ZstdCompressionDict(fh.read())
+
+
 def get_datetime_timestamp():
     """Get current datetime timestamp, based on Korea Timezone"""
     KST = datetime.timezone(datetime.timedelta(hours=9))
     return datetime.datetime.now(tz=KST).strftime("%Y%m%d%H%M%S")[2:]
 
 
+@lru_cache(maxsize=None)
 def get_version():
-    """Get package version from metadata"""
+    """Get package version from metadata. Cached, it is read on every commit."""
     return version("ko_lm_dataformat")
@@ -1,7 +1,10 @@
 import json
+import os
 import shutil
+from glob import glob
 
 import pytest
+import zstandard
 
 import ko_lm_dataformat as kldf
 
@@ -83,3 +86,107 @@ def test_archive_kss_sent_split():
     archive.fh.close()
 
     shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_archive_auto_roll():
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=2)
+    texts = [f"문서 {i}" for i in range(25)]
+    for text in texts:
+        archive.add_data(text)
+    archive.commit()
+    archive.close()
+
+    # shards are read in commit order, data_10_* after data_9_*
+    assert len(glob(os.path.join(TMP_DIR_NAME, "data_*.jsonl.zst"))) == 13
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == texts
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_archive_background_compression():
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, frame_size=7, max_shard_bytes=2000, compress_workers=2)
+    expected = [(f"문서 {i} " * (i % 5 + 1), {"i": i}) for i in range(200)]
+    for text, meta in expected:
+        archive.add_data(text, meta=meta)
+    archive.commit()
+    archive.close()
+
+    files = os.listdir(TMP_DIR_NAME)
+    assert len([f for f in files if f.endswith(".jsonl.zst")]) > 1
+    assert len([f for f in files if f.endswith(".idx")]) == len([f for f in files if f.endswith(".jsonl.zst")])
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    assert list(reader.stream_data(get_meta=True)) == expected
+    assert len(reader) == len(expected)
+    assert reader[123] == expected[123][0]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def make_sentences(num):
+    return [f"{i}번째 문장입니다. 오늘의 날씨는 맑음, 기온은 {i % 30}도입니다." for i in range(num)]
+
+
+def test_archive_trained_dictionary():
+    remove_tmp_dir()
+    texts = make_sentences(2000)
+
+    archive = kldf.Archive(TMP_DIR_NAME, frame_size=10, dict_size=4096, dict_sample_records=500)
+    for text in texts:
+        archive.add_data(text, meta={"source": "news"})
+    archive.commit()
+    archive.close()
+
+    assert archive.dictionary is not None
+    assert len([f for f in os.listdir(TMP_DIR_NAME) if f.endswith(".dict")]) == 1
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    assert list(reader.stream_data()) == texts
+    assert reader[1234] == texts[1234]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dat_json_given_dictionary():
+    texts = make_sentences(1000)
+    dictionary = zstandard.train_dictionary(4096, [text.encode("UTF-8") for text in texts])
+
+    for archive_cls in [kldf.DatArchive, kldf.JSONArchive]:
+        remove_tmp_dir()
+        archive = archive_cls(TMP_DIR_NAME, dictionary=dictionary.as_bytes(), max_shard_records=300)
+        for text in texts:
+            archive.add_data(text)
+        archive.commit()
+
+        # one dictionary for the 4 shards, which reference it by its id
+        assert [f for f in os.listdir(TMP_DIR_NAME) if f.endswith(".dict")] == [
+            f"zstd_dict_{dictionary.dict_id()}.dict"
+        ]
+        assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == texts
+        shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_raw_content_dictionary():
+    remove_tmp_dir()
+    texts = make_sentences(100)
+    archive = kldf.JSONArchive(
+        TMP_DIR_NAME, dictionary="오늘의 날씨는 맑음, 기온은".encode("UTF-8") * 20, max_shard_records=50
+    )
+    for text in texts:
+        archive.add_data(text)
+    archive.close()
+
+    # no dict id to reference it by, every shard has its own sidecar
+    assert len([f for f in os.listdir(TMP_DIR_NAME) if f.endswith(".json.zst.dict")]) == 2
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == texts
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dictionary_too_few_samples():
+    remove_tmp_dir()
+    archive = kldf.DatArchive(TMP_DIR_NAME, dict_size=4096)
+    archive.add_data("testing 123")
+    archive.commit()
+
+    assert archive.dictionary is None
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == ["testing 123"]
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,70 @@
+import shutil
+
+import ko_lm_dataformat as kldf
+from ko_lm_dataformat.cache import LRUCache
+from ko_lm_dataformat.sentence_cleaner import clean_sentence
+
+from .test_sentence_splitter import PeriodSentenceSplitter
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+class CountingSplitter(PeriodSentenceSplitter):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def split(self, document, clean_sent=False):
+        self.calls += 1
+        return super().split(document, clean_sent=clean_sent)
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+
+
+def test_cached_sentence_splitter():
+    documents = ["공지사항입니다. 감사합니다.", "본문 1. 본문 2.", "공지사항입니다. 감사합니다."] * 10
+    base = CountingSplitter()
+    splitter = kldf.CachedSentenceSplitter(base, max_size=10)
+
+    results = [splitter.split(doc) for doc in documents]
+    assert results == [base.split(doc) for doc in documents]
+    assert base.calls == 2 + len(documents)
+    assert splitter.stats.hits == len(documents) - 2
+
+    results[0].append("changed")
+    assert splitter.split(documents[0]) == ["공지사항입니다.", "감사합니다."]
+
+    base.calls = 0
+    splitter = kldf.CachedSentenceSplitter(base)
+    assert splitter.split_batch(documents + ["새 문서."]) == [base.split(doc) for doc in documents + ["새 문서."]]
+    assert base.calls == 3 + len(documents) + 1
+    # every distinct document is a miss once, its copies in the batch are hits
+    assert (splitter.stats.hits, splitter.stats.misses) == (len(documents) - 2, 3)
+
+    assert splitter.split_batch(documents[:3]) == [base.split(doc) for doc in documents[:3]]
+    assert (splitter.stats.hits, splitter.stats.misses) == (len(documents) + 1, 3)
+
+
+def test_cached_sentence_cleaner():
+    remove_tmp_dir()
+    cleaner = kldf.CachedSentenceCleaner()
+    archive = kldf.Archive(TMP_DIR_NAME, sentence_cleaner=cleaner)
+    texts = ["  반복되는\t\t푸터 \x00", "본문입니다 ", "  반복되는\t\t푸터 \x00"] * 5
+    for text in texts:
+        archive.add_data(text, clean_sent=True)
+    archive.commit()
+    archive.close()
+
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == [clean_sentence(text) for text in texts]
+    assert (cleaner.stats.hits, cleaner.stats.misses) == (len(texts) - 2, 2)
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import pytest
+
+import ko_lm_dataformat as kldf
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+pc = pytest.importorskip("pyarrow.compute")
+
+ARROW_DIR_NAME = TMP_DIR_NAME + "_arrow"
+
+
+def write_archive():
+    remove_tmp_dir()
+    shutil.rmtree(ARROW_DIR_NAME, ignore_errors=True)
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=50)
+    docs = []
+    for i in range(120):
+        meta = {"source": "news" if i % 3 == 0 else "blog", "id": i}
+        if i == 110:
+            meta["lang"] = "ko"  # only in the last shard, past `infer_rows`
+        text = ["첫 문장", f"문서 {i}"] if i % 10 == 0 else f"문서 {i}"
+        archive.add_data(text, meta=meta)
+        docs.append((" ".join(text) if isinstance(text, list) else text, meta))
+    archive.commit()
+    return docs
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_export_and_read_arrow(file_format):
+    docs = write_archive()
+    paths = kldf.Reader(TMP_DIR_NAME).export_arrow(ARROW_DIR_NAME, file_format=file_format, batch_size=16)
+    assert len(paths) == 3 and all(path.endswith("." + file_format) for path in paths)
+
+    reader = kldf.Reader(ARROW_DIR_NAME)
+    assert len(reader) == 120
+    assert reader[75] == docs[75][0]
+    assert list(reader.stream_data(get_meta=True)) == docs
+    assert list(reader.stream_data()) == [text for text, _ in docs]
+
+    shutil.rmtree(TMP_DIR_NAME)
+    shutil.rmtree(ARROW_DIR_NAME)
+
+
+def test_stream_arrow_batches():
+    docs = write_archive()
+    kldf.Reader(TMP_DIR_NAME).export_arrow(ARROW_DIR_NAME, batch_size=16)
+
+    reader = kldf.Reader(ARROW_DIR_NAME)
+    batches = list(reader.stream_arrow_batches(columns=["meta.id"], filter=pc.field("meta.source") == "news"))
+    assert all(batch.schema.names == ["meta.id"] for batch in batches)
+    assert [i for batch in batches for i in batch.column("meta.id").to_pylist()] == list(range(0, 120, 3))
+
+    # resume in the middle of a file
+    batches = reader.stream_arrow_batches(columns=["text"], batch_size=16)
+    first = [next(batches), next(batches)]
+    state = reader.state_dict()
+    batches.close()
+    reader.resume(state)
+    rest = list(reader.stream_arrow_batches(columns=["text"], batch_size=16))
+    texts = [text for batch in first + rest for text in batch.column("text").to_pylist()]
+    assert texts == [text for text, _ in docs]
+
+    with pytest.raises(ValueError):
+        next(kldf.Reader(TMP_DIR_NAME).stream_arrow_batches())
+
+    shutil.rmtree(TMP_DIR_NAME)
+    shutil.rmtree(ARROW_DIR_NAME)
+
+
+@pytest.mark.parametrize("manifest", [True, False])
+def test_export_mixed_meta_types(manifest):
+    remove_tmp_dir()
+    shutil.rmtree(ARROW_DIR_NAME, ignore_errors=True)
+    archive = kldf.Archive(TMP_DIR_NAME, manifest=manifest)
+    docs = []
+    for i in range(40):
+        # `code` is an int in the first documents only, `score` shows up after them
+        meta = {"code": i if i < 30 else f"c{i}"}
+        if i >= 30:
+            meta["score"] = i
+        archive.add_data(f"문서 {i}", meta=meta)
+        docs.append((f"문서 {i}", meta))
+    archive.commit()
+    archive.close()
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    if manifest:
+        reader.export_arrow(ARROW_DIR_NAME, infer_rows=10, batch_size=8)
+        assert list(kldf.Reader(ARROW_DIR_NAME).stream_data(get_meta=True)) == docs
+    else:
+        # without the manifest's values, the conflict shows up after `infer_rows`
+        with pytest.raises(ValueError, match="infer_rows"):
+            reader.export_arrow(ARROW_DIR_NAME, infer_rows=10, batch_size=8)
+        assert os.listdir(ARROW_DIR_NAME) == []
+
+        # inferred from all the documents, `code` is stored as JSON
+        reader.export_arrow(ARROW_DIR_NAME, infer_rows=40)
+        assert list(kldf.Reader(ARROW_DIR_NAME).stream_data(get_meta=True)) == docs
+
+    shutil.rmtree(TMP_DIR_NAME)
+    shutil.rmtree(ARROW_DIR_NAME)
@@ -0,0 +1,160 @@
+import os
+import random
+import shutil
+
+import pytest
+
+import ko_lm_dataformat as kldf
+from ko_lm_dataformat import dedup as dedup_module
+from ko_lm_dataformat.dedup import DEDUP_STATE_NAME, HashSet
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+def test_hash_set_grows():
+    hash_set = HashSet(capacity=4)
+    keys = [0, 1, 2**64 - 1] + [i * 0x9E3779B97F4A7C15 % 2**64 for i in range(2, 1000)]
+    assert all(hash_set.add(key) for key in keys[1:])
+    assert not hash_set.add(keys[0])  # 0 and 1 share a slot
+    assert len(hash_set) == len(keys) - 1
+    assert all(key in hash_set for key in keys)
+    assert 12345 not in hash_set
+
+
+@pytest.mark.parametrize("bloom_error_rate", [None, 0.001])
+def test_exact_dedup(bloom_error_rate):
+    dedup = kldf.ExactDeduplicator(capacity=1000, bloom_error_rate=bloom_error_rate)
+    assert not dedup.is_duplicate("안녕하세요. 반갑습니다.")
+    assert dedup.is_duplicate("안녕하세요.  반갑습니다.\n")  # whitespace is collapsed
+    assert dedup.is_duplicate(["안녕하세요.", "반갑습니다."])
+    assert not dedup.is_duplicate("안녕하세요!")
+    assert (dedup.num_seen, dedup.num_duplicates) == (4, 2)
+
+    restored = kldf.ExactDeduplicator(capacity=1000, bloom_error_rate=bloom_error_rate)
+    restored.loads(dedup.dumps())
+    assert restored.is_duplicate("안녕하세요!")
+    assert not restored.is_duplicate("처음 보는 문서")
+    with pytest.raises(ValueError):
+        kldf.MinHashDeduplicator().loads(dedup.dumps())
+
+
+def test_dedup_state_appends():
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    path = os.path.join(TMP_DIR_NAME, DEDUP_STATE_NAME)
+    dedup = kldf.ExactDeduplicator()
+    assert len(dedup.hashes.table) * 8 < 1 << 16  # grows with the data instead
+    for i in range(1000):
+        dedup.is_duplicate(f"문서 {i}")
+    dedup.save(path)
+    size = os.path.getsize(path)
+
+    # only the new hashes are appended
+    for i in range(990, 1010):
+        dedup.is_duplicate(f"문서 {i}")
+    dedup.save(path)
+    assert os.path.getsize(path) == size + 24 + 8 * 10
+    dedup.save(path)
+    assert os.path.getsize(path) == size + 2 * 24 + 8 * 10
+
+    # a chunk cut off by a crash is ignored
+    with open(path, "ab") as fh:
+        fh.write(b"\1" * 30)
+    restored = kldf.ExactDeduplicator()
+    restored.load(path)
+    assert (restored.num_seen, restored.num_duplicates, len(restored.hashes)) == (1020, 10, 1010)
+    assert restored.is_duplicate("문서 1009")
+    assert not restored.is_duplicate("문서 1010")
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_bloom_dedup_state_size():
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    path = os.path.join(TMP_DIR_NAME, DEDUP_STATE_NAME)
+    dedup = kldf.ExactDeduplicator(capacity=1000, bloom_error_rate=0.01)
+    sizes = []
+    for start in range(0, 3000, 1000):
+        for i in range(start, start + 1000):
+            dedup.is_duplicate(f"문서 {i}")
+        dedup.save(path)
+        sizes.append(os.path.getsize(path))
+    assert len(set(sizes)) == 1 and len(dedup._new_keys) == 0
+
+    restored = kldf.ExactDeduplicator(capacity=1000, bloom_error_rate=0.01)
+    restored.load(path)
+    assert (restored.num_seen, restored.hashes.bits) == (3000, dedup.hashes.bits)
+    assert restored.is_duplicate("문서 2999")
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dedup_state_keeps_its_hash(monkeypatch):
+    # a state saved with another hash than the default one is still loaded, with its hash
+    blake2b_64 = dedup_module.HASH_FUNCTIONS["blake2b-64"]
+    monkeypatch.setitem(dedup_module.HASH_FUNCTIONS, "other-64", lambda data: blake2b_64(data) ^ 1)
+    with monkeypatch.context() as m:
+        m.setattr(dedup_module, "HASH_NAME", "other-64")
+        dedup = kldf.MinHashDeduplicator()
+    dedup.is_duplicate("같은 문서입니다")
+    state = dedup.dumps()
+
+    restored = kldf.MinHashDeduplicator()
+    assert restored.hash_name != "other-64"
+    restored.loads(state)
+    assert restored.hash_name == "other-64"
+    assert restored.is_duplicate("같은 문서입니다")
+
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match="xxhash"):
+        kldf.MinHashDeduplicator().loads(state)
+
+
+def test_minhash_dedup():
+    rng = random.Random(42)
+    syllables = [chr(cp) for cp in range(0xAC00, 0xD7A4)]
+    words = ["".join(rng.choices(syllables, k=3)) for _ in range(300)]
+    dedup = kldf.MinHashDeduplicator()
+    assert not dedup.is_duplicate(" ".join(words[:200]))
+    assert dedup.is_duplicate(" ".join(words[:190] + ["다른", "끝", "부분"]))
+    assert not dedup.is_duplicate(" ".join(words[100:]))  # half of the first one
+    assert not dedup.is_duplicate("짧은 문서")
+    assert dedup.is_duplicate("짧은 문서")
+
+
+@pytest.mark.parametrize("compress_workers", [0, 2])
+def test_archive_dedup(compress_workers):
+    remove_tmp_dir()
+    texts = [f"문서 {i}" for i in range(50)]
+    archive = kldf.Archive(TMP_DIR_NAME, compress_workers=compress_workers, dedup=kldf.ExactDeduplicator())
+    for text in texts + texts[:10]:
+        archive.add_data(text)
+    archive.add_data_batch(texts[10:20] + ["새 문서", "새 문서"])
+    archive.commit(archive_name="first")
+    archive.close()
+    assert os.path.exists(os.path.join(TMP_DIR_NAME, DEDUP_STATE_NAME))
+
+    # a resumed run loads the state of the first one
+    archive = kldf.Archive(TMP_DIR_NAME, compress_workers=compress_workers, dedup=kldf.ExactDeduplicator())
+    for text in texts[:25] + ["마지막 문서"]:
+        archive.add_data(text)
+    archive.commit(archive_name="second")
+    archive.close()
+
+    assert sorted(kldf.Reader(TMP_DIR_NAME).stream_data()) == sorted(texts + ["새 문서", "마지막 문서"])
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+@pytest.mark.parametrize("archive_cls", [kldf.DatArchive, kldf.JSONArchive])
+def test_dat_json_archive_dedup(archive_cls):
+    remove_tmp_dir()
+    archive = archive_cls(TMP_DIR_NAME, dedup=kldf.ExactDeduplicator())
+    for text in ["가", "나", "가", "다", "나"]:
+        archive.add_data(text)
+    archive.commit()
+
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == ["가", "나", "다"]
+
+    shutil.rmtree(TMP_DIR_NAME)
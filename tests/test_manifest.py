@@ -0,0 +1,89 @@
+import hashlib
+import os
+import shutil
+from glob import glob
+
+import pytest
+import zstandard
+
+import ko_lm_dataformat as kldf
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+@pytest.mark.parametrize("compress_workers", [0, 2])
+def test_archive_manifest(compress_workers):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=40, compress_workers=compress_workers)
+    texts = [f"문서 {i}" for i in range(100)]
+    for i, text in enumerate(texts):
+        archive.add_data(text, meta={"source": "test"} if i % 2 else {"id": i})
+    archive.add_data(["첫 문장", "둘째 문장"])
+    archive.commit()
+    archive.close()
+
+    shards = sorted(glob(os.path.join(TMP_DIR_NAME, "data_*.jsonl.zst")))
+    assert len(shards) == 3
+    reader = kldf.Reader(TMP_DIR_NAME)
+    stats = reader.stats()
+    assert stats["num_shards"] == 3
+    assert stats["num_records"] == len(reader) == 101
+    assert stats["num_chars"] == sum(len(text) for text in texts) + len("첫 문장둘째 문장")
+    assert stats["meta_keys"] == ["id", "source"]
+    assert stats["num_compressed_bytes"] == sum(os.path.getsize(f) for f in shards)
+
+    for f in shards:
+        manifest = stats["shards"][os.path.basename(f)]
+        with open(f, "rb") as fh:
+            raw = zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True).read()
+        assert manifest["num_bytes"] == len(raw)
+        assert manifest["checksum"] == "blake2b-128:" + hashlib.blake2b(raw, digest_size=16).hexdigest()
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dat_json_manifest():
+    remove_tmp_dir()
+    texts = ["testing 123", "한국어 문장", ""]
+    archives = [kldf.DatArchive(TMP_DIR_NAME), kldf.JSONArchive(TMP_DIR_NAME)]
+    for archive in archives:
+        for text in texts:
+            archive.add_data(text)
+        archive.commit()
+
+    # commits only write the shard manifests
+    assert not os.path.exists(os.path.join(TMP_DIR_NAME, "manifest.json"))
+    stats = kldf.Reader(TMP_DIR_NAME).stats()
+    assert stats["num_shards"] == 2
+    assert [m["num_records"] for m in stats["shards"].values()] == [3, 3]
+    assert [m["num_chars"] for m in stats["shards"].values()] == [17, 17]
+
+    for archive in archives:
+        archive.close()
+    assert os.path.exists(os.path.join(TMP_DIR_NAME, "manifest.json"))
+    assert kldf.Reader(TMP_DIR_NAME).stats() == stats
+
+    # list of files
+    files = sorted(glob(os.path.join(TMP_DIR_NAME, "data_*.zst")))
+    assert kldf.Reader(files).stats() == stats
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_stats_without_dir_manifest():
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME)
+    archive.add_data("testing 123")
+    archive.commit()
+    archive.close()
+    expected = kldf.Reader(TMP_DIR_NAME).stats()
+
+    os.remove(os.path.join(TMP_DIR_NAME, "manifest.json"))
+    assert kldf.Reader(TMP_DIR_NAME).stats() == expected
+
+    archive = kldf.Archive(TMP_DIR_NAME, manifest=False)
+    archive.add_data("testing 456")
+    archive.commit(archive_name="no_manifest")
+    archive.close()
+    assert not os.path.exists(os.path.join(TMP_DIR_NAME, "manifest.json"))
+    with pytest.raises(ValueError):
+        kldf.Reader(TMP_DIR_NAME).stats()
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import ko_lm_dataformat as kldf
+from ko_lm_dataformat.meta_filter import MetaFilter
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+def test_meta_filter():
+    meta_filter = MetaFilter({"source": ["뉴스", "wiki"], "id": 1})
+    assert meta_filter({"source": "뉴스", "id": 1})
+    assert meta_filter({"source": "wiki", "id": True})
+    assert not meta_filter({"source": "blog", "id": 1})
+    assert not meta_filter({"source": "wiki"})
+
+    # every spelling of a matching line passes the prefilter
+    for meta in ({"source": "뉴스", "id": 1}, {"source": "wiki", "id": True}):
+        for ensure_ascii in (True, False):
+            line = json.dumps({"text": "본문", "meta": meta}, ensure_ascii=ensure_ascii).encode("utf-8")
+            assert meta_filter.prefilter(line)
+    assert not meta_filter.prefilter(b'{"text": "wiki", "meta": {"source": "blog", "id": 2}}')
+
+    manifest = {"meta_keys": ["id", "source"], "meta_values": {"id": [1, 2], "source": ["blog", "뉴스"]}}
+    assert meta_filter.may_match(manifest)
+    assert not meta_filter.may_match({**manifest, "meta_values": {"id": [2], "source": None}})
+    assert not MetaFilter({"lang": "ko"}).may_match(manifest)
+    assert MetaFilter({"lang": [None, "ko"]}).may_match(manifest)
+    assert MetaFilter(lambda meta: False).may_match(manifest)
+
+
+@pytest.mark.parametrize("strict_jsonl", [False, True])
+@pytest.mark.parametrize("num_proc", [0, 2])
+def test_stream_data_filter(strict_jsonl, num_proc):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=30)
+    for i in range(90):
+        # every shard of 30 records has a single source
+        archive.add_data(f"문서 {i}", meta={"source": ["news", "blog", "뉴스"][i // 30], "id": i})
+    archive.commit()
+
+    reader = kldf.Reader(TMP_DIR_NAME, strict_jsonl=strict_jsonl)
+    docs = list(reader.stream_data(get_meta=True, num_proc=num_proc, filter={"source": ["news", "뉴스"]}))
+    assert [meta["id"] for _, meta in docs] == list(range(30)) + list(range(60, 90))
+    texts = list(reader.stream_data(num_proc=num_proc, filter=lambda meta: meta["id"] % 10 == 0))
+    assert texts == [f"문서 {i}" for i in range(0, 90, 10)]
+    with pytest.raises(ValueError):
+        reader.state_dict()
+
+    batches = list(reader.stream_batches(batch_size=16, num_proc=num_proc, filter={"source": "blog", "id": 45}))
+    assert batches == [["문서 45"]]
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_filter_skips_shards():
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=10)
+    for i in range(30):
+        archive.add_data(f"문서 {i}", meta={"source": "news" if i < 10 else "blog"})
+    archive.commit()
+
+    opened = []
+    reader = kldf.Reader(TMP_DIR_NAME)
+    read_jsonl = reader.read_jsonl
+    reader.read_jsonl = lambda f, **kwargs: opened.append(f) or read_jsonl(f, **kwargs)
+    assert list(reader.stream_data(filter={"source": "news"})) == [f"문서 {i}" for i in range(10)]
+    assert len(opened) == 1
+
+    # without manifests every shard is read
+    for f in os.listdir(TMP_DIR_NAME):
+        if f.endswith("manifest.json"):
+            os.remove(os.path.join(TMP_DIR_NAME, f))
+    reader = kldf.Reader(TMP_DIR_NAME)
+    assert list(reader.stream_data(filter={"source": "news"})) == [f"문서 {i}" for i in range(10)]
+
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+from glob import glob
+
+import pytest
+
+import ko_lm_dataformat as kldf
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+@pytest.mark.parametrize("compress_workers", [0, 2])
+def test_archive_metrics(compress_workers):
+    remove_tmp_dir()
+    events = []
+    metrics = kldf.Metrics(callback=lambda event, m: events.append((event, m.counters["archive.records"])))
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=40, compress_workers=compress_workers, metrics=metrics)
+    for i in range(100):
+        archive.add_data(f"문서 {i}", meta={"id": i}, clean_sent=True)
+    archive.commit()
+    archive.close()
+
+    summary = metrics.summary()
+    assert summary["counters"]["archive.records"] == 100
+    assert summary["counters"]["archive.shards"] == 3
+    assert summary["counters"]["archive.bytes_out"] == sum(
+        os.path.getsize(f) for f in glob(os.path.join(TMP_DIR_NAME, "data_*.jsonl.zst"))
+    )
+    assert events == [("commit", 40), ("commit", 80), ("commit", 100)]
+    for name in ("archive.clean", "archive.encode", "archive.compress", "archive.commit"):
+        assert summary["timers"][name] > 0
+    assert summary["rates"]["archive.compression_ratio"] > 0
+    if compress_workers:
+        assert "archive.queue_depth.max" in summary["gauges"]
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+@pytest.mark.parametrize("num_proc", [0, 2])
+def test_reader_metrics(num_proc):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, max_shard_records=30)
+    for i in range(100):
+        archive.add_data(f"문서 {i}")
+    archive.commit()
+
+    events = []
+    metrics = kldf.Metrics(callback=lambda event, m: events.append(event))
+    reader = kldf.Reader(TMP_DIR_NAME, metrics=metrics)
+    assert len(list(reader.stream_data(num_proc=num_proc))) == 100
+
+    summary = metrics.summary()
+    assert summary["counters"]["read.records"] == 100
+    assert summary["rates"]["read.records_per_sec"] > 0
+    if num_proc == 0:
+        assert events == ["file"] * 4
+        assert summary["counters"]["read.files"] == 4
+        assert summary["counters"]["read.bytes_in"] == sum(
+            os.path.getsize(f) for f in glob(os.path.join(TMP_DIR_NAME, "data_*.jsonl.zst"))
+        )
+        assert summary["timers"]["read.decode"] >= summary["timers"]["read.decompress"] > 0
+    else:
+        assert "read.queue_depth.max" in summary["gauges"]
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_metrics_pickle():
+    metrics = kldf.Metrics()
+    metrics.count("read.records", 3)
+    metrics.set_gauge("read.queue_depth", 2)
+    metrics.set_gauge("read.queue_depth", 1)
+    metrics = pickle.loads(pickle.dumps(metrics))
+    metrics.count("read.records")
+    assert metrics.counters["read.records"] == 4
+    assert metrics.gauges == {"read.queue_depth": 1, "read.queue_depth.max": 2}
@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import pytest
+
+import ko_lm_dataformat as kldf
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+def char_tokenize(text):
+    return [ord(c) for c in text]
+
+
+def failing_tokenize(text):
+    if text == "실패":
+        raise RuntimeError("tokenizer failed")
+    return char_tokenize(text)
+
+
+@pytest.mark.parametrize("num_proc", [0, 2])
+def test_pack_tokens(num_proc):
+    remove_tmp_dir()
+    docs = [f"{i}번째 문서입니다." * (i % 3 + 1) for i in range(50)]
+    archive = kldf.Archive(TMP_DIR_NAME)
+    for doc in docs:
+        archive.add_data(doc)
+    archive.commit()
+
+    out_path = os.path.join(TMP_DIR_NAME, "tokens")
+    num_docs, num_tokens = kldf.pack_tokens(
+        kldf.Reader(TMP_DIR_NAME),
+        char_tokenize,
+        out_path,
+        vocab_size=1 << 16,
+        eos_token_id=0,
+        num_proc=num_proc,
+        batch_size=7,
+    )
+    assert num_docs == len(docs)
+    assert num_tokens == sum(len(doc) + 1 for doc in docs)
+    assert os.path.getsize(out_path + ".bin") == 2 * num_tokens
+    # next to the shards, the token index isn't taken for a frame index
+    assert not any(f.endswith(".idx") for f in os.listdir(TMP_DIR_NAME))
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == docs
+
+    all_tokens = [token for doc in docs for token in char_tokenize(doc) + [0]]
+    with kldf.PackedDataset(out_path, seq_len=16) as dataset:
+        assert dataset.dtype == "uint16"
+        assert len(dataset) == num_tokens // 16
+        for i in (0, 5, len(dataset) - 1, -1):
+            start = (i % len(dataset)) * 16
+            assert list(dataset[i]) == all_tokens[start : start + 16]
+        with pytest.raises(IndexError):
+            dataset[len(dataset)]
+
+        for i, doc in enumerate(docs):
+            assert list(dataset.get_document(i)) == char_tokenize(doc) + [0]
+
+        # documents start after every eos
+        for i in range(len(dataset)):
+            sequence = list(dataset[i])
+            starts = [pos for pos in range(16) if (i == 0 and pos == 0) or (pos > 0 and sequence[pos - 1] == 0)]
+            if i > 0 and all_tokens[i * 16 - 1] == 0:
+                starts.insert(0, 0)
+            assert dataset.get_document_starts(i) == starts
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_pack_tokens_dtype():
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    out_path = os.path.join(TMP_DIR_NAME, "tokens")
+
+    with pytest.raises(ValueError):
+        kldf.pack_tokens(["😀"], char_tokenize, out_path, dtype="uint16")
+
+    # batched tokenizer, uint32 without a vocab size
+    kldf.pack_tokens(["😀", "", "가나"], lambda texts: [char_tokenize(text) for text in texts], out_path, batched=True)
+    with kldf.PackedDataset(out_path, seq_len=1) as dataset:
+        assert dataset.dtype == "uint32"
+        assert dataset.num_docs == 3
+        assert list(dataset[0]) == [ord("😀")]
+        assert list(dataset.get_document(1)) == []
+        assert dataset.get_document_starts(1) == [0]
+
+    kldf.pack_tokens([], char_tokenize, out_path)
+    with kldf.PackedDataset(out_path, seq_len=8) as dataset:
+        assert len(dataset) == 0
+
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+@pytest.mark.parametrize("num_proc", [0, 2])
+def test_pack_tokens_failure(num_proc):
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    out_path = os.path.join(TMP_DIR_NAME, "tokens")
+
+    docs = [f"문서 {i}" for i in range(20)] + ["실패"]
+    with pytest.raises(RuntimeError):
+        kldf.pack_tokens(docs, failing_tokenize, out_path, num_proc=num_proc, batch_size=4)
+    # no partial output is left behind
+    assert os.listdir(TMP_DIR_NAME) == []
+
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import shutil
+import threading
+import time
+from glob import glob
+
+import pytest
+import zstandard
+
+import ko_lm_dataformat as kldf
+import ko_lm_dataformat.reader as reader_module
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+def write_shards(num_shards=4, docs_per_shard=300):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME)
+    expected = []
+    for shard_idx in range(num_shards):
+        for doc_idx in range(docs_per_shard):
+            text = f"문서 {shard_idx}-{doc_idx}"
+            meta = {"shard": shard_idx, "doc": doc_idx}
+            archive.add_data(text, meta=meta)
+            expected.append((text, meta))
+        archive.commit(archive_name=f"shard{shard_idx}")
+
+    # close the archive's file handles to avoid Windows permission issues
+    archive.compressor.close()
+    archive.fh.close()
+    return expected
+
+
+def test_parallel_ordered():
+    expected = write_shards()
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    assert list(reader.stream_data(get_meta=True, num_proc=3)) == expected
+    assert list(reader.stream_data(get_meta=True, threaded=True)) == expected
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_parallel_unordered():
+    expected = write_shards()
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    data = list(reader.stream_data(num_proc=3, ordered=False))
+
+    assert sorted(data) == sorted(text for text, _ in expected)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_parallel_early_stop():
+    write_shards(docs_per_shard=5000)
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    stream = reader.stream_data(num_proc=2)
+    for i, _ in enumerate(stream):
+        if i == 10:
+            break
+    stream.close()
+
+    assert not any(p.is_alive() for p in mp.active_children())
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_stream_batches():
+    expected = write_shards(num_shards=2, docs_per_shard=250)
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    batches = list(reader.stream_batches(batch_size=100))
+    assert [len(batch) for batch in batches] == [100, 100, 100, 100, 100]
+    assert sum(batches, []) == [text for text, _ in expected]
+
+    # In worker mode batches don't span two files
+    batches = list(reader.stream_batches(get_meta=True, batch_size=100, num_proc=2))
+    assert [len(texts) for texts, _ in batches] == [100, 100, 50, 100, 100, 50]
+    assert [(t, m) for texts, metas in batches for t, m in zip(texts, metas)] == expected
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_stream_batches_bytes():
+    expected = write_shards(num_shards=1, docs_per_shard=100)
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    doc_bytes = len(expected[0][0].encode("utf-8"))
+    batches = list(reader.stream_batches(batch_bytes=doc_bytes * 10))
+    assert all(len(batch) <= 10 for batch in batches)
+    assert sum(batches, []) == [text for text, _ in expected]
+
+    data = list(reader.stream_data(num_proc=1, batch_size=7, batch_bytes=doc_bytes * 3))
+    assert data == [text for text, _ in expected]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def write_indexed_shards(frame_size=10, shard_sizes=(95, 40)):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME, frame_size=frame_size)
+    expected = []
+    for shard_idx, num_docs in enumerate(shard_sizes):
+        for doc_idx in range(num_docs):
+            text = f"문서 {shard_idx}-{doc_idx}"
+            archive.add_data(text, meta={"doc": doc_idx})
+            expected.append((text, {"doc": doc_idx}))
+        archive.commit(archive_name=f"shard{shard_idx}")
+
+    # close the archive's file handles to avoid Windows permission issues
+    archive.compressor.close()
+    archive.fh.close()
+    return expected
+
+
+def test_indexed_random_access():
+    expected = write_indexed_shards()
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    assert len(reader) == len(expected)
+    assert reader[0] == expected[0][0]
+    assert reader[95] == expected[95][0]
+    assert reader[-1] == expected[-1][0]
+    assert [reader[i] for i in range(len(expected))] == [text for text, _ in expected]
+    with pytest.raises(IndexError):
+        reader[len(expected)]
+
+    # the reader's decoder is used, as in `stream_data`
+    calls = []
+    reader = kldf.Reader(TMP_DIR_NAME, json_loads=lambda line: calls.append(line) or json.loads(line))
+    assert reader[95] == expected[95][0]
+    assert len(calls) == 1
+
+    # Index files are not streamed as data
+    assert list(reader.stream_data(get_meta=True)) == expected
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_indexed_seek():
+    expected = write_indexed_shards()
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    for start in [0, 9, 10, 57, 95, 120, len(expected)]:
+        reader.seek(start)
+        assert list(reader.stream_data(get_meta=True)) == expected[start:]
+
+    # seek only applies to the next stream
+    reader.seek(100)
+    assert list(reader.stream_data(num_proc=2)) == [text for text, _ in expected[100:]]
+    assert len(list(reader.stream_data())) == len(expected)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_len_without_index():
+    expected = write_shards(num_shards=2, docs_per_shard=10)
+    reader = kldf.Reader(TMP_DIR_NAME)
+    # from the manifests, the files are decoded up to the record
+    assert len(reader) == 20
+    assert [reader[i] for i in (0, 9, 10, -1)] == [expected[i][0] for i in (0, 9, 10, -1)]
+    reader.seek(13)
+    assert list(reader.stream_data(get_meta=True)) == expected[13:]
+
+    for f in glob(os.path.join(TMP_DIR_NAME, "*manifest.json")):
+        os.remove(f)
+    reader = kldf.Reader(TMP_DIR_NAME)
+    with pytest.raises(ValueError):
+        len(reader)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_fast_jsonl_decode():
+    expected = write_shards(num_shards=2, docs_per_shard=50)
+    fast = kldf.Reader(TMP_DIR_NAME)
+    strict = kldf.Reader(TMP_DIR_NAME, strict_jsonl=True)
+
+    for kwargs in [{}, {"get_meta": True}]:
+        assert list(fast.stream_data(**kwargs)) == list(strict.stream_data(**kwargs))
+    assert list(fast.stream_data(get_meta=True)) == expected
+
+    # custom decoder is used whenever the whole record is needed
+    calls = []
+
+    def loads(line):
+        calls.append(line)
+        return json.loads(line)
+
+    assert list(kldf.Reader(TMP_DIR_NAME, json_loads=loads).stream_data(get_meta=True)) == expected
+    assert len(calls) == len(expected)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_fast_jsonl_decode_handwritten():
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    lines = [
+        '{"text": "띄어쓰기 \\"따옴표\\" \\ud55c\\uae00", "meta": {}}',
+        "",
+        '{"meta": {"a": 1}, "text": ["첫 문장", "둘째 문장"]}',
+        '{"text":"붙여쓰기"}',
+    ]
+    with open(os.path.join(TMP_DIR_NAME, "data.jsonl.zst"), "wb") as f:
+        f.write(zstandard.ZstdCompressor().compress("\n".join(lines).encode("utf-8")))
+
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data(autojoin_sentences=True)) == [
+        '띄어쓰기 "따옴표" 한글',
+        "첫 문장 둘째 문장",
+        "붙여쓰기",
+    ]
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data(get_meta=True))[1] == (["첫 문장", "둘째 문장"], {"a": 1})
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+async def collect_async(stream, limit=None):
+    data = []
+    async for x in stream:
+        data.append(x)
+        if limit is not None and len(data) == limit:
+            break
+    await stream.aclose()
+    return data
+
+
+def test_astream_data():
+    expected = write_shards(num_shards=4, docs_per_shard=300)
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    assert asyncio.run(collect_async(reader.astream_data(get_meta=True, batch_size=32))) == expected
+    assert asyncio.run(collect_async(reader.astream_data(read_ahead=1))) == [text for text, _ in expected]
+
+    # leaving early stops the threads
+    assert len(asyncio.run(collect_async(reader.astream_data(batch_size=1), limit=5))) == 5
+    time.sleep(0.5)
+    assert not any(t.name.startswith("kldf-reader") for t in threading.enumerate())
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_astream_data_error():
+    write_shards(num_shards=1, docs_per_shard=10)
+    with open(os.path.join(TMP_DIR_NAME, "broken.jsonl.zst"), "wb") as f:
+        f.write(b"not zstd")
+    reader = kldf.Reader(TMP_DIR_NAME)
+
+    with pytest.raises(zstandard.ZstdError):
+        asyncio.run(collect_async(reader.astream_data()))
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_prefetch(monkeypatch):
+    expected = write_shards(num_shards=4, docs_per_shard=100)
+    warmed = []
+    warm = reader_module._ShardPrefetcher.warm
+    monkeypatch.setattr(reader_module._ShardPrefetcher, "warm", lambda self, f: (warmed.append(f), warm(self, f)))
+
+    reader = kldf.Reader(TMP_DIR_NAME, prefetch=2)
+    assert list(reader.stream_data(get_meta=True)) == expected
+    # every file but the first is read ahead
+    assert sorted(set(warmed)) == reader._list_files()[1:]
+
+    assert list(reader.stream_data(get_meta=True, num_proc=2)) == expected
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_partition_indexed():
+    expected = write_indexed_shards(shard_sizes=(95, 40, 66))
+    texts = [text for text, _ in expected]
+
+    parts = []
+    for rank in range(2):
+        for worker_id in range(3):
+            reader = kldf.Reader(TMP_DIR_NAME, rank=rank, world_size=2, worker_id=worker_id, num_workers=3)
+            parts.append(list(reader.stream_data()))
+            # `len` and indices are those of the part
+            assert len(reader) == len(parts[-1])
+            assert [reader[i] for i in range(len(reader))] == parts[-1]
+
+    # equal record ranges, in order, without overlap
+    assert [len(part) for part in parts] == [33, 34, 33, 34, 33, 34]
+    assert sum(parts, []) == texts
+
+    reader = kldf.Reader(TMP_DIR_NAME, rank=1, world_size=2)
+    assert list(reader.stream_data(num_proc=2)) == texts[100:]
+    reader.seek(10)
+    assert list(reader.stream_data()) == texts[110:]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_partition_by_size():
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME)
+    for shard_idx, num_docs in enumerate([400, 100, 100, 100, 100]):
+        for doc_idx in range(num_docs):
+            # incompressible, so file sizes follow the number of documents
+            archive.add_data(os.urandom(32).hex())
+        archive.commit(archive_name=f"shard{shard_idx}")
+    archive.compressor.close()
+    archive.fh.close()
+
+    readers = [kldf.Reader(TMP_DIR_NAME, rank=rank, world_size=2) for rank in range(2)]
+    parts = [list(reader.stream_data()) for reader in readers]
+    # the big shard makes a part on its own
+    assert sorted(len(part) for part in parts) == [400, 400]
+    assert [len(reader) for reader in readers] == [len(part) for part in parts]
+    assert sorted(sum(parts, [])) == sorted(kldf.Reader(TMP_DIR_NAME).stream_data())
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_shuffled_file_order():
+    write_shards(num_shards=8, docs_per_shard=5)
+
+    def first_docs(reader):
+        return [text for i, text in enumerate(reader.stream_data()) if i % 5 == 0]
+
+    reader = kldf.Reader(TMP_DIR_NAME, seed=42)
+    epoch0 = first_docs(reader)
+    assert epoch0 == first_docs(kldf.Reader(TMP_DIR_NAME, seed=42))
+    assert sorted(epoch0) == sorted(first_docs(kldf.Reader(TMP_DIR_NAME)))
+
+    reader.set_epoch(1)
+    assert first_docs(reader) != epoch0
+
+    # ranks agree on the shuffle, so their parts don't overlap
+    parts = [set(kldf.Reader(TMP_DIR_NAME, rank=rank, world_size=3, seed=7).stream_data()) for rank in range(3)]
+    assert sum(len(part) for part in parts) == len(set.union(*parts)) == 40
+
+    with pytest.raises(ValueError):
+        kldf.Reader(TMP_DIR_NAME, rank=2, world_size=2)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_resume(indexed):
+    if indexed:
+        expected = write_indexed_shards(shard_sizes=(95, 40, 66))
+    else:
+        expected = write_shards(num_shards=3, docs_per_shard=70)
+    texts = [text for text, _ in expected]
+
+    for stop in [0, 1, 69, 70, 95, 150, len(texts)]:
+        reader = kldf.Reader(TMP_DIR_NAME)
+        stream = reader.stream_data()
+        assert [next(stream) for _ in range(stop)] == texts[:stop]
+        state = json.loads(json.dumps(reader.state_dict()))
+
+        reader = kldf.Reader(TMP_DIR_NAME)
+        reader.resume(state)
+        assert list(reader.stream_data()) == texts[stop:]
+
+    if indexed:
+        assert state == {
+            "epoch": 0,
+            "task": 2,
+            "file": os.path.basename(reader._list_files()[2]),
+            "member": None,
+            "record": 66,
+            "frame": 6,
+            "record_in_frame": 6,
+        }
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_resume_parallel_and_batches():
+    expected = write_indexed_shards(shard_sizes=(95, 40, 66))
+    texts = [text for text, _ in expected]
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    stream = reader.stream_data(num_proc=2, batch_size=16)
+    assert [next(stream) for _ in range(100)] == texts[:100]
+    state = reader.state_dict()
+    stream.close()
+    assert state["frame"] == 0 and state["record_in_frame"] == 5
+
+    reader.resume(state)
+    batches = reader.stream_batches(batch_size=30, num_proc=2)
+    assert next(batches) == texts[100:130]
+    state = reader.state_dict()
+    batches.close()
+
+    reader.resume(state)
+    assert sum(reader.stream_batches(batch_size=30), []) == texts[130:]
+
+    # the state belongs to other data
+    reader.resume(dict(state, file="data_0_other.jsonl.zst"))
+    with pytest.raises(ValueError):
+        list(reader.stream_data())
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,61 @@
+import random
+import sys
+import unicodedata
+
+from ko_lm_dataformat.sentence_cleaner import _is_control, clean_sentence, clean_sentences
+
+
+def reference_clean_sentence(sentence, remove_control=True):
+    """`clean_sentence` before the regex fast path"""
+    sentence = unicodedata.normalize("NFC", sentence)
+
+    if remove_control:
+        output = []
+        for char in sentence:
+            if _is_control(char) or ord(char) == 0xFFFD:
+                continue
+            output.append(char)
+
+        sentence = "".join(output)
+
+    return " ".join(sentence.strip().split())
+
+
+def random_sentences(num, seed=42):
+    rng = random.Random(seed)
+    pools = [
+        "abc ABC 123 .,!?",
+        "가나다라마바사 한국어 문장",
+        "\t\n\r\x00\x01\x0b\x0c\x1c\x1f\x7f\x85\xa0\u200b\u2028\u3000\ufeff\ufffd\ue000",
+        "ᄀ ᅡ ᆨ e\u0301 \u00e9 \u212b",  # NFC changes these
+        "😀 \U0001f1f0\U0001f1f7 \U000e0001 \U000f0000 \U0010fffd 𝕜",
+    ]
+    sentences = []
+    for _ in range(num):
+        chars = [rng.choice(rng.choice(pools)) for _ in range(rng.randint(0, 40))]
+        sentences.append("".join(chars))
+    return sentences
+
+
+def test_clean_sentence_same_as_reference():
+    for sentence in random_sentences(2000):
+        assert clean_sentence(sentence) == reference_clean_sentence(sentence)
+        assert clean_sentence(sentence, remove_control=False) == reference_clean_sentence(
+            sentence, remove_control=False
+        )
+
+
+def test_clean_sentence_every_bmp_char():
+    sentence = "".join(chr(cp) for cp in range(0x10000) if not 0xD800 <= cp <= 0xDFFF)
+    assert clean_sentence(sentence) == reference_clean_sentence(sentence)
+
+    sentence = "".join(chr(cp) for cp in range(0x10000, sys.maxunicode + 1, 97))
+    assert clean_sentence(sentence) == reference_clean_sentence(sentence)
+
+
+def test_clean_sentences():
+    sentences = random_sentences(500)
+    expected = [reference_clean_sentence(sentence) for sentence in sentences]
+
+    assert clean_sentences(sentences) == expected
+    assert clean_sentences(sentences, num_proc=2, chunksize=50) == expected
@@ -0,0 +1,94 @@
+import multiprocessing as mp
+import pickle
+import shutil
+from typing import List
+
+import pytest
+
+import ko_lm_dataformat as kldf
+from ko_lm_dataformat.sentence_cleaner import clean_sentence
+from ko_lm_dataformat.sentence_splitter import SentenceSplitterBase
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+class PeriodSentenceSplitter(SentenceSplitterBase):
+    """Splits on ". ", doesn't need kss"""
+
+    def split(self, document: str, clean_sent: bool = False) -> List[str]:
+        sentences = [sent + "." for sent in document.rstrip(".").split(". ")]
+        if clean_sent:
+            sentences = [clean_sentence(sent) for sent in sentences]
+        return sentences
+
+
+DOCUMENTS = [f"첫번째 문장 {i}. 두번째\t\t문장 {i}. 세번째 문장." for i in range(200)]
+
+
+def test_split_batch_keeps_order():
+    expected = [PeriodSentenceSplitter().split(doc, clean_sent=True) for doc in DOCUMENTS]
+
+    assert PeriodSentenceSplitter().split_batch(DOCUMENTS, clean_sent=True) == expected
+
+    splitter = PeriodSentenceSplitter(num_proc=2)
+    assert splitter.split_batch(DOCUMENTS, clean_sent=True, chunksize=7) == expected
+    # the pool is reused
+    pool = splitter._pool
+    assert splitter.split_batch(DOCUMENTS[:10], clean_sent=True) == expected[:10]
+    assert splitter._pool is pool
+    splitter.close()
+
+
+def test_splitter_pickle_without_pool():
+    splitter = PeriodSentenceSplitter(num_proc=2)
+    splitter.split_batch(DOCUMENTS[:4])
+
+    restored = pickle.loads(pickle.dumps(splitter))
+    assert restored._pool is None
+    assert restored.split(DOCUMENTS[0]) == splitter.split(DOCUMENTS[0])
+    splitter.close()
+
+
+def test_archive_add_data_batch():
+    remove_tmp_dir()
+    children = set(mp.active_children())
+    splitter = PeriodSentenceSplitter(num_proc=2)
+    archive = kldf.Archive(TMP_DIR_NAME, sentence_splitter=splitter)
+    metas = [{"i": i} for i in range(len(DOCUMENTS))]
+    archive.add_data_batch(DOCUMENTS, metas=metas, split_sent=True, clean_sent=True)
+    archive.commit()
+    assert len(set(mp.active_children()) - children) == 2
+    archive.close()
+    # the archive stops the splitter's workers
+    assert set(mp.active_children()) <= children
+
+    data = list(kldf.Reader(TMP_DIR_NAME).stream_data(get_meta=True))
+    assert data == [(splitter.split(doc, clean_sent=True), meta) for doc, meta in zip(DOCUMENTS, metas)]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dat_json_archive_split_sent():
+    remove_tmp_dir()
+    children = set(mp.active_children())
+    splitter = PeriodSentenceSplitter(num_proc=2)
+    archive = kldf.JSONArchive(TMP_DIR_NAME, sentence_splitter=splitter)
+    archive.add_data_batch(DOCUMENTS[:10], split_sent=True, clean_sent=True)
+    archive.add_data(DOCUMENTS[10], split_sent=True)
+    archive.commit()
+    archive.close()
+    assert set(mp.active_children()) <= children
+
+    # one record per document, holding its sentences
+    reader = kldf.Reader(TMP_DIR_NAME)
+    expected = [splitter.split(doc, clean_sent=True) for doc in DOCUMENTS[:10]] + [splitter.split(DOCUMENTS[10])]
+    assert list(reader.stream_data()) == expected
+    assert list(reader.stream_data(autojoin_sentences=True)) == [" ".join(sents) for sents in expected]
+    shutil.rmtree(TMP_DIR_NAME)
+
+    archive = kldf.DatArchive(TMP_DIR_NAME, sentence_splitter=splitter)
+    with pytest.raises(ValueError):
+        archive.add_data_batch(DOCUMENTS[:10], split_sent=True)
+    with pytest.raises(ValueError):
+        archive.add_data(DOCUMENTS[0], split_sent=True)
+    archive.close()
+    shutil.rmtree(TMP_DIR_NAME)
@@ -0,0 +1,77 @@
+import random
+import shutil
+
+import pytest
+
+import ko_lm_dataformat as kldf
+from ko_lm_dataformat.shuffle import interleave_streams, shuffle_buffer
+
+from .testing_utils import TMP_DIR_NAME, remove_tmp_dir
+
+
+def test_shuffle_buffer():
+    items = list(range(1000))
+
+    shuffled = list(shuffle_buffer(items, 100, random.Random(0)))
+    assert sorted(shuffled) == items
+    assert shuffled != items
+    assert shuffled == list(shuffle_buffer(items, 100, random.Random(0)))
+
+    # an item can't move earlier than `buffer_size` positions before its index
+    assert all(pos >= item - 100 for pos, item in enumerate(shuffled))
+
+    assert sorted(shuffle_buffer(items[:10], 100, random.Random(0))) == items[:10]
+    assert list(shuffle_buffer([], 100, random.Random(0))) == []
+    with pytest.raises(ValueError):
+        list(shuffle_buffer(items, 0, random.Random(0)))
+
+
+def test_interleave_streams():
+    opened = []
+
+    def streams():
+        for i in range(5):
+            opened.append(i)
+            yield [(i, j) for j in range(i * 10)]
+
+    mixed = interleave_streams(streams(), 2, random.Random(0))
+    first = [next(mixed) for _ in range(5)]
+    # only the first two streams are open, and the empty one is already replaced
+    assert {i for i, _ in first} <= {1, 2}
+    assert opened == [0, 1, 2]
+
+    mixed = list(first) + list(mixed)
+    assert sorted(mixed) == [(i, j) for i in range(5) for j in range(i * 10)]
+    # each stream keeps its own order
+    for i in range(5):
+        assert [j for k, j in mixed if k == i] == list(range(i * 10))
+
+
+def write_shards(num_shards=4, docs_per_shard=200):
+    remove_tmp_dir()
+    archive = kldf.Archive(TMP_DIR_NAME)
+    for shard_idx in range(num_shards):
+        for doc_idx in range(docs_per_shard):
+            archive.add_data(f"문서 {shard_idx}-{doc_idx}", meta={"doc": doc_idx})
+        archive.commit(archive_name=f"shard{shard_idx}")
+    archive.compressor.close()
+    archive.fh.close()
+
+
+def test_stream_shuffled():
+    write_shards()
+    ordered = list(kldf.Reader(TMP_DIR_NAME).stream_data(get_meta=True))
+
+    reader = kldf.Reader(TMP_DIR_NAME, seed=3)
+    shuffled = list(reader.stream_shuffled(get_meta=True, buffer_size=50, interleave=2))
+    assert shuffled != ordered
+    assert sorted(shuffled, key=str) == sorted(ordered, key=str)
+    assert shuffled == list(
+        kldf.Reader(TMP_DIR_NAME, seed=3).stream_shuffled(get_meta=True, buffer_size=50, interleave=2)
+    )
+
+    reader.set_epoch(1)
+    assert list(reader.stream_shuffled(get_meta=True, buffer_size=50, interleave=2)) != shuffled
+
+    assert sorted(kldf.Reader(TMP_DIR_NAME).stream_shuffled(buffer_size=1)) == sorted(text for text, _ in ordered)
+    shutil.rmtree(TMP_DIR_NAME)
@@ -1,5 +1,13 @@
+import gzip
 import hashlib
+import os
 import shutil
+import tarfile
+from glob import glob
+
+import pytest
+import ujson
+import zstandard
 
 import ko_lm_dataformat as kldf
 
@@ -192,3 +200,204 @@ def test_tarfile_reader():
         ]
 
         assert all(map(lambda x: x[0] == x[1], zip(hashes, expected)))
+
+
+def test_dat_v1_compat():
+    remove_tmp_dir()
+    archive = kldf.DatArchive(TMP_DIR_NAME, format_version=1)
+    archive.add_data("testing 123")
+    archive.add_data("")
+    archive.add_data("한국어 문장")
+    archive.commit()
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    assert list(reader.stream_data()) == ["testing 123", "", "한국어 문장"]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_dat_memoryview_and_cache():
+    remove_tmp_dir()
+    archive = kldf.DatArchive(TMP_DIR_NAME, format_version=2)
+    texts = ["testing 123", "", "한국어 문장", "x" * 1000]
+    for text in texts:
+        archive.add_data(text)
+    archive.commit()
+
+    reader = kldf.Reader(TMP_DIR_NAME)
+    (file,) = glob(os.path.join(TMP_DIR_NAME, "data_*.zst"))
+    views = list(reader.read_dat(file, as_memoryview=True))
+    assert [bytes(view).decode("utf-8") for view in views] == texts
+
+    cache_dir = os.path.join(TMP_DIR_NAME + "_cache")
+    reader = kldf.Reader(TMP_DIR_NAME, dat_cache_dir=cache_dir)
+    assert list(reader.stream_data()) == texts
+    assert len(os.listdir(cache_dir)) == 1
+    # second read goes through the cached file
+    assert list(reader.stream_data()) == texts
+    views = list(reader.read_dat(file, as_memoryview=True))
+    assert [bytes(view).decode("utf-8") for view in views] == texts
+
+    stream = reader.stream_data()
+    assert next(stream) == texts[0]
+    stream.close()
+
+    shutil.rmtree(cache_dir)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_json_same_bytes():
+    remove_tmp_dir()
+    archive = kldf.JSONArchive(TMP_DIR_NAME)
+    data = ["testing 123", ["a", "b"], {"text": "한국어"}, ""]
+    for x in data:
+        archive.add_data(x)
+    archive.commit()
+
+    (file,) = glob(os.path.join(TMP_DIR_NAME, "data_*.zst"))
+    with open(file, "rb") as fh:
+        raw = zstandard.ZstdDecompressor().stream_reader(fh).read()
+    assert raw == ujson.dumps(data).encode("UTF-8")
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_auto_commit():
+    remove_tmp_dir()
+    texts = [f"testing {i}" for i in range(25)]
+
+    archive = kldf.DatArchive(TMP_DIR_NAME, max_shard_records=10)
+    for text in texts:
+        archive.add_data(text)
+    archive.commit()
+    assert len(glob(os.path.join(TMP_DIR_NAME, "data_*.zst"))) == 3
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == texts
+    shutil.rmtree(TMP_DIR_NAME)
+
+    archive = kldf.JSONArchive(TMP_DIR_NAME, max_shard_bytes=50)
+    for text in texts:
+        archive.add_data(text)
+    archive.commit()
+    assert len(glob(os.path.join(TMP_DIR_NAME, "data_*.zst"))) > 3
+    assert list(kldf.Reader(TMP_DIR_NAME).stream_data()) == texts
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+@pytest.mark.parametrize("archive_cls", [kldf.DatArchive, kldf.JSONArchive])
+def test_close(archive_cls):
+    remove_tmp_dir()
+    archive = archive_cls(TMP_DIR_NAME, max_shard_records=10)
+    for i in range(20):
+        archive.add_data(f"testing {i}")
+    # the last commit left no open chunk
+    archive.close()
+    assert not [name for name in os.listdir(TMP_DIR_NAME) if "incomplete" in name]
+
+    archive = archive_cls(TMP_DIR_NAME)
+    archive.add_data("testing")
+    archive.close()
+    assert archive.fh is None and archive.compressor is None
+    assert len([name for name in os.listdir(TMP_DIR_NAME) if "incomplete" in name]) == 1
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def write_nested_tarball(tar_path, mode):
+    """Tarball holding an archive's `.jsonl.zst` shard and a plain text file"""
+    archive = kldf.Archive(TMP_DIR_NAME)
+    expected = []
+    for i in range(100):
+        archive.add_data(f"문서 {i}", meta={"doc": i})
+        expected.append((f"문서 {i}", {"doc": i}))
+    archive.commit()
+    archive.compressor.close()
+    archive.fh.close()
+    shard = os.path.basename(glob(os.path.join(TMP_DIR_NAME, "data_*.jsonl.zst"))[0])
+
+    fileobj = open(tar_path, "wb")
+    if mode == "zst":
+        fileobj = zstandard.ZstdCompressor().stream_writer(fileobj)
+    with tarfile.open(fileobj=fileobj, mode="w:gz" if mode == "gz" else "w|", format=tarfile.PAX_FORMAT) as tar:
+        tar.add(os.path.join(TMP_DIR_NAME, shard), arcname="a" * 150 + "/" + shard)
+        tar.add(get_tests_dir(append_path="assets/blns.txt"), arcname="blns.txt")
+    fileobj.close()
+    return shard, expected
+
+
+@pytest.mark.parametrize("mode", ["gz", "zst"])
+def test_nested_tarball_read(mode):
+    remove_tmp_dir()
+    tar_path = TMP_DIR_NAME + ("_nested.tar.gz" if mode == "gz" else "_nested.tar.zst")
+    shard, expected = write_nested_tarball(tar_path, mode)
+    with open(get_tests_dir(append_path="assets/blns.txt"), encoding="utf-8") as f:
+        blns = f.read()
+
+    data = list(kldf.Reader(tar_path).stream_data())
+    assert data == [text for text, _ in expected] + [blns]
+
+    opener = gzip.open if mode == "gz" else lambda p: zstandard.ZstdDecompressor().stream_reader(open(p, "rb"))
+    with opener(tar_path) as fh:
+        members = list(kldf.iter_tar_members(fh))
+    assert [m.name for m in members] == ["a" * 150 + "/" + shard, "blns.txt"]
+    assert members[1].size == len(blns.encode("utf-8"))
+
+    os.remove(tar_path)
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_tarball_plain_jsonl_member():
+    remove_tmp_dir()
+    os.makedirs(TMP_DIR_NAME)
+    jsonl_path = os.path.join(TMP_DIR_NAME, "docs.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        f.write('{"text": "문서 1"}\n{"text": "문서 2"}\n')
+    tar_path = os.path.join(TMP_DIR_NAME, "plain.tar.gz")
+    with tarfile.open(tar_path, "w:gz") as tar:
+        tar.add(jsonl_path, arcname="docs.jsonl")
+
+    # only archive shards are split into records, a plain member is one document
+    with open(jsonl_path, encoding="utf-8") as f:
+        assert list(kldf.Reader(tar_path).stream_data()) == [f.read()]
+    shutil.rmtree(TMP_DIR_NAME)
+
+
+def test_tar_member_partial_read():
+    with open(get_tests_dir(append_path="assets/testtarfile.tar"), "rb") as f:
+        full = [m.read() for m in kldf.iter_tar_members(f)]
+        f.seek(0)
+        # members left half read are skipped
+        partial = [m.read(10) for m in kldf.iter_tar_members(f)]
+
+    assert partial == [data[:10] for data in full]
+    assert [sha256str(data) for data in full] == [
+        "782588d891b1a836fcbd0bcd43227f83bf066d90245dd91d061f1b2c0e72fc9d",
+        "dc666c65cd421c688ed8542223c24d9e4a2e5276944f1e7cc296d43a57245498",
+        "c38af4ad8a9b901ea75d7cf60d452a233949f9e88b5fea04f80acde29d513d3e",
+        "fb3ecc0ad0b851dd3e9f0955805530b4946080f6e2a8e6aa0f67ba8209c2f779",
+    ]
+
+
+def test_tar_member_table():
+    with open(get_tests_dir(append_path="assets/testtarfile.tar"), "rb") as f:
+        table = kldf.list_tar_members(f)
+        f.seek(0)
+        members = list(kldf.tarfile_reader(f, streaming=True))
+
+        assert [entry.name for entry in table] == ["testdir/1.txt", "testdir/4.txt", "testdir/3.txt", "testdir/2.txt"]
+        # one mapping shared by every member
+        assert len({id(m.data.obj) for m in members}) == 1
+        for entry, member in zip(table, members):
+            assert (member.offset, member.size) == (entry.offset, entry.size)
+            f.seek(entry.offset)
+            assert bytes(member.data) == f.read(entry.size)
+            assert member.read(5) + member.read() == bytes(member.data)
+            member.close()
+
+
+def test_jsonl_tar_parallel():
+    reader = kldf.Reader(get_tests_dir(append_path="assets/blns.jsonl.zst.tar"))
+    expected = list(reader.stream_data(get_meta=True))
+
+    # members of a single tar are spread across the workers
+    assert len(reader._get_tasks()) == 2
+    assert list(reader.stream_data(get_meta=True, num_proc=2)) == expected
+    assert (
+        list(reader.read_jsonl_tar(reader.in_path, get_meta=True, autojoin_sentences=False, member=1)) == expected[4:]
+    )